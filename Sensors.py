@@ -7,15 +7,34 @@ import logging
 import logging.handlers
 
 from lib.gas_sensor import GasSensor
+from lib.gas_sampler import GasSampler
 from lib.light_sensor import LightSensor, LightSensorResult
+from lib.light_monitor import LightStateMonitor
 import lib.temp_probe as temp_probe
 from lib.recurring_task import RecurringTask
+from lib.sensor_history import SensorHistory
+from lib.sensor_guard import SensorWorker
 
 DEFAULT_SENSOR_LOG = 'sensors.log'
 DEFAULT_LIGHT_SENSOR_UPDATE_INTERVAL = 30
+# With the INT pin wired the sensor tells us when the lights
+# change, so it is only read now and then for the history.
+DEFAULT_LIGHT_SENSOR_INTERRUPT_UPDATE_INTERVAL = 600
 DEFAULT_GAS_SENSOR_UPDATE_INTERVAL = 60
 DEFAULT_TEMPERATURE_SENSOR_UPDATE_INTEVAL = 120
 
+# How long a read may take before it counts as hung.
+DEFAULT_GAS_READ_DEADLINE = 1.0
+DEFAULT_LIGHT_READ_DEADLINE = 3.0  # three reads at the longest integration
+DEFAULT_TEMPERATURE_READ_DEADLINE = 5.0
+
+GAS_CHANNEL = "GAS"
+GAS_RAW_CHANNEL = "GAS_RAW"
+LIGHT_CHANNEL = "LUX"
+INFRARED_CHANNEL = "IR"
+FULL_SPECTRUM_CHANNEL = "FULL"
+TEMPERATURE_CHANNEL = "TEMP"
+
 
 class Sensors(object):
     """
@@ -33,16 +52,46 @@ class Sensors(object):
         self.__logger__.addHandler(self.__handler__)
 
         self.__gas_sensor__ = None
+        self.__gas_sampler__ = None
         self.__light_sensor__ = None
 
         self.current_gas_sensor_reading = None
         self.current_light_sensor_reading = None
         self.current_temperature_sensor_reading = None
 
-        self.__light_sensor__ = LightSensor()
+        # Recent history of each sensor, for trends.
+        self.history = SensorHistory()
+        self.__reading_listeners__ = []
+        self.__gas_detection_listeners__ = []
+        self.__light_state_listeners__ = []
+
+        # Each sensor is read on its own worker, so a hung bus
+        # only stops the sensor that is on it.
+        self.__gas_worker__ = SensorWorker("GAS", DEFAULT_GAS_READ_DEADLINE)
+        self.__light_worker__ = SensorWorker("LIGHT", DEFAULT_LIGHT_READ_DEADLINE)
+        self.__temperature_worker__ = SensorWorker("TEMP",
+                                                   DEFAULT_TEMPERATURE_READ_DEADLINE)
+        self.__sensor_workers__ = []
+
+        self.__light_sensor__ = LightSensor(
+            auto_range=configuration.is_light_auto_range_enabled)
+        self.__light_monitor__ = LightStateMonitor(self.__light_sensor__,
+                                                   configuration.hangar_dark,
+                                                   configuration.hangar_lit,
+                                                   self.__light_state_changed__)
 
         if self.__light_sensor__.enabled:
-            RecurringTask("__update_light_sensor__", DEFAULT_LIGHT_SENSOR_UPDATE_INTERVAL,
+            light_update_interval = DEFAULT_LIGHT_SENSOR_UPDATE_INTERVAL
+
+            if configuration.light_sensor_interrupt_pin > 0 \
+                    and self.__light_monitor__.start_interrupts(
+                            configuration.light_sensor_interrupt_pin,
+                            self.__update_light_sensor__):
+                light_update_interval = DEFAULT_LIGHT_SENSOR_INTERRUPT_UPDATE_INTERVAL
+
+            self.__sensor_workers__.append(self.__light_worker__)
+            self.history.add_channel(LIGHT_CHANNEL, light_update_interval)
+            RecurringTask("__update_light_sensor__", light_update_interval,
                           self.__update_light_sensor__, self.__logger__)
 
         if configuration.is_mq2_enabled:
@@ -50,24 +99,180 @@ class Sensors(object):
 
             if self.__gas_sensor__ is not None and \
                     self.__gas_sensor__.enabled:
+                self.__gas_sampler__ = GasSampler(self.__gas_sensor__,
+                                                  configuration.gas_sample_hz,
+                                                  configuration.gas_median_window,
+                                                  configuration.gas_ewma_alpha,
+                                                  self.__gas_detection_changed__,
+                                                  sensor_worker=self.__gas_worker__)
+                self.__gas_sampler__.start(self.__logger__)
+                self.__sensor_workers__.append(self.__gas_worker__)
+                self.history.add_channel(GAS_CHANNEL,
+                                         DEFAULT_GAS_SENSOR_UPDATE_INTERVAL)
                 RecurringTask("__update_gas_sensor__", DEFAULT_GAS_SENSOR_UPDATE_INTERVAL,
                               self.__update_gas_sensor__, self.__logger__)
 
+        self.__temperature_probes__ = temp_probe.TemperatureProbes(
+            default_resolution=configuration.temp_probe_resolution,
+            resolutions=configuration.temp_probe_resolutions)
+        self.__probe_registry__ = temp_probe.ProbeRegistry(
+            [(probe_definition.name, probe_definition.probe_id)
+             for probe_definition in configuration.temp_probe_definitions])
+
+        # Temperature, in F, of each probe that was read, by probe name.
+        self.current_temperature_readings = []
+
         if configuration.is_temp_probe_enabled:
+            self.__sensor_workers__.append(self.__temperature_worker__)
+            self.history.add_channel(TEMPERATURE_CHANNEL,
+                                     DEFAULT_TEMPERATURE_SENSOR_UPDATE_INTEVAL)
             RecurringTask("__update_temperature_sensor__",
                           DEFAULT_TEMPERATURE_SENSOR_UPDATE_INTEVAL,
                           self.__update_temperature_sensor__, self.__logger__)
 
+    def add_reading_listener(self, reading_listener):
+        """
+        Adds a function that is called with (channel name, value)
+        every time a sensor is read.
+        """
+
+        self.__reading_listeners__.append(reading_listener)
+
+    def add_gas_detection_listener(self, gas_detection_listener):
+        """
+        Adds a function that is called with the GasSensorResult
+        as soon as gas is detected, or has cleared.
+        """
+
+        self.__gas_detection_listeners__.append(gas_detection_listener)
+
+    def add_light_state_listener(self, light_state_listener):
+        """
+        Adds a function that is called with (is_lit, LightSensorResult)
+        as soon as the hangar lights go on or off.
+        """
+
+        self.__light_state_listeners__.append(light_state_listener)
+
+    def is_hangar_lit(self):
+        """
+        Returns True if the lights are on, or None before
+        the first reading.
+        """
+
+        return self.__light_monitor__.is_lit
+
+    def get_temperature_reading(self, name):
+        """
+        Returns the (name, F) of the probe with the name or
+        serial, or None if it was not read.
+        """
+
+        probe_id = self.__probe_registry__.find_id(
+            name, self.__temperature_probes__.get_probe_ids())
+
+        if probe_id is None:
+            return None
+
+        probe_name = self.__probe_registry__.get_name(probe_id)
+
+        for reading in self.current_temperature_readings:
+            if reading[0] == probe_name:
+                return reading
+
+        return None
+
+    def get_breaker_status_text(self):
+        """
+        Returns the circuit breaker state of each sensor,
+        ie "LUX=OK GAS=OPEN(3 fails, deadline, retry 4s)"
+        """
+
+        return " ".join([sensor_worker.get_status_text()
+                         for sensor_worker in self.__sensor_workers__])
+
+    def get_gas_sampler(self):
+        """
+        Returns the GasSampler, which has the recent raw and
+        filtered gas series, or None if there is no gas sensor.
+        """
+
+        return self.__gas_sampler__
+
+    def __gas_detection_changed__(self, gas_sensor_result):
+        """
+        Called by the sampler the moment the filtered
+        level crosses a threshold.
+        """
+
+        self.current_gas_sensor_reading = gas_sensor_result
+
+        for gas_detection_listener in self.__gas_detection_listeners__:
+            gas_detection_listener(gas_sensor_result)
+
+    def __light_state_changed__(self, is_lit, light_sensor_result):
+        """
+        Called by the monitor when the lights go on or off.
+        """
+
+        self.__logger__.info(", LIGHTS, Lit=" + str(is_lit)
+                             + ", Lux=" + str(int(light_sensor_result.lux)))
+
+        for light_state_listener in self.__light_state_listeners__:
+            light_state_listener(is_lit, light_sensor_result)
+
+    def __record__(self, channel_name, value):
+        """
+        Adds the reading to the history and tells the listeners.
+        """
+
+        if self.history.get_channel(channel_name) is not None:
+            self.history.add(channel_name, value)
+
+        for reading_listener in self.__reading_listeners__:
+            reading_listener(channel_name, value)
+
     def __update_light_sensor__(self):
         """
-        Reads the light sensor and saves the result.
+        Has the light sensor read on its worker, and the result
+        saved. Called by the scheduler and from the INT pin.
         """
 
-        self.current_light_sensor_reading = LightSensorResult(
-            self.__light_sensor__)
-        self.__logger__.info(", LIGHT, Lux=" + str(int(self.current_light_sensor_reading.lux)) \
-                             + ", VIS=" + str(self.current_light_sensor_reading.full_spectrum) \
-                             + ", IR=" + str(self.current_light_sensor_reading.infrared))
+        self.__light_worker__.submit(self.__read_light_sensor__,
+                                     self.__light_reading_taken__)
+
+    def __read_light_sensor__(self):
+        """
+        Reads the light sensor, on its worker.
+        Returns None if the read failed.
+        """
+
+        light_sensor_result = LightSensorResult(self.__light_sensor__)
+
+        if not light_sensor_result.enabled:
+            return None
+
+        return light_sensor_result
+
+    def __light_reading_taken__(self, light_sensor_result):
+        """
+        Saves a light sensor reading, from the scheduler or
+        from the INT pin, and checks it for a light change.
+        """
+
+        self.current_light_sensor_reading = light_sensor_result
+
+        if light_sensor_result.enabled:
+            self.__record__(LIGHT_CHANNEL, light_sensor_result.lux)
+            self.__record__(INFRARED_CHANNEL, light_sensor_result.infrared)
+            self.__record__(FULL_SPECTRUM_CHANNEL,
+                            light_sensor_result.full_spectrum)
+        self.__logger__.info(", LIGHT, Lux=" + str(round(light_sensor_result.lux, 3)) \
+                             + ", VIS=" + str(light_sensor_result.full_spectrum) \
+                             + ", IR=" + str(light_sensor_result.infrared) \
+                             + ", Range=" + str(light_sensor_result.range_text))
+
+        self.__light_monitor__.update(light_sensor_result)
 
     def __update_gas_sensor__(self):
         """
@@ -78,23 +283,85 @@ class Sensors(object):
             self.current_gas_sensor_reading = None
             return
 
-        self.current_gas_sensor_reading = self.__gas_sensor__.update()
+        # Do not record a stale reading while the sensor is failing
+        if not self.__gas_worker__.is_healthy():
+            return
+
+        self.current_gas_sensor_reading = self.__gas_sampler__.current_result
 
         if self.current_gas_sensor_reading is not None:
+            raw_value = self.__gas_sampler__.get_latest_raw_value()
+            self.__record__(GAS_CHANNEL,
+                            self.current_gas_sensor_reading.current_value)
+            self.__record__(GAS_RAW_CHANNEL, raw_value)
             self.__logger__.info(", GAS, Level=" + str(self.current_gas_sensor_reading.current_value) \
-                                 + ", Detected=" + str(self.current_gas_sensor_reading.is_gas_detected))
+                                 + ", Detected=" + str(self.current_gas_sensor_reading.is_gas_detected) \
+                                 + ", Raw=" + str(int(raw_value)))
 
     def __update_temperature_sensor__(self):
         """
-        Reads the temperature senso and keep the results.
+        Reads every temperature probe and keeps the results.
+        The primary probe is also "the temperature".
         """
 
-        sensor_readings = temp_probe.read_sensors()
-        if sensor_readings is not None:
-            results_count = len(sensor_readings)
-            if results_count > 0:
-                self.current_temperature_sensor_reading = int(
-                    sensor_readings[0])
-                self.__logger__.info(", TEMP, F=" + str(self.current_temperature_sensor_reading))
-            else:
-                self.current_temperature_sensor_reading = None
+        self.__temperature_worker__.submit(self.__read_temperature_probes__,
+                                           self.__temperature_probes_read__)
+
+    def __read_temperature_probes__(self):
+        """
+        Reads the probes, on their worker. Returns None
+        if there are probes but none could be read.
+        """
+
+        temperatures = self.__temperature_probes__.read_probes()
+
+        if temperatures and all([temperature is None
+                                 for temperature in temperatures.values()]):
+            return None
+
+        return temperatures
+
+    def __temperature_probes_read__(self, temperatures):
+        """
+        Keeps the temperature of each probe.
+        """
+
+        probe_ids = [probe_id for probe_id in temperatures
+                     if temperatures[probe_id] is not None]
+        primary_id = self.__probe_registry__.get_primary_id(probe_ids)
+        readings = []
+
+        for probe_id in self.__probe_registry__.get_ordered_ids(probe_ids):
+            name = self.__probe_registry__.get_name(probe_id)
+            fahrenheit = temp_probe.celcius_to_farenheit(temperatures[probe_id])
+            channel_name = get_temperature_channel_name(name)
+
+            self.history.add_channel(channel_name,
+                                     DEFAULT_TEMPERATURE_SENSOR_UPDATE_INTEVAL)
+            self.__record__(channel_name, fahrenheit)
+            readings.append((name, fahrenheit))
+
+        self.current_temperature_readings = readings
+
+        if primary_id is None:
+            self.current_temperature_sensor_reading = None
+            return
+
+        self.current_temperature_sensor_reading = temp_probe.celcius_to_farenheit(
+            temperatures[primary_id])
+        self.__record__(TEMPERATURE_CHANNEL,
+                        self.current_temperature_sensor_reading)
+        self.__logger__.info(", TEMP, F=" + str(self.current_temperature_sensor_reading)
+                             + "".join([", " + name + "=" + str(fahrenheit)
+                                        for name, fahrenheit in readings]))
+
+
+def get_temperature_channel_name(probe_name):
+    """
+    Returns the history channel of a probe.
+
+    >>> get_temperature_channel_name("Engine bay")
+    'TEMP_ENGINE_BAY'
+    """
+
+    return TEMPERATURE_CHANNEL + "_" + "_".join(probe_name.upper().split())
@@ -0,0 +1,37 @@
+"""
+Offline report over the logs and history copied off a HangarBuddy.
+
+Requires NumPy. Run on a laptop, from the root of the repository:
+    python analyze_sensors.py sensors.log [--heater hangar_buddy.log]
+                              [--history history/raw] [--utc-offset 8]
+"""
+
+import argparse
+
+import lib.sensor_analytics as sensor_analytics
+import lib.sensor_log_import as sensor_log_import
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(
+        description="Summarize the sensor history of a HangarBuddy.")
+    PARSER.add_argument("sensor_logs", nargs="*",
+                        help="sensors.log files. Rotated copies are included.")
+    PARSER.add_argument("--heater", action="append", default=[],
+                        help="hangar_buddy.log files, for the heater runs.")
+    PARSER.add_argument("--history", action="append", default=[],
+                        help="Raw history directories.")
+    PARSER.add_argument("--utc-offset", type=int, default=0,
+                        help="Hours local time is behind UTC (UTC_OFFSET).")
+    PARSER.add_argument("--lit", type=float,
+                        default=sensor_analytics.DEFAULT_LIT_THRESHOLD,
+                        help="Lux above which the lights are on.")
+    ARGUMENTS = PARSER.parse_args()
+
+    SENSOR_DATA = sensor_log_import.import_sensor_logs(ARGUMENTS.sensor_logs)
+    sensor_log_import.import_heater_logs(ARGUMENTS.heater, SENSOR_DATA)
+
+    for directory in ARGUMENTS.history:
+        sensor_log_import.import_series_store(directory, ARGUMENTS.utc_offset,
+                                              SENSOR_DATA)
+
+    print sensor_analytics.get_report_text(SENSOR_DATA, ARGUMENTS.lit)
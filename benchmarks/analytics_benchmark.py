@@ -0,0 +1,79 @@
+"""
+Benchmark of importing and analyzing a year of sensors.log.
+
+Writes a synthetic year of one-minute light, gas and temperature
+lines (about 1.5 million lines), then times the import and the
+report.
+
+Requires NumPy. Run from the root of the repository:
+    python benchmarks/analytics_benchmark.py
+"""
+
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import lib.sensor_analytics as sensor_analytics
+import lib.sensor_log_import as sensor_log_import
+
+DAYS = 365
+START_TIME = 1483228800  # 2017-01-01
+
+
+def write_log(path):
+    """
+    Writes a year of sensors.log lines, one file per month like
+    a rotated log would be.
+    """
+
+    for month in range(12):
+        lines = []
+        first_minute = month * DAYS * 24 * 60 / 12
+        last_minute = (month + 1) * DAYS * 24 * 60 / 12
+
+        for minute in xrange(first_minute, last_minute):
+            timestamp = time.strftime("%Y-%m-%d %H:%M:%S",
+                                      time.gmtime(START_TIME + minute * 60)) + ",000"
+            hour = (minute / 60) % 24
+            lux = 200 if 8 <= hour < 17 else 0
+            fahrenheit = int(40 + 15 * math.sin(2 * math.pi * (minute % 1440) / 1440.0))
+
+            lines.append(timestamp + " INFO     , LIGHT, Lux=" + str(lux)
+                         + ", VIS=" + str(lux * 3) + ", IR=" + str(lux / 4))
+            lines.append(timestamp + " INFO     , GAS, Level=" + str(50 + minute % 7)
+                         + ", Detected=False")
+            lines.append(timestamp + " INFO     , TEMP, F=" + str(fahrenheit))
+
+        suffix = "" if month == 11 else "." + str(11 - month)
+        with open(path + suffix, "w") as log_file:
+            log_file.write("\n".join(lines) + "\n")
+
+
+if __name__ == '__main__':
+    DIRECTORY = tempfile.mkdtemp()
+    LOG_PATH = os.path.join(DIRECTORY, "sensors.log")
+
+    try:
+        write_log(LOG_PATH)
+        SIZE = sum([os.path.getsize(path)
+                    for path in sensor_log_import.get_log_files(LOG_PATH)])
+
+        START = time.time()
+        SENSOR_DATA = sensor_log_import.import_sensor_logs([LOG_PATH])
+        IMPORTED = time.time()
+        REPORT = sensor_analytics.get_report_text(SENSOR_DATA)
+        FINISHED = time.time()
+
+        print "log size (MB):      " + str(round(SIZE / 1048576.0, 1))
+        print "samples imported:   " + str(sum([
+            len(SENSOR_DATA.get(name)[0]) for name in SENSOR_DATA.get_channel_names()]))
+        print "import (s):         " + str(round(IMPORTED - START, 2))
+        print "analytics (s):      " + str(round(FINISHED - IMPORTED, 2))
+        print "report lines:       " + str(len(REPORT.split("\n")))
+    finally:
+        shutil.rmtree(DIRECTORY)
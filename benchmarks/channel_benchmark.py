@@ -0,0 +1,102 @@
+"""
+Benchmark of multiprocessing.Queue against lib.channel.Channel
+for passing items between threads of one process.
+
+Reports the enqueue->dequeue latency between two threads,
+and the thread and file descriptor count of the process after
+creating the five queues HangarBuddy uses.
+
+Run from the root of the repository:
+    python benchmarks/channel_benchmark.py
+"""
+
+import os
+import sys
+import threading
+import time
+from multiprocessing import Queue as MPQueue
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lib.channel import Channel
+
+NUMBER_OF_QUEUES = 5
+NUMBER_OF_ITEMS = 5000
+
+
+def get_open_file_count():
+    """
+    Returns the number of open file descriptors, or None
+    if /proc is not available.
+    """
+
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+
+def measure_latency(queue, number_of_items):
+    """
+    Sends timestamps from a producer thread, one at a time, and
+    returns the sorted list of how long each one took to arrive.
+    """
+
+    latencies = []
+    received = threading.Event()
+
+    def consume():
+        for _ in range(number_of_items):
+            sent_time = queue.get()
+            latencies.append(time.time() - sent_time)
+            received.set()
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+
+    for _ in range(number_of_items):
+        received.clear()
+        queue.put(time.time())
+        received.wait()
+
+    consumer.join()
+
+    return sorted(latencies)
+
+
+def run_benchmark(queue_name, queue_factory):
+    """
+    Creates the queues, pushes an item through each so
+    any helper threads start, then measures the latency.
+    """
+
+    threads_before = threading.active_count()
+    files_before = get_open_file_count()
+
+    queues = [queue_factory() for _ in range(NUMBER_OF_QUEUES)]
+    for queue in queues:
+        queue.put(0)
+        queue.get()
+
+    threads_added = threading.active_count() - threads_before
+    files_after = get_open_file_count()
+    files_added = None if files_before is None else files_after - files_before
+
+    start_time = time.time()
+    latencies = measure_latency(queues[0], NUMBER_OF_ITEMS)
+    elapsed = time.time() - start_time
+
+    print queue_name
+    print "  threads added:      " + str(threads_added)
+    print "  file descriptors:   " + str(files_added)
+    print "  round trips/second: " + str(int(NUMBER_OF_ITEMS / elapsed))
+    print "  latency p50 (us):   " + str(int(latencies[len(latencies) / 2] * 1000000))
+    print "  latency p99 (us):   " + \
+        str(int(latencies[int(len(latencies) * 0.99)] * 1000000))
+
+    return queues
+
+
+if __name__ == '__main__':
+    run_benchmark("lib.channel.Channel", Channel)
+    run_benchmark("multiprocessing.Queue", MPQueue)
@@ -0,0 +1,171 @@
+"""
+Benchmark of gas detection with and without the median/EWMA filter.
+
+Replays a trace of raw gas readings through lib.gas_sampler and
+reports, for each filter setting, how many alarms were raised
+outside of a real leak (false positives) and how long after the
+leak crossed the trigger level it was detected.
+
+By default a synthetic 4Hz trace is used: a noisy baseline with
+single sample spikes, and a few slow leaks. A recorded trace can be
+given instead, one raw reading per line, with the samples that are
+real leaks marked by a trailing "*":
+    python benchmarks/gas_filter_benchmark.py [trace.txt] [sample_hz]
+
+Run from the root of the repository, on the Pi or on
+a Mac/Windows machine (where the sensor is simulated).
+"""
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import lib.gas_sampler as gas_sampler
+from lib.gas_sensor import DEFAULT_TRIGGER_THRESHOLD
+
+SAMPLE_HZ = 4
+TRACE_HOURS = 6
+SPIKE_PROBABILITY = 0.002
+LEAK_STARTS_HOURS = [1, 3, 5]
+LEAK_RAMP_SECONDS = 120
+LEAK_HOLD_SECONDS = 300
+
+FILTER_SETTINGS = [(1, 1.0), (3, 1.0), (5, 1.0), (5, 0.5), (5, 0.3), (9, 0.2)]
+
+
+def get_synthetic_trace(sample_hz):
+    """
+    Returns (raw values, is_leak flags) for a noisy baseline with
+    single sample spikes, and slow leaks that rise past the trigger.
+    """
+
+    random.seed(1234)
+    raw_values = []
+    is_leak = []
+    leak_starts = [hours * 60 * 60 * sample_hz for hours in LEAK_STARTS_HOURS]
+    ramp_samples = LEAK_RAMP_SECONDS * sample_hz
+    hold_samples = LEAK_HOLD_SECONDS * sample_hz
+
+    for sample in xrange(TRACE_HOURS * 60 * 60 * sample_hz):
+        gas_level = 200.0
+
+        for leak_start in leak_starts:
+            offset = sample - leak_start
+            if 0 <= offset < ramp_samples:
+                gas_level += 60.0 * offset / ramp_samples
+            elif ramp_samples <= offset < ramp_samples + hold_samples:
+                gas_level += 60.0
+
+        level = gas_level + random.gauss(0, 4)
+
+        if random.random() < SPIKE_PROBABILITY:
+            level = 255
+
+        raw_values.append(int(min(255, max(0, level))))
+        is_leak.append(gas_level >= DEFAULT_TRIGGER_THRESHOLD)
+
+    return raw_values, is_leak
+
+
+def read_trace(path):
+    """
+    Returns (raw values, is_leak flags) from a recorded trace.
+    """
+
+    raw_values = []
+    is_leak = []
+
+    with open(path, "r") as trace_file:
+        for line in trace_file:
+            line = line.strip()
+            if not line:
+                continue
+
+            is_leak.append(line.endswith("*"))
+            raw_values.append(float(line.rstrip("*")))
+
+    return raw_values, is_leak
+
+
+def get_leaks(is_leak):
+    """
+    Returns the (first, last) sample of each leak.
+    """
+
+    leaks = []
+    start = None
+
+    for sample, flag in enumerate(is_leak + [False]):
+        if flag and start is None:
+            start = sample
+        elif not flag and start is not None:
+            leaks.append((start, sample - 1))
+            start = None
+
+    return leaks
+
+
+def score(changes, leaks, sample_count, sample_hz):
+    """
+    Returns (false positives, detection latencies in seconds, missed leaks).
+    An alarm is a false positive if it does not overlap a leak.
+    """
+
+    alarms = []
+    start = None
+
+    for sample, is_detected in changes:
+        if is_detected:
+            start = sample
+        elif start is not None:
+            alarms.append((start, sample - 1))
+            start = None
+
+    if start is not None:
+        alarms.append((start, sample_count - 1))
+
+    false_positives = len([alarm for alarm in alarms
+                           if not any([alarm[0] <= last and first <= alarm[1]
+                                       for first, last in leaks])])
+    latencies = []
+    missed = 0
+
+    for first, last in leaks:
+        caught = [max(alarm[0], first) for alarm in alarms
+                  if alarm[0] <= last and first <= alarm[1]]
+        if caught:
+            latencies.append((min(caught) - first) / float(sample_hz))
+        else:
+            missed += 1
+
+    return false_positives, latencies, missed
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        RAW_VALUES, IS_LEAK = read_trace(sys.argv[1])
+        HZ = float(sys.argv[2]) if len(sys.argv) > 2 else SAMPLE_HZ
+    else:
+        HZ = SAMPLE_HZ
+        RAW_VALUES, IS_LEAK = get_synthetic_trace(HZ)
+
+    LEAKS = get_leaks(IS_LEAK)
+
+    print str(len(RAW_VALUES)) + " samples at " + str(HZ) + "Hz, " \
+        + str(len(LEAKS)) + " leaks"
+    print "median alpha  false+  missed  latency avg/max (s)"
+
+    for MEDIAN_WINDOW, EWMA_ALPHA in FILTER_SETTINGS:
+        CHANGES = gas_sampler.replay(RAW_VALUES, MEDIAN_WINDOW, EWMA_ALPHA)
+        FALSE_POSITIVES, LATENCIES, MISSED = score(CHANGES, LEAKS, len(RAW_VALUES), HZ)
+        LATENCY_TEXT = "-"
+
+        if LATENCIES:
+            LATENCY_TEXT = str(round(sum(LATENCIES) / len(LATENCIES), 2)) + "/" \
+                + str(round(max(LATENCIES), 2))
+
+        print str(MEDIAN_WINDOW).rjust(6) + str(EWMA_ALPHA).rjust(6) \
+            + str(FALSE_POSITIVES).rjust(8) + str(MISSED).rjust(8) \
+            + "  " + LATENCY_TEXT
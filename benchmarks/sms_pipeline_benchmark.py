@@ -0,0 +1,419 @@
+"""
+Benchmark of the SMS command pipeline, end to end.
+
+Drives a CommandProcessor on the simulated hardware, texting it
+through the simulated Fona, and measures in simulated seconds:
+
+sms_to_relay_on   An "ON" text arriving, to the heater relay pin going high.
+status_to_reply   A "STATUS" text arriving, to the reply being sent.
+gas_to_relay_off  The gas level jumping over the alarm, to the relay pin
+                  going low. Includes the filtering of the gas sensor.
+broadcast_<n>     A text from an unknown number arriving, to the warning
+                  being sent to every one of n allowed numbers.
+
+The clock runs "speed" times faster than the wall clock, so the
+waits in the Fona driver do not take all day. The time spent running
+code is scaled up by the same amount, so only compare results taken
+at the same speed.
+
+The medians are compared with sms_pipeline_baseline.json, and the
+exit code is 1 if any of them is slower than the baseline allows.
+Each number of allowed numbers is run in its own process, as the
+hardware backend, I2C buses and scheduler are shared by a process.
+
+Run from the root of the repository:
+    python benchmarks/sms_pipeline_benchmark.py [--json] [--save-baseline]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+REPOSITORY_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPOSITORY_DIRECTORY)
+
+import configuration
+import soak_test
+import lib.clock as clock
+import lib.hardware as hardware
+from lib.simulated_hardware import ConstantWaveform
+
+DEFAULT_SPEED = 100
+DEFAULT_REPEAT = 5
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "sms_pipeline_baseline.json")
+
+# A median is a regression if it is more than this fraction
+# slower than the baseline, plus the slack.
+REGRESSION_TOLERANCE = 0.25
+REGRESSION_SLACK_SECONDS = 1.0
+
+BROADCAST_NUMBER_COUNTS = [1, 10, 50]
+
+# Nothing in the hangar changes unless a measurement changes it
+CALM_WAVEFORMS = "ADC0:constant:120, LUX:constant:300"
+GAS_LEVEL = 250
+CALM_GAS_LEVEL = 120
+
+# Simulated seconds
+POLL_SECONDS = 0.05
+MEASUREMENT_TIMEOUT = 60 * 60
+IDLE_SECONDS = 30
+
+UNKNOWN_SENDER_NUMBER = "+12069990000"
+
+
+def get_allowed_numbers(count):
+    """
+    Returns count phone numbers to allow.
+    """
+
+    return [str(2065550100 + index) for index in range(count)]
+
+
+def get_summary(samples):
+    """
+    Returns the median, 90th percentile and maximum of the samples.
+    """
+
+    samples = sorted(samples)
+
+    return {"median": round(soak_test.get_percentile(samples, 0.5), 3),
+            "p90": round(soak_test.get_percentile(samples, 0.9), 3),
+            "max": round(samples[-1], 3),
+            "samples": [round(sample, 3) for sample in samples]}
+
+
+def wait_for(condition, timeout=MEASUREMENT_TIMEOUT):
+    """
+    Polls until condition() is True. Returns the simulated
+    time it was seen. Raises if it does not happen in time.
+    """
+
+    deadline = clock.get_time() + timeout
+
+    while clock.get_time() < deadline:
+        if condition():
+            return clock.get_time()
+
+        clock.sleep(POLL_SECONDS)
+
+    raise RuntimeError("Timed out waiting for " + condition.__name__)
+
+
+class PipelineBenchmark(object):
+    """
+    Takes the measurements from a running CommandProcessor.
+    """
+
+    def measure_relay_on(self, repeat):
+        """
+        Texts "ON", and times the relay pin going high.
+        Texts "OFF" after each one.
+        """
+
+        samples = []
+
+        for _ in range(repeat):
+            self.wait_until_idle()
+            start_time = clock.get_time()
+            self.__modem__.receive_message(self.sender_number, "ON")
+            samples.append(wait_for(self.is_relay_on) - start_time)
+
+            self.__modem__.receive_message(self.sender_number, "OFF")
+            wait_for(self.is_relay_off)
+
+        return get_summary(samples)
+
+    def measure_status_reply(self, repeat):
+        """
+        Texts "STATUS", and times the reply being sent.
+        """
+
+        samples = []
+
+        for _ in range(repeat):
+            self.wait_until_idle()
+            start_time = clock.get_time()
+            self.__modem__.receive_message(self.sender_number, "STATUS")
+            samples.append(self.wait_for_texts([self.reply_number])
+                           - start_time)
+
+        return get_summary(samples)
+
+    def measure_gas_relay_off(self, repeat):
+        """
+        Turns the heater on, raises the gas level over the
+        alarm, and times the relay pin going low.
+        """
+
+        samples = []
+
+        for _ in range(repeat):
+            self.wait_until_idle()
+            self.__modem__.receive_message(self.sender_number, "ON")
+            wait_for(self.is_relay_on)
+            self.wait_until_idle()
+
+            start_time = clock.get_time()
+            self.__backend__.waveforms["ADC0"] = ConstantWaveform(GAS_LEVEL)
+            samples.append(wait_for(self.is_relay_off) - start_time)
+
+            self.__backend__.waveforms["ADC0"] = ConstantWaveform(CALM_GAS_LEVEL)
+            wait_for(self.is_gas_clear)
+
+        return get_summary(samples)
+
+    def measure_broadcast(self, repeat):
+        """
+        Texts from an unknown number, and times the warning
+        reaching every allowed number.
+        """
+
+        samples = []
+
+        for _ in range(repeat):
+            self.wait_until_idle()
+            start_time = clock.get_time()
+            self.__modem__.receive_message(UNKNOWN_SENDER_NUMBER, "STATUS")
+            samples.append(self.wait_for_texts(self.allowed_numbers)
+                           - start_time)
+
+        return get_summary(samples)
+
+    def is_relay_on(self):
+        return self.__gpio__.input(self.heater_pin) == self.__gpio__.HIGH
+
+    def is_relay_off(self):
+        return self.__gpio__.input(self.heater_pin) == self.__gpio__.LOW
+
+    def is_gas_clear(self):
+        return not self.__processor__.is_gas_detected()
+
+    def wait_for_texts(self, phone_numbers):
+        """
+        Waits until a text has been sent to each of the numbers.
+        Returns the simulated time the last one was sent.
+        """
+
+        waiting_numbers = set(phone_numbers)
+        sent_times = []
+
+        def is_every_text_sent():
+            for sent_time, phone_number, _ in self.__modem__.take_sent_messages():
+                if phone_number in waiting_numbers:
+                    waiting_numbers.remove(phone_number)
+                    sent_times.append(sent_time)
+
+            return not waiting_numbers
+
+        wait_for(is_every_text_sent)
+
+        return max(sent_times)
+
+    def wait_until_idle(self):
+        """
+        Waits until every text has been handled and sent,
+        then forgets what was sent.
+        """
+
+        def is_idle():
+            queue_depths = self.__processor__.get_queue_depths()
+
+            return queue_depths["outgoing_sms"] == 0 \
+                and queue_depths["message_waiting"] == 0 \
+                and self.__modem__.get_message_count() == 0
+
+        wait_for(is_idle)
+        clock.sleep(IDLE_SECONDS)
+        wait_for(is_idle)
+        self.__modem__.take_sent_messages()
+
+    def __init__(self, processor, allowed_numbers, heater_pin):
+        self.__processor__ = processor
+        self.__backend__ = hardware.get_backend()
+        self.__modem__ = self.__backend__.modem
+        self.__gpio__ = self.__backend__.gpio
+        self.allowed_numbers = allowed_numbers
+        self.heater_pin = heater_pin
+        self.sender_number = "+1" + allowed_numbers[0]
+        # The reply goes back to the number as it was received
+        self.reply_number = "1" + allowed_numbers[0]
+
+
+def run_configuration(number_count, speed, repeat):
+    """
+    Runs a CommandProcessor that allows number_count numbers,
+    and returns its measurements by name.
+    """
+
+    directory = tempfile.mkdtemp(prefix="hangar_buddy_sms_")
+    allowed_numbers = get_allowed_numbers(number_count)
+    os.environ[hardware.WAVEFORMS_ENVIRONMENT_VARIABLE] = CALM_WAVEFORMS
+    soak_test.write_configuration(directory, [
+        ("ALLOWED_PHONE_NUMBERS", ",".join(allowed_numbers))])
+
+    processor, main_loop = soak_test.start_hangar_buddy(directory, speed)
+    results = {}
+
+    try:
+        benchmark = PipelineBenchmark(processor, allowed_numbers,
+                                      configuration.Configuration().heater_pin)
+
+        if number_count == 1:
+            results["sms_to_relay_on"] = benchmark.measure_relay_on(repeat)
+            results["status_to_reply"] = benchmark.measure_status_reply(repeat)
+            results["gas_to_relay_off"] = benchmark.measure_gas_relay_off(repeat)
+
+        results["broadcast_" + str(number_count)] = benchmark.measure_broadcast(repeat)
+    finally:
+        soak_test.stop_hangar_buddy(processor, main_loop)
+
+    return results
+
+
+def run_benchmarks(speed, repeat):
+    """
+    Runs every configuration in its own process,
+    and returns all of the measurements by name.
+    """
+
+    results = {}
+
+    for number_count in BROADCAST_NUMBER_COUNTS:
+        output_file = tempfile.mktemp(suffix=".json")
+
+        try:
+            subprocess.check_call([sys.executable, os.path.abspath(__file__),
+                                   "--numbers", str(number_count),
+                                   "--speed", str(speed),
+                                   "--repeat", str(repeat),
+                                   "--output", output_file])
+
+            with open(output_file, "r") as results_file:
+                results.update(json.load(results_file))
+        finally:
+            if os.path.exists(output_file):
+                os.remove(output_file)
+
+    return results
+
+
+def compare_with_baseline(results, baseline):
+    """
+    Returns the comparison of each median with the baseline.
+    """
+
+    comparison = {}
+
+    for name in sorted(results.keys()):
+        median = results[name]["median"]
+        baseline_median = baseline.get(name, {}).get("median")
+
+        if baseline_median is None:
+            comparison[name] = {"baseline": None, "change": None,
+                                "is_regression": False}
+            continue
+
+        comparison[name] = {
+            "baseline": baseline_median,
+            "change": round(median / baseline_median - 1.0, 3) if baseline_median else None,
+            "is_regression": median > baseline_median * (1.0 + REGRESSION_TOLERANCE)
+                             + REGRESSION_SLACK_SECONDS}
+
+    return comparison
+
+
+def load_baseline(speed):
+    """
+    Returns the stored measurements, if they were taken at the speed.
+    """
+
+    if not os.path.exists(BASELINE_FILE):
+        return {}
+
+    with open(BASELINE_FILE, "r") as baseline_file:
+        baseline = json.load(baseline_file)
+
+    if baseline.get("speed") != speed:
+        return {}
+
+    return baseline.get("results", {})
+
+
+def print_report(report):
+    """
+    Prints the measurements next to the baseline.
+    """
+
+    print "SMS pipeline, " + report["unit"] + " at " + str(report["speed"]) \
+        + "x, " + str(report["repeat"]) + " runs each"
+    print "  " + "name".ljust(18) + "median".rjust(9) + "p90".rjust(9) \
+        + "max".rjust(9) + "baseline".rjust(10) + "change".rjust(9)
+
+    for name in sorted(report["results"].keys()):
+        summary = report["results"][name]
+        comparison = report["comparison"][name]
+        change = comparison["change"]
+
+        print "  " + name.ljust(18) + str(summary["median"]).rjust(9) \
+            + str(summary["p90"]).rjust(9) + str(summary["max"]).rjust(9) \
+            + str(comparison["baseline"]).rjust(10) \
+            + ("-" if change is None else "{0:+.0%}".format(change)).rjust(9) \
+            + ("  SLOWER" if comparison["is_regression"] else "")
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description="Benchmark of the SMS command pipeline.")
+    PARSER.add_argument("--speed", type=int, default=DEFAULT_SPEED,
+                        help="how many times faster the clock runs")
+    PARSER.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help="how many times each measurement is taken")
+    PARSER.add_argument("--json", action="store_true",
+                        help="print the results as JSON")
+    PARSER.add_argument("--save-baseline", action="store_true",
+                        help="store the results as the new baseline")
+    PARSER.add_argument("--numbers", type=int, help=argparse.SUPPRESS)
+    PARSER.add_argument("--output", help=argparse.SUPPRESS)
+    ARGUMENTS = PARSER.parse_args()
+
+    if ARGUMENTS.numbers is not None:
+        # One configuration, run by run_benchmarks(). The
+        # logger prints every message, so hide them.
+        sys.stdout = open(os.devnull, "w")
+        CONFIGURATION_RESULTS = run_configuration(ARGUMENTS.numbers,
+                                                  ARGUMENTS.speed,
+                                                  ARGUMENTS.repeat)
+
+        with open(ARGUMENTS.output, "w") as OUTPUT_FILE:
+            json.dump(CONFIGURATION_RESULTS, OUTPUT_FILE)
+
+        # Do not wait on the simulator's threads
+        sys.stdout.flush()
+        os._exit(0)
+
+    RESULTS = run_benchmarks(ARGUMENTS.speed, ARGUMENTS.repeat)
+    REPORT = {"unit": "simulated seconds",
+              "speed": ARGUMENTS.speed,
+              "repeat": ARGUMENTS.repeat,
+              "results": RESULTS,
+              "comparison": compare_with_baseline(RESULTS,
+                                                  load_baseline(ARGUMENTS.speed))}
+
+    if ARGUMENTS.save_baseline:
+        with open(BASELINE_FILE, "w") as BASELINE:
+            json.dump({"unit": REPORT["unit"], "speed": REPORT["speed"],
+                       "repeat": REPORT["repeat"], "results": RESULTS},
+                      BASELINE, indent=2, sort_keys=True, separators=(",", ": "))
+            BASELINE.write("\n")
+
+    if ARGUMENTS.json:
+        print json.dumps(REPORT, indent=2, sort_keys=True, separators=(",", ": "))
+    else:
+        print_report(REPORT)
+
+    sys.exit(1 if [name for name in REPORT["comparison"]
+                   if REPORT["comparison"][name]["is_regression"]] else 0)
@@ -0,0 +1,305 @@
+"""
+Soak test of the whole HangarBuddy on the simulated hardware,
+with the clock running many times faster than the wall clock.
+
+Runs a CommandProcessor for the given number of simulated hours,
+texting it a command every fifteen simulated minutes, and reports:
+
+  - how much the resident memory grew per simulated day
+  - the thread count
+  - the depth of each queue the main loop services
+  - how long a text took to be answered, in simulated seconds
+  - how late the recurring tasks ran
+
+The sensor waveforms can be scripted with the
+HANGARBUDDY_HARDWARE_WAVEFORMS environment variable.
+The configuration, logs and history are written to a
+temporary folder, which is kept.
+
+Run from the root of the repository:
+    python benchmarks/soak_test.py [simulated hours] [speed]
+"""
+
+import logging
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from ConfigParser import SafeConfigParser
+
+REPOSITORY_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPOSITORY_DIRECTORY)
+
+import configuration
+import command_processor
+import lib.clock as clock
+import lib.hardware as hardware
+import lib.task_scheduler as task_scheduler
+from lib.logger import Logger
+
+DEFAULT_SIMULATED_HOURS = 72
+DEFAULT_SPEED = 1000
+
+# Simulated seconds between texts, and between samples
+COMMAND_INTERVAL = 60 * 15
+SAMPLE_INTERVAL = 60 * 10
+
+# The memory after the first simulated hour is the baseline,
+# so the growth does not include starting up.
+WARM_UP_SECONDS = 60 * 60
+
+# The number the commands are texted from. Replies go back to the
+# number as it was received ("1206..."), while the broadcasts go to
+# the number as it is configured ("206..."), so they can be told apart.
+ALLOWED_NUMBER = "2065550100"
+SENDER_NUMBER = "+1" + ALLOWED_NUMBER
+REPLY_NUMBER = "1" + ALLOWED_NUMBER
+
+COMMANDS = ["STATUS", "ON", "TEMP", "OFF", "UPTIME", "STATS"]
+
+
+def get_resident_bytes():
+    """
+    Returns the resident memory of the process. Falls back
+    to the peak when /proc is not available.
+    """
+
+    try:
+        with open("/proc/self/statm", "r") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError):
+        # Kilobytes on Linux, bytes on a Mac
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def get_percentile(sorted_values, fraction):
+    """
+    Returns the value at the fraction of the sorted values.
+    """
+
+    if not sorted_values:
+        return None
+
+    return sorted_values[min(len(sorted_values) - 1,
+                             int(len(sorted_values) * fraction))]
+
+
+def write_configuration(directory, settings=None):
+    """
+    Writes the repository's configuration into the folder,
+    changed to keep everything in the folder and to run
+    on the simulated hardware. settings is a list of
+    (key, value) to change as well.
+    """
+
+    config_parser = SafeConfigParser()
+    config_parser.read(os.path.join(REPOSITORY_DIRECTORY, "HangarBuddy.config"))
+
+    for key, value in [("ALLOWED_PHONE_NUMBERS", ALLOWED_NUMBER),
+                       ("LOGFILE_DIRECTORY", directory + os.sep),
+                       ("DEBUGGING_LOGFILE_DIRECTORY", directory + os.sep),
+                       ("HISTORY_DIRECTORY", os.path.join(directory, "history")),
+                       ("DIAGNOSTICS_PORT", "0"),
+                       ("HARDWARE", hardware.SIMULATED)] + (settings or []):
+        config_parser.set("SETTINGS", key, value)
+
+    with open(os.path.join(directory, "HangarBuddy.config"), "w") as config_file:
+        config_parser.write(config_file)
+
+
+def get_logger(directory):
+    """
+    Returns a logger that writes to the folder.
+    """
+
+    logger = logging.getLogger("soak_test")
+    logger.setLevel(logging.INFO)
+    handler = logging.FileHandler(os.path.join(directory, "hangar_buddy.log"))
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)-8s %(message)s'))
+    logger.addHandler(handler)
+
+    return logger
+
+
+def start_hangar_buddy(directory, speed):
+    """
+    Starts a CommandProcessor from the configuration in the
+    folder, with the clock running speed times faster.
+    Returns the processor and the thread of its main loop.
+    """
+
+    clock.set_clock(clock.ScaledClock(speed))
+    os.environ[hardware.BACKEND_ENVIRONMENT_VARIABLE] = hardware.SIMULATED
+    os.chdir(directory)
+
+    processor = command_processor.CommandProcessor(
+        configuration.Configuration(), Logger(get_logger(directory)))
+    main_loop = threading.Thread(target=processor.run_hangar_buddy,
+                                 name="main_loop")
+    main_loop.daemon = True
+    main_loop.start()
+
+    return processor, main_loop
+
+
+def stop_hangar_buddy(processor, main_loop):
+    """
+    Stops the CommandProcessor and the recurring tasks.
+    """
+
+    processor.stop()
+    main_loop.join(5)
+    processor.close()
+    task_scheduler.shutdown()
+
+
+def take_sample(processor):
+    """
+    Returns the (time, resident bytes, thread count, queue depths) now.
+    """
+
+    return (clock.get_time(), get_resident_bytes(),
+            threading.active_count(), processor.get_queue_depths())
+
+
+def get_reply_latencies(commands_sent, sent_messages):
+    """
+    Returns, for each command, how long it took for the
+    first reply after it to be sent.
+    """
+
+    reply_times = sorted([sent_time for sent_time, number, _ in sent_messages
+                          if number == REPLY_NUMBER])
+    latencies = []
+    reply_index = 0
+
+    for command_time, _ in commands_sent:
+        while reply_index < len(reply_times) and reply_times[reply_index] < command_time:
+            reply_index += 1
+
+        if reply_index < len(reply_times):
+            latencies.append(reply_times[reply_index] - command_time)
+            reply_index += 1
+
+    return sorted(latencies)
+
+
+def run_soak_test(simulated_hours, speed):
+    """
+    Runs the HangarBuddy for the simulated hours,
+    and returns what was measured.
+    """
+
+    directory = tempfile.mkdtemp(prefix="hangar_buddy_soak_")
+    write_configuration(directory)
+
+    # The logger prints every message as well
+    console = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    real_start_time = time.time()
+
+    try:
+        processor, main_loop = start_hangar_buddy(directory, speed)
+        modem = hardware.get_backend().modem
+
+        start_time = clock.get_time()
+        end_time = start_time + simulated_hours * 60 * 60
+        next_command_time = start_time + COMMAND_INTERVAL
+        next_sample_time = start_time
+        commands_sent = []
+        sent_messages = []
+        samples = []
+
+        while clock.get_time() < end_time:
+            current_time = clock.get_time()
+
+            if current_time >= next_command_time:
+                command = COMMANDS[len(commands_sent) % len(COMMANDS)]
+                modem.receive_message(SENDER_NUMBER, command)
+                commands_sent.append((current_time, command))
+                next_command_time += COMMAND_INTERVAL
+
+            if current_time >= next_sample_time:
+                samples.append(take_sample(processor))
+                next_sample_time += SAMPLE_INTERVAL
+
+            sent_messages.extend(modem.take_sent_messages())
+            clock.sleep(min(next_command_time, next_sample_time, end_time)
+                        - clock.get_time())
+
+        samples.append(take_sample(processor))
+        scheduler_stats = task_scheduler.get_scheduler().get_stats_text()
+
+        stop_hangar_buddy(processor, main_loop)
+        sent_messages.extend(modem.take_sent_messages())
+    finally:
+        sys.stdout.close()
+        sys.stdout = console
+
+    return {"directory": directory,
+            "real_seconds": time.time() - real_start_time,
+            "commands_sent": commands_sent,
+            "sent_messages": sent_messages,
+            "latencies": get_reply_latencies(commands_sent, sent_messages),
+            "samples": samples,
+            "scheduler_stats": scheduler_stats}
+
+
+def print_report(simulated_hours, speed, results):
+    """
+    Prints what the soak test measured.
+    """
+
+    samples = results["samples"]
+    latencies = results["latencies"]
+    start_time = samples[0][0]
+    baseline = [sample for sample in samples
+                if sample[0] - start_time >= WARM_UP_SECONDS][:1] or samples[:1]
+    baseline_time, baseline_bytes = baseline[0][0], baseline[0][1]
+    end_time, end_bytes = samples[-1][0], samples[-1][1]
+    simulated_days = max(end_time - baseline_time, 1.0) / (60 * 60 * 24)
+    thread_counts = [sample[2] for sample in samples]
+    queue_names = sorted(samples[-1][3].keys())
+
+    print "Soak test: " + str(simulated_hours) + " simulated hours at " \
+        + str(speed) + "x, in " + str(int(results["real_seconds"])) + " seconds"
+    print "  folder:                 " + results["directory"]
+    print "  commands texted:        " + str(len(results["commands_sent"]))
+    print "  replies sent:           " + str(len(latencies))
+    print "  texts sent in total:    " + str(len(results["sent_messages"]))
+    print "  reply p50/p90/p99/max:  " + "/".join(
+        [str(round(value, 1)) if value is not None else "-"
+         for value in [get_percentile(latencies, 0.5),
+                       get_percentile(latencies, 0.9),
+                       get_percentile(latencies, 0.99),
+                       latencies[-1] if latencies else None]]) + " simulated s"
+    print "  memory start/end/max:   " + "/".join(
+        [str(round(value / 1048576.0, 1)) for value in
+         [baseline_bytes, end_bytes, max([sample[1] for sample in samples])]]) + " MB"
+    print "  memory growth:          " + str(int((end_bytes - baseline_bytes)
+                                                 / 1024.0 / simulated_days)) \
+        + " KB per simulated day"
+    print "  threads min/max/end:    " + str(min(thread_counts)) + "/" \
+        + str(max(thread_counts)) + "/" + str(thread_counts[-1])
+    print "  queue depth max (end):"
+
+    for queue_name in queue_names:
+        print "    " + queue_name + ": " \
+            + str(max([sample[3][queue_name] for sample in samples])) \
+            + " (" + str(samples[-1][3][queue_name]) + ")"
+
+    print "  recurring tasks:"
+
+    for stats_line in results["scheduler_stats"].split("\n"):
+        print "    " + stats_line
+
+
+if __name__ == '__main__':
+    SIMULATED_HOURS = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SIMULATED_HOURS
+    SPEED = float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_SPEED
+
+    print_report(SIMULATED_HOURS, SPEED, run_soak_test(SIMULATED_HOURS, SPEED))
@@ -0,0 +1,142 @@
+"""
+Benchmark of reading DS18B20 probes one after another, on
+their own threads, and with the kernel's bulk conversion.
+
+Builds a fake /sys/bus/w1/devices tree in a temporary folder.
+Reading a probe's w1_slave sleeps for the conversion time of its
+resolution, like the kernel does, unless a bulk conversion has
+already been done. Writing "trigger" to therm_bulk_read starts a
+conversion of every probe, and it reads -1 until they are done.
+
+Run from the root of the repository:
+    python benchmarks/temp_probe_benchmark.py [probe count]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import lib.hardware as hardware
+import lib.temp_probe as temp_probe
+
+PROBE_COUNT = 4
+READS = 3
+W1_SLAVE_TEXT = "72 01 4b 46 7f ff 0e 10 57 : crc=57 YES\n" \
+    + "72 01 4b 46 7f ff 0e 10 57 t=23125\n"
+
+
+class FakeSysfsProbes(temp_probe.TemperatureProbes):
+    """
+    TemperatureProbes with the conversion delays of real probes.
+    """
+
+    def __read_file__(self, path):
+        if path.endswith(temp_probe.BULK_READ_FILE):
+            if time.time() < self.bulk_done_time:
+                return "-1\n"
+
+            return "1\n"
+
+        if path.endswith("w1_slave"):
+            probe_id = os.path.basename(os.path.dirname(path))
+
+            if probe_id in self.converted_probes:
+                self.converted_probes.remove(probe_id)
+            else:
+                time.sleep(temp_probe.CONVERSION_SECONDS[self.get_resolution(probe_id)])
+
+        return temp_probe.TemperatureProbes.__read_file__(self, path)
+
+    def __write_file__(self, path, text):
+        if path.endswith(temp_probe.BULK_READ_FILE):
+            self.bulk_done_time = time.time() + self.get_cycle_seconds()
+            self.converted_probes = set(self.get_probe_ids())
+
+        temp_probe.TemperatureProbes.__write_file__(self, path, text)
+
+    def __init__(self, devices_directory, resolution):
+        self.bulk_done_time = 0
+        self.converted_probes = set()
+        temp_probe.TemperatureProbes.__init__(self, devices_directory,
+                                              default_resolution=resolution,
+                                              sysfs=hardware.SysfsFiles())
+
+
+def make_tree(directory, probe_count, has_bulk_read):
+    """
+    Writes the fake devices folder.
+    """
+
+    for probe in range(probe_count):
+        probe_directory = os.path.join(directory, "28-00000000000" + str(probe))
+        os.makedirs(probe_directory)
+
+        with open(os.path.join(probe_directory, "w1_slave"), "w") as w1_slave:
+            w1_slave.write(W1_SLAVE_TEXT)
+
+        with open(os.path.join(probe_directory, "resolution"), "w") as resolution:
+            resolution.write("12\n")
+
+    master_directory = os.path.join(directory, "w1_bus_master1")
+    os.makedirs(master_directory)
+
+    if has_bulk_read:
+        with open(os.path.join(master_directory, temp_probe.BULK_READ_FILE), "w") as bulk:
+            bulk.write("0\n")
+
+
+def time_reads(probes, read_function):
+    """
+    Returns the average seconds of a read.
+    """
+
+    probes.get_probe_ids()
+    start = time.time()
+
+    for _ in range(READS):
+        temperatures = read_function()
+        assert len(temperatures) == len(probes.get_probe_ids())
+
+    return (time.time() - start) / READS
+
+
+def read_one_after_another(probes):
+    """
+    The way read_sensors used to read the probes.
+    """
+
+    return [temp_probe.celcius_to_farenheit(probes.read_probe(probe_id))
+            for probe_id in probes.get_probe_ids()]
+
+
+if __name__ == '__main__':
+    COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else PROBE_COUNT
+    DIRECTORY = tempfile.mkdtemp()
+
+    try:
+        THREADED_DIRECTORY = os.path.join(DIRECTORY, "threaded")
+        BULK_DIRECTORY = os.path.join(DIRECTORY, "bulk")
+        make_tree(THREADED_DIRECTORY, COUNT, False)
+        make_tree(BULK_DIRECTORY, COUNT, True)
+
+        print str(COUNT) + " probes, average of " + str(READS) + " reads (s)"
+        print "bits  one by one  threads  bulk"
+
+        for RESOLUTION in sorted(temp_probe.CONVERSION_SECONDS.keys()):
+            THREADED = FakeSysfsProbes(THREADED_DIRECTORY, RESOLUTION)
+            BULK = FakeSysfsProbes(BULK_DIRECTORY, RESOLUTION)
+
+            ONE_BY_ONE_TIME = time_reads(THREADED, lambda: read_one_after_another(THREADED))
+            THREADED_TIME = time_reads(THREADED, THREADED.read)
+            BULK_TIME = time_reads(BULK, BULK.read)
+
+            assert BULK.bulk_read_count == READS
+
+            print str(RESOLUTION).rjust(4) + str(round(ONE_BY_ONE_TIME, 3)).rjust(12) \
+                + str(round(THREADED_TIME, 3)).rjust(9) + str(round(BULK_TIME, 3)).rjust(6)
+    finally:
+        shutil.rmtree(DIRECTORY)
@@ -5,22 +5,54 @@ Contains the response generated by a command request.
 # TODO - Make commands and help response customizable for Localization
 # TODO - Add documentation on all of "pip installs" required
 
+import os
 import sys
-import time
-import datetime
+import threading
 import Queue
 import math
-from multiprocessing import Queue as MPQueue
-import serial  # Requires "pyserial"
 import text
 from fona_manager import FonaManager
-from Sensors import Sensors
+from Sensors import Sensors, TEMPERATURE_CHANNEL
 from relay_controller import RelayManager
 from lib.recurring_task import RecurringTask
+from lib.channel import Channel
+import lib.channel as channel
+import lib.task_scheduler as task_scheduler
+import lib.i2c_bus as i2c_bus
+import lib.hardware as hardware
+import lib.clock as clock
+from lib.diagnostics_server import DiagnosticsServer
+from lib.series_store import SeriesStore
+from lib.series_rollup import RollupStore
+import lib.series_rollup as series_rollup
 import lib.utilities as utilities
+import lib.sensor_history as sensor_history
 import lib.local_debug as local_debug
 from lib.logger import Logger
 from lib.sf_1602_lcd import LcdDisplay
+from lib.lcd_renderer import LcdRenderer
+import lib.lcd_renderer as lcd_renderer
+
+# How often the scheduler statistics are written to the log
+STATS_LOG_INTERVAL = 60 * 15
+
+# Longest the main loop sleeps when there are no events.
+# Bounds how late the heater shutoff timer can be serviced.
+MAIN_LOOP_IDLE_TIMEOUT = 1.0
+
+# How often the text of the LCD pages is rebuilt,
+# and how long "Ready" is shown before the first page
+LCD_REFRESH_INTERVAL = 5
+LCD_READY_SECONDS = 5
+
+# How often to check if the buffered history is due to be written.
+HISTORY_FLUSH_CHECK_INTERVAL = 60
+
+# How often old history is removed.
+HISTORY_RETENTION_INTERVAL = 60 * 60 * 6
+
+# How many days the DAILY command reports.
+DAILY_HISTORY_DAYS = 7
 
 # Build a list of the valid commanhds so
 # the CommandProcessor can know what to
@@ -32,6 +64,9 @@ VALID_COMMANDS = {text.FULL_STATUS_COMMAND,
                   text.CELL_STATUS_COMMAND,
                   text.TEMPERATURE_COMMAND,
                   text.UPTIME_COMMAND,
+                  text.STATS_COMMAND,
+                  text.TREND_COMMAND,
+                  text.DAILY_COMMAND,
                   text.HEATER_OFF_COMMAND,
                   text.HEATER_ON_COMMAND,
                   text.SHUTDOWN_COMMAND,
@@ -88,7 +123,7 @@ class CommandProcessor(object):
         self.__logger__.log_info_message('Press Ctrl-C to quit.')
 
         # This can be safely used off the main thread.
-        # and writes into the MPqueue...
+        # and writes into the channel...
         # It kicks off every 30 seconds
 
         RecurringTask("monitor_gas_sensor", 30,
@@ -97,10 +132,30 @@ class CommandProcessor(object):
         RecurringTask("battery_check", 60 * 5,
                       self.__monitor_fona_health__, self.__logger__)
 
-        RecurringTask("update_lcd", 5, self.__update_lcd__, self.__logger__)
+        RecurringTask("refresh_lcd_pages", LCD_REFRESH_INTERVAL,
+                      self.__lcd_renderer__.refresh, self.__logger__)
+
+        RecurringTask("log_stats", STATS_LOG_INTERVAL,
+                      self.__log_stats__, self.__logger__,
+                      initial_delay=STATS_LOG_INTERVAL)
+
+        if self.__series_store__ is not None:
+            RecurringTask("flush_history", HISTORY_FLUSH_CHECK_INTERVAL,
+                          self.__flush_history__, self.__logger__)
+            RecurringTask("history_retention", HISTORY_RETENTION_INTERVAL,
+                          self.__apply_history_retention__, self.__logger__)
+
+        self.__start_diagnostics_server__()
+
+        wakeup_channels = [self.__gas_sensor_queue__] \
+            + self.__relay_controller__.get_channels() \
+            + self.__fona_manager__.get_channels()
 
         # The main service loop
-        while True:
+        while not self.__stop_event__.is_set():
+            # Sleep until there is something to service
+            channel.select(wakeup_channels, MAIN_LOOP_IDLE_TIMEOUT)
+
             self.__run_servicer__(self.__service_gas_sensor_queue__,
                                   "Gas sensor queue")
             self.__relay_controller__.update()
@@ -108,6 +163,28 @@ class CommandProcessor(object):
                                   "Incoming request queue")
             self.__fona_manager__.update()
 
+    def stop(self):
+        """
+        Makes run_hangar_buddy return once it has finished
+        the pass it is on. Safe to call from any thread.
+        """
+
+        self.__stop_event__.set()
+
+    def close(self):
+        """
+        Writes out anything that is still buffered,
+        and stops drawing on the LCD.
+        """
+
+        self.__lcd_renderer__.stop()
+
+        if self.__series_store__ is not None:
+            self.__series_store__.close()
+            self.__rollups__.close()
+
+        hardware.close_backend()
+
     def is_gas_detected(self):
         """
         Returns True if gas is detected.
@@ -117,6 +194,22 @@ class CommandProcessor(object):
 
         return False
 
+    def get_queue_depths(self):
+        """
+        Returns how many items are waiting in each of the
+        channels the main loop services, by name.
+        """
+
+        status_queue, send_queue, message_waiting_queue = \
+            self.__fona_manager__.get_channels()
+
+        return {"gas_sensor": self.__gas_sensor_queue__.qsize(),
+                "heater": sum([heater_queue.qsize() for heater_queue
+                               in self.__relay_controller__.get_channels()]),
+                "modem_status": status_queue.qsize(),
+                "outgoing_sms": send_queue.qsize(),
+                "message_waiting": message_waiting_queue.qsize()}
+
     def is_allowed_phone_number(self, phone_number):
         """
         Returns True if the phone number is allowed in the whitelist.
@@ -143,12 +236,16 @@ class CommandProcessor(object):
 
         self.__configuration__ = buddy_configuration
         self.__logger__ = logger
+        self.__stop_event__ = threading.Event()
+        self.__select_hardware__()
         self.__lcd__ = None
-        self.__lcd_status_id__ = 0
+        self.__lcd_renderer__ = None
         self.__initialize_lcd__()
         self.__is_gas_detected__ = False
-        self.__system_start_time__ = datetime.datetime.now()
+        self.__system_start_time__ = clock.get_now()
         self.__sensors__ = Sensors(buddy_configuration)
+        self.__rollups__ = None
+        self.__series_store__ = self.__initialize_series_store__()
 
         serial_connection = self.__initialize_modem__()
         if serial_connection is None and not local_debug.is_debug():
@@ -160,14 +257,23 @@ class CommandProcessor(object):
                                             serial_connection,
                                             self.__configuration__.cell_power_status_pin,
                                             self.__configuration__.cell_ring_indicator_pin,
-                                            self.__configuration__.utc_offset)
+                                            self.__configuration__.utc_offset,
+                                            self.__series_store__)
 
         # create heater relay instance
         self.__relay_controller__ = RelayManager(buddy_configuration, logger,
                                                  self.__heater_turned_on_callback__,
                                                  self.__heater_turned_off_callback__,
-                                                 self.__heater_max_time_off_callback__)
-        self.__gas_sensor_queue__ = MPQueue()
+                                                 self.__heater_max_time_off_callback__,
+                                                 self.__series_store__,
+                                                 self.__heater_rejected_callback__)
+        self.__gas_sensor_queue__ = Channel()
+
+        # Do not wait for the next monitor pass to act on gas
+        self.__sensors__.add_gas_detection_listener(
+            self.__gas_detection_changed__)
+        self.__sensors__.add_light_state_listener(
+            self.__light_state_changed__)
 
         self.__logger__.log_info_message(
             "Starting SMS monitoring and heater service")
@@ -177,8 +283,9 @@ class CommandProcessor(object):
         self.__queue_message_to_all_numbers__("HangarBuddy monitoring started."
                                               + "\n" + self.__get_help_status__())
         self.__queue_message_to_all_numbers__(self.__get_full_status__())
-        self.__lcd__.clear()
-        self.__lcd__.write(0, 0, "Ready")
+        self.__register_lcd_pages__()
+        self.__lcd_renderer__.show("Ready")
+        self.__lcd_renderer__.start_rotation(LCD_READY_SECONDS)
 
     def __clear_existing_messages__(self):
         """
@@ -209,6 +316,12 @@ class CommandProcessor(object):
         if self.__relay_controller__ is None:
             return "Relay not detected."
 
+        relay_names = self.__relay_controller__.get_relay_names()
+
+        if len(relay_names) > 1:
+            return "\n".join([self.__relay_controller__.get_relay_status(relay_name)
+                              for relay_name in relay_names])
+
         status_text = "Heater is "
 
         if self.__relay_controller__.is_relay_on():
@@ -264,18 +377,33 @@ class CommandProcessor(object):
         Returns the status of the temperature probe.
         """
 
+        readings = self.__sensors__.current_temperature_readings
+
+        if len(readings) > 1:
+            return "\n".join([self.__get_probe_text__(reading)
+                              for reading in readings])
+
         if self.__sensors__.current_temperature_sensor_reading is not None:
             return "TEMP: " \
-                   + str(self.__sensors__.current_temperature_sensor_reading) + "F"
+                   + str(round(self.__sensors__.current_temperature_sensor_reading, 1)) + "F"
 
         return "Temp probe not enabled."
 
+    def __get_probe_text__(self, reading):
+        """
+        Returns the status line of one probe.
+        """
+
+        name, fahrenheit = reading
+
+        return name.upper() + ": " + str(round(fahrenheit, 1)) + "F"
+
     def __get_uptime_status__(self):
         """
         Gets how long the system has been up.
         """
 
-        uptime = (datetime.datetime.now() - self.__system_start_time__).total_seconds()
+        uptime = (clock.get_now() - self.__system_start_time__).total_seconds()
         return utilities.get_time_text(uptime)
 
     def __get_light_status__(self):
@@ -306,6 +434,61 @@ class CommandProcessor(object):
 
         return "Light sensor not enabled."
 
+    def __get_stats_status__(self):
+        """
+        Returns how the scheduled tasks have been running,
+        how busy the I2C bus is, and how many I2C writes
+        each LCD frame took.
+        Run and late are mean/max in milliseconds, and skip is
+        the total skipped runs/those of the most recent runs.
+        """
+
+        stats = task_scheduler.get_scheduler().get_stats_text()
+        bus_stats = i2c_bus.get_stats_text()
+
+        if bus_stats:
+            stats += "\n" + bus_stats
+
+        if self.__lcd__.enable:
+            stats += "\n" + self.__lcd_renderer__.get_stats_text()
+
+        return stats
+
+    def __get_trend_status__(self):
+        """
+        Returns the min/max/mean and rate of change
+        of each sensor over the recent windows.
+        """
+
+        history = self.__sensors__.history
+        trends = [sensor_history.get_trend_text(history.get_channel(channel_name))
+                  for channel_name in history.get_channel_names()]
+
+        if not trends:
+            return "No sensors enabled."
+
+        return "\n".join(trends)
+
+    def __get_daily_status__(self):
+        """
+        Returns the low and high temperature of each
+        of the last few days.
+        """
+
+        if self.__rollups__ is None:
+            return "History is disabled."
+
+        return series_rollup.get_daily_text(self.__rollups__,
+                                            TEMPERATURE_CHANNEL,
+                                            DAILY_HISTORY_DAYS)
+
+    def __get_sensor_health_status__(self):
+        """
+        Returns the circuit breaker state of each sensor.
+        """
+
+        return "SENSORS: " + self.__sensors__.get_breaker_status_text()
+
     def __get_full_status__(self):
         """
         Returns the status of the HangarBuddy.
@@ -317,6 +500,7 @@ class CommandProcessor(object):
             status += self.__get_gas_sensor_status__() + "\n"
             status += self.__get_light_status__() + "\n"
             status += self.__get_temp_probe_status__() + "\n"
+            status += self.__get_sensor_health_status__() + "\n"
             status += self.__get_fona_status__() + "\n"
             status += self.__get_uptime_status__()
         except:
@@ -341,26 +525,36 @@ class CommandProcessor(object):
     #-- Event callbacks
     ##############################
 
-    def __heater_turned_on_callback__(self):
+    def __heater_turned_on_callback__(self, relay_names):
         """
         Callback that signals the relay turned the heater on.
         """
         self.__queue_message_to_all_numbers__(
-            "Heater turned  " + text.HEATER_ON_COMMAND + ".")
+            ", ".join(relay_names) + " turned " + text.HEATER_ON_COMMAND + ".")
 
-    def __heater_turned_off_callback__(self):
+    def __heater_turned_off_callback__(self, relay_names):
         """
         Callback that signals the relay turned the heater off.
         """
         self.__queue_message_to_all_numbers__(
-            "Heater turned  " + text.HEATER_OFF_COMMAND + ".")
+            ", ".join(relay_names) + " turned " + text.HEATER_OFF_COMMAND + ".")
+
+    def __heater_rejected_callback__(self, relay_names):
+        """
+        Callback that signals the relay was not turned on,
+        because it draws more than the load budget.
+        """
+        self.__queue_message_to_all_numbers__(
+            ", ".join(relay_names) + " draws more than the "
+            + str(self.__configuration__.load_budget_watts) + "W budget.")
 
-    def __heater_max_time_off_callback__(self):
+    def __heater_max_time_off_callback__(self, relay_names):
         """
         Callback that signals the relay turned the heater off due to the timer.
         """
         self.__queue_message_to_all_numbers__(
-            "Heater turned  " + text.HEATER_OFF_COMMAND + " due to timer.")
+            ", ".join(relay_names) + " turned " + text.HEATER_OFF_COMMAND
+            + " due to timer.")
 
     ##############################
     #-- Message queing
@@ -465,6 +659,27 @@ class CommandProcessor(object):
 
         return CommandResponse(text.UPTIME_COMMAND, self.__get_uptime_status__())
 
+    def __handle_stats_request__(self, phone_number):
+        """
+        Handle a request for the scheduler statistics.
+        """
+
+        return CommandResponse(text.STATS_COMMAND, self.__get_stats_status__())
+
+    def __handle_trend_request__(self, phone_number):
+        """
+        Handle a request for the sensor trends.
+        """
+
+        return CommandResponse(text.TREND_COMMAND, self.__get_trend_status__())
+
+    def __handle_daily_request__(self, phone_number):
+        """
+        Handle a request for the daily lows and highs.
+        """
+
+        return CommandResponse(text.DAILY_COMMAND, self.__get_daily_status__())
+
     def __handle_quit_request__(self, phone_number):
         """
         Handle a request to quit the process.
@@ -479,11 +694,27 @@ class CommandProcessor(object):
 
         return CommandResponse(text.GAS_COMMAND, self.__get_gas_sensor_status__())
 
-    def __handle_temperature_request__(self, phone_number):
+    def __handle_temperature_request__(self, phone_number, message=""):
         """
         Handle a reest to find out the temperature.
+        "TEMP ENGINE" asks for just the probe named Engine.
         """
 
+        words = message.split()
+
+        if text.TEMPERATURE_COMMAND in words \
+                and words.index(text.TEMPERATURE_COMMAND) + 1 < len(words):
+            probe_name = " ".join(words[words.index(text.TEMPERATURE_COMMAND) + 1:])
+            reading = self.__sensors__.get_temperature_reading(probe_name)
+
+            if reading is None:
+                return CommandResponse(text.TEMPERATURE_COMMAND,
+                                       "No probe named " + probe_name + ".\n"
+                                       + self.__get_temp_probe_status__())
+
+            return CommandResponse(text.TEMPERATURE_COMMAND,
+                                   self.__get_probe_text__(reading))
+
         return CommandResponse(text.TEMPERATURE_COMMAND, self.__get_temp_probe_status__())
 
     def __handle_cell_status_request__(self, phone_number):
@@ -531,6 +762,9 @@ class CommandProcessor(object):
             text.CELL_STATUS_COMMAND: self.__handle_cell_status_request__,
             text.TEMPERATURE_COMMAND: self.__handle_temperature_request__,
             text.UPTIME_COMMAND: self.__handle_uptime_request__,
+            text.STATS_COMMAND: self.__handle_stats_request__,
+            text.TREND_COMMAND: self.__handle_trend_request__,
+            text.DAILY_COMMAND: self.__handle_daily_request__,
             text.GAS_COMMAND: self.__handle_gas_request__,
             text.SHUTDOWN_COMMAND: self.__handle_shutdown_request__,
             text.RESTART_COMMAND: self.__handle_restart_request__,
@@ -539,9 +773,17 @@ class CommandProcessor(object):
             text.HEATER_ON_COMMAND: self.__handle_on_request__,
         }
 
+        # Handlers that also need the rest of the message
+        message_handlers = {
+            text.TEMPERATURE_COMMAND: self.__handle_temperature_request__
+        }
+
         # Execute the first handler found.
         for command in command_handlers:
             if command.upper() in cleansed_message:
+                if command in message_handlers:
+                    return message_handlers[command](phone_number, cleansed_message)
+
                 return command_handlers[command](phone_number)
 
         return CommandResponse(text.HELP_COMMAND, "INVALID COMMAND\n" + self.__get_help_status__())
@@ -577,6 +819,96 @@ class CommandProcessor(object):
         # what we think the status is.
         self.__relay_controller__.turn_off()
 
+    ##############################
+    #-- LCD pages
+    ##############################
+
+    def __get_summary_lcd_text__(self):
+        """
+        Returns the signal, battery and heater on the top row,
+        and the gas, temperature and light on the bottom one,
+        using the LCD's custom characters.
+        """
+
+        signal_strength = self.__fona_manager__.signal_strength()
+        battery = self.__fona_manager__.battery_condition()
+        csq = signal_strength.get_signal_strength() \
+            if signal_strength is not None else None
+
+        top_row = lcd_renderer.get_signal_glyph(csq) \
+            + (str(csq) if csq is not None else "--").ljust(3)
+
+        if battery is not None:
+            percent = int(battery.battery_percent)
+            top_row += lcd_renderer.get_battery_glyph(percent) \
+                + (str(percent) + "%").ljust(5)
+
+        if self.__relay_controller__ is not None \
+                and self.__relay_controller__.is_relay_on():
+            top_row += lcd_renderer.FLAME + "ON"
+        else:
+            top_row += "OFF"
+
+        gas_reading = self.__sensors__.current_gas_sensor_reading
+        temperature = self.__sensors__.current_temperature_sensor_reading
+        light_reading = self.__sensors__.current_light_sensor_reading
+
+        bottom_row = lcd_renderer.GAS
+
+        if gas_reading is not None:
+            bottom_row += str(int(gas_reading.current_value))
+
+            if gas_reading.is_gas_detected:
+                bottom_row += "!"
+        else:
+            bottom_row += "--"
+
+        bottom_row += " " + (str(int(round(temperature))) if temperature is not None
+                             else "--") + "F"
+
+        if light_reading is not None and light_reading.enabled:
+            bottom_row += " " + str(int(light_reading.lux)) + "lx"
+
+        return top_row + "\n" + bottom_row
+
+    def __get_gas_lcd_text__(self):
+        """
+        Returns the gas sensor page, or None if there is no reading.
+        """
+
+        if self.__sensors__.current_gas_sensor_reading is None:
+            return None
+
+        return self.__get_gas_sensor_status__()
+
+    def __get_light_lcd_text__(self):
+        """
+        Returns the light sensor page, or None if there is no reading.
+        """
+
+        if self.__sensors__.current_light_sensor_reading is None \
+                or not self.__sensors__.current_light_sensor_reading.enabled:
+            return None
+
+        return self.__get_light_status__()
+
+    def __get_temp_probe_lcd_text__(self):
+        """
+        Returns the temperature page, or None if there is no reading.
+        """
+
+        if self.__sensors__.current_temperature_sensor_reading is None:
+            return None
+
+        return self.__get_temp_probe_status__()
+
+    def __get_uptime_lcd_text__(self):
+        """
+        Returns the uptime page.
+        """
+
+        return "UPTIME:\n" + self.__get_uptime_status__()
+
     ##############################
     #-- Command execution
     ##############################
@@ -591,10 +923,9 @@ class CommandProcessor(object):
         # or the Pi
         if command_response.get_command() == text.SHUTDOWN_COMMAND:
             try:
-                # Update the LCD, then set it to NULL
-                # so that it will not be updated again
-                self.__lcd__.write_text("Shutting down...")
-                self.__lcd__ = None
+                # Holds the message on the LCD, so
+                # the pages do not replace it
+                self.__lcd_renderer__.show("Shutting down...")
                 self.__queue_message_to_all_numbers__(
                     "Shutting down Raspberry Pi.")
                 self.__clear_existing_messages__()
@@ -607,8 +938,7 @@ class CommandProcessor(object):
         elif command_response.get_command() == text.RESTART_COMMAND:
             try:
                 # Show that we are rebooting
-                self.__lcd__.write_text("Restarting...")
-                self.__lcd__ = None
+                self.__lcd_renderer__.show("Restarting...")
                 self.__clear_existing_messages__()
                 self.__queue_message_to_all_numbers__("Attempting restart")
                 self.__restart__()
@@ -619,7 +949,8 @@ class CommandProcessor(object):
                     "CR: Issue restarting")
         elif command_response.get_command() == text.QUIT_COMMAND:
             try:
-                self.__lcd__.write_text("Quiting")
+                self.__lcd_renderer__.show("Quiting")
+                self.__lcd_renderer__.stop()
                 exit()
             except:
                 self.__logger__.log_warning_message(
@@ -651,19 +982,19 @@ class CommandProcessor(object):
         # check to see if this is an allowed phone number
         if not self.is_allowed_phone_number(phone_number):
             unauth_message = "Received unauthorized SMS from " + phone_number
-            return self.__queue_message_to_all_numbers__(unauth_message)
+            return self.__queue_message_to_all_numbers__(unauth_message), False
 
         if len(phone_number) < 7:
             invalid_number_message = "Attempt from invalid phone number " + \
                 phone_number + " received."
-            return self.__queue_message_to_all_numbers__(invalid_number_message)
+            return self.__queue_message_to_all_numbers__(invalid_number_message), False
 
         message_length = len(message)
         if message_length < 1 or message_length > 32:
             invalid_message = "Message was invalid length."
             self.__queue_message__(
                 phone_number, invalid_message)
-            return self.__logger__.log_warning_message(invalid_message)
+            return self.__logger__.log_warning_message(invalid_message), False
 
         command_response = self.__get_command_response__(
             message, phone_number)
@@ -684,6 +1015,7 @@ class CommandProcessor(object):
         """
         self.__logger__.log_info_message("RESTARTING. Turning off relay")
         self.__relay_controller__.turn_off()
+        self.close()
         utilities.restart()
 
     def __shutdown__(self):
@@ -692,6 +1024,7 @@ class CommandProcessor(object):
         """
         self.__logger__.log_info_message("SHUTDOWN: Turning off relay.")
         self.__relay_controller__.turn_off()
+        self.close()
 
         self.__logger__.log_info_message(
             "SHUTDOWN: Shutting down HangarBuddy.")
@@ -743,13 +1076,36 @@ class CommandProcessor(object):
             self.__logger__.log_warning_message(status)
             self.__gas_sensor_queue__.put(
                 text.GAS_WARNING + ", level=" + str(current_level))
-            self.__logger__.heater_queue.put(text.HEATER_OFF_COMMAND)
+            self.__relay_controller__.turn_off()
             self.__queue_message_to_all_numbers__(status)
         else:
             self.__logger__.log_info_message("Sending OK into queue", False)
             self.__gas_sensor_queue__.put(
                 text.GAS_OK + ", level=" + str(current_level))
 
+    def __gas_detection_changed__(self, gas_sensor_result):
+        """
+        Called as soon as gas is detected or clears.
+        """
+
+        self.__logger__.log_info_message(
+            "Gas detection changed to " + str(gas_sensor_result.is_gas_detected)
+            + ", Level=" + str(gas_sensor_result.current_value))
+        self.__monitor_gas_sensor__()
+
+    def __light_state_changed__(self, is_lit, light_sensor_result):
+        """
+        Called as soon as the hangar lights go on or off.
+        """
+
+        message = text.LIGHTS_ON if is_lit else text.LIGHTS_OFF
+        message += ". " + str(int(light_sensor_result.lux)) + " LUX."
+
+        self.__logger__.log_info_message(message)
+
+        if self.__configuration__.is_light_alert_enabled:
+            self.__queue_message_to_all_numbers__(message)
+
     def __monitor_fona_health__(self):
         """
         Check to make sure the Fona battery and
@@ -768,56 +1124,38 @@ class CommandProcessor(object):
             self.__queue_message_to_all_numbers__(low_battery_message)
             self.__logger__.log_warning_message(low_battery_message)
 
-    def __update_lcd__(self):
+    def __log_stats__(self):
         """
-        Updates the LCD screen.
+        Writes the scheduler statistics to the log.
         """
 
-        # If we start shutting down or rebooting
-        # then __lcd__ is set to None to avoid
-        # any more updates
-        if self.__lcd__ is None:
-            return
-
-        self.__lcd__.clear()
-
-        # Moves to the next status message based on the
-        # interval in given to RecurringEvent (Normally 5 seconds)
-        try:
-            if self.__lcd_status_id__ == 0:
-                self.__lcd__.write_text(self.__get_fona_status__())
-            if self.__lcd_status_id__ == 1:
-                self.__lcd__.write_text(self.__get_heater_status__())
-            if self.__lcd_status_id__ == 2:
-                if self.__sensors__.current_gas_sensor_reading is not None:
-                    self.__lcd__.write_text(self.__get_gas_sensor_status__())
-                else:
-                    self.__lcd_status_id__ += 1
-            if self.__lcd_status_id__ == 3:
-                if  self.__sensors__.current_light_sensor_reading is not None \
-                        and  self.__sensors__.current_light_sensor_reading.enabled:
-                    self.__lcd__.write_text(self.__get_light_status__())
-                else:
-                    self.__lcd_status_id__ += 1
-            if self.__lcd_status_id__ == 4:
-                if self.__sensors__.current_temperature_sensor_reading is not None:
-                    self.__lcd__.write_text(self.__get_temp_probe_status__())
-                else:
-                    self.__lcd_status_id__ += 1
-            if self.__lcd_status_id__ >= 5:
-                self.__lcd_status_id__ = -1
-                self.__lcd__.write_text("UPTIME:\n" + self.__get_uptime_status__())
-        except:
-            self.__lcd__.write(0, 0, "ERROR: LCD_ID=" +
-                               str(self.__lcd_status_id__))
-            self.__lcd_status_id__ = -1
-
-        self.__lcd_status_id__ = self.__lcd_status_id__ + 1
+        for stats_line in self.__get_stats_status__().split("\n"):
+            self.__logger__.log_info_message("STATS " + stats_line, False)
 
     ##############################
     #-- Initializers
     ##############################
 
+    def __select_hardware__(self):
+        """
+        Picks the hardware backend before any driver is created.
+        """
+
+        light_interrupt_pin = None
+
+        if self.__configuration__.light_sensor_interrupt_pin > 0:
+            light_interrupt_pin = self.__configuration__.light_sensor_interrupt_pin
+
+        backend = hardware.select_backend(
+            self.__configuration__.hardware_backend,
+            self.__configuration__.hardware_waveforms,
+            self.__configuration__.hardware_replay_file,
+            self.__configuration__.hardware_recording_file,
+            light_interrupt_pin,
+            self.__configuration__.cell_ring_indicator_pin)
+
+        self.__logger__.log_info_message("Using the " + backend.name + " hardware")
+
     def __initialize_modem__(self, retries=4, seconds_between_retries=10):
         """
         Attempts to initialize the modem over the serial port.
@@ -825,15 +1163,12 @@ class CommandProcessor(object):
 
         serial_connection = None
 
-        if local_debug.is_debug():
-            return None
-
         while retries > 0 and serial_connection is None:
             try:
                 self.__logger__.log_info_message(
                     "Opening on " + self.__configuration__.cell_serial_port)
 
-                serial_connection = serial.Serial(
+                serial_connection = hardware.open_serial(
                     self.__configuration__.cell_serial_port,
                     self.__configuration__.cell_baud_rate)
             except:
@@ -844,20 +1179,118 @@ class CommandProcessor(object):
                     + " check to make sure device is connected correctly")
 
                 # wait 60 seconds and check again
-                time.sleep(seconds_between_retries)
+                clock.sleep(seconds_between_retries)
 
             retries -= 1
 
         return serial_connection
 
+    def __start_diagnostics_server__(self):
+        """
+        Serves the diagnostics reports on a local socket.
+        """
+
+        if self.__configuration__.diagnostics_port <= 0:
+            return None
+
+        try:
+            diagnostics_server = DiagnosticsServer(
+                self.__configuration__.diagnostics_port)
+            diagnostics_server.add_report(text.STATS_COMMAND,
+                                          self.__get_stats_status__)
+            diagnostics_server.add_report(text.FULL_STATUS_COMMAND,
+                                          self.__get_full_status__)
+            diagnostics_server.add_report(text.TREND_COMMAND,
+                                          self.__get_trend_status__)
+            diagnostics_server.add_report(text.DAILY_COMMAND,
+                                          self.__get_daily_status__)
+            diagnostics_server.start()
+
+            return diagnostics_server
+        except:
+            self.__logger__.log_warning_message(
+                "Unable to start diagnostics server:" + str(sys.exc_info()[0]))
+
+        return None
+
+    def __initialize_series_store__(self):
+        """
+        Opens the on-disk history and starts recording
+        every sensor reading into it.
+        """
+
+        if not self.__configuration__.is_history_enabled:
+            return None
+
+        try:
+            history_directory = self.__configuration__.history_directory
+            series_store = SeriesStore(os.path.join(history_directory, "raw"))
+            rollups = RollupStore(os.path.join(history_directory, "rollups"),
+                                  self.__configuration__.utc_offset,
+                                  self.__configuration__.history_rollup_days)
+
+            # Bring the rollups up to date before new samples arrive
+            replayed = rollups.catch_up(series_store)
+            self.__logger__.log_info_message(
+                "Replayed " + str(replayed) + " samples into the rollups.")
+
+            series_store.add_sample_listener(rollups.add)
+            self.__sensors__.add_reading_listener(series_store.add)
+            self.__rollups__ = rollups
+
+            return series_store
+        except:
+            self.__logger__.log_warning_message(
+                "Unable to open the history:" + str(sys.exc_info()[0]))
+
+        return None
+
+    def __flush_history__(self):
+        """
+        Writes the buffered samples, and the rollup
+        buckets that have closed, once they are due.
+        """
+
+        if self.__series_store__.flush_if_due() > 0:
+            self.__rollups__.flush()
+
+    def __apply_history_retention__(self):
+        """
+        Removes the history that is older than
+        the configured retention.
+        """
+
+        self.__series_store__.delete_segments_before(
+            clock.get_time() - self.__configuration__.history_raw_days
+            * series_rollup.ONE_DAY)
+        self.__rollups__.apply_retention()
+
     def __initialize_lcd__(self):
         """
         Initializes the display.
         """
-        self.__lcd_status_id__ = 0
         self.__lcd__ = LcdDisplay()
-        self.__lcd__.clear()
-        self.__lcd__.write(0, 0, "Initializing...")
+        self.__lcd_renderer__ = LcdRenderer(self.__lcd__,
+                                            self.__configuration__.lcd_pages,
+                                            self.__logger__)
+        self.__lcd_renderer__.show("Initializing...")
+
+    def __register_lcd_pages__(self):
+        """
+        Gives the LCD the text of each of its pages.
+        The order comes from the configuration.
+        """
+
+        for page_name, build_text in [("SUMMARY", self.__get_summary_lcd_text__),
+                                      ("SIGNAL", self.__get_fona_status__),
+                                      ("HEATER", self.__get_heater_status__),
+                                      ("GAS", self.__get_gas_lcd_text__),
+                                      ("LIGHT", self.__get_light_lcd_text__),
+                                      ("TEMP", self.__get_temp_probe_lcd_text__),
+                                      ("UPTIME", self.__get_uptime_lcd_text__)]:
+            self.__lcd_renderer__.register_page(page_name, build_text)
+
+        self.__lcd_renderer__.refresh()
 
     ##############################
     #-- Servicers
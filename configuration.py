@@ -2,8 +2,20 @@
 
 # encoding: UTF-8
 
-from ConfigParser import SafeConfigParser
+from ConfigParser import SafeConfigParser, NoOptionError
 import lib.local_debug as local_debug
+from lib.diagnostics_server import DEFAULT_DIAGNOSTICS_PORT
+import lib.load_scheduler as load_scheduler
+import lib.series_rollup as series_rollup
+import lib.gas_sampler as gas_sampler
+import lib.temp_probe as temp_probe
+import lib.hardware as hardware
+import lib.lcd_renderer as lcd_renderer
+
+DEFAULT_RELAY_NAME = "Heater"
+DEFAULT_RELAY_WATTS = 1500
+DEFAULT_LOAD_BUDGET_WATTS = 1800  # 15A at 120V
+DEFAULT_HISTORY_RAW_DAYS = 14
 
 # read in configuration settings
 
@@ -19,6 +31,104 @@ def get_config_file_location():
     return './HangarBuddy.config'
 
 
+class RelayDefinition(object):
+    """
+    A relay and the load that is plugged into it.
+    """
+
+    def __init__(self, name, pin, watts):
+        self.name = name
+        self.pin = pin
+        self.watts = watts
+
+
+def parse_relay_definitions(relays_setting):
+    """
+    Parses a list of relays in the form "Name:Pin:Watts, ..."
+
+    >>> relays = parse_relay_definitions("Engine:22:1000, Cabin:29:750")
+    >>> [(relay.name, relay.pin, relay.watts) for relay in relays]
+    [('Engine', 22, 1000), ('Cabin', 29, 750)]
+    """
+
+    relay_definitions = []
+
+    for relay_setting in relays_setting.split(','):
+        tokens = [token.strip() for token in relay_setting.split(':')]
+        relay_definitions.append(RelayDefinition(tokens[0],
+                                                 int(tokens[1]),
+                                                 int(tokens[2])))
+
+    return relay_definitions
+
+
+class TemperatureProbeDefinition(object):
+    """
+    A named temperature probe, by its 1-Wire serial.
+    """
+
+    def __init__(self, name, probe_id, resolution=None):
+        self.name = name
+        self.probe_id = probe_id
+        self.resolution = resolution
+
+
+def parse_probe_definitions(probes_setting):
+    """
+    Parses a list of probes in the form "Name:Serial[:Bits], ..."
+
+    >>> probes = parse_probe_definitions("Engine:28-0316a2799fff:10, Outside:28-0416a27a01ff")
+    >>> [(probe.name, probe.probe_id, probe.resolution) for probe in probes]
+    [('Engine', '28-0316a2799fff', 10), ('Outside', '28-0416a27a01ff', None)]
+    """
+
+    probe_definitions = []
+
+    for probe_setting in probes_setting.split(','):
+        tokens = [token.strip() for token in probe_setting.split(':')]
+        resolution = int(tokens[2]) if len(tokens) > 2 else None
+        probe_definitions.append(TemperatureProbeDefinition(tokens[0],
+                                                            tokens[1],
+                                                            resolution))
+
+    return probe_definitions
+
+
+def parse_probe_resolutions(resolutions_setting):
+    """
+    Parses a list of probe resolutions in the form "Id:Bits, ..."
+
+    >>> sorted(parse_probe_resolutions("28-0316a2799fff:9, 28-0416a27a01ff:12").items())
+    [('28-0316a2799fff', 9), ('28-0416a27a01ff', 12)]
+    """
+
+    resolutions = {}
+
+    for resolution_setting in resolutions_setting.split(','):
+        tokens = [token.strip() for token in resolution_setting.split(':')]
+        resolutions[tokens[0]] = int(tokens[1])
+
+    return resolutions
+
+
+def parse_lcd_pages(pages_setting):
+    """
+    Parses the LCD pages, in the order they are shown,
+    in the form "Name:Seconds, ..."
+
+    >>> parse_lcd_pages("SUMMARY:5, UPTIME:2.5")
+    [('SUMMARY', 5.0), ('UPTIME', 2.5)]
+    """
+
+    pages = []
+
+    for page_setting in pages_setting.split(','):
+        tokens = [token.strip() for token in page_setting.split(':')]
+        pages.append((tokens[0].upper(), float(tokens[1])))
+
+    return pages
+
+
 class Configuration(object):
     """
     Object to handle configuration of the HangarBuddy.
@@ -32,6 +142,99 @@ class Configuration(object):
 
         return self.__config_parser__.get('SETTINGS', 'LOGFILE_DIRECTORY')
 
+    def __get_relay_definitions__(self):
+        """
+        Returns the relays from the RELAYS setting. Falls
+        back to a single heater on HEATER_PIN when it is not
+        set, and raises if it can not be read.
+        """
+
+        try:
+            relays_setting = self.__config_parser__.get('SETTINGS', 'RELAYS')
+        except NoOptionError:
+            return [RelayDefinition(DEFAULT_RELAY_NAME,
+                                    self.heater_pin,
+                                    DEFAULT_RELAY_WATTS)]
+
+        try:
+            return parse_relay_definitions(relays_setting)
+        except (IndexError, ValueError):
+            raise ValueError("RELAYS should be Name:Pin:Watts, ... not '"
+                             + relays_setting + "'")
+
+    def __get_lcd_pages__(self):
+        """
+        Returns the LCD pages from the LCD_PAGES setting,
+        or the default pages.
+        """
+
+        try:
+            return parse_lcd_pages(
+                self.__config_parser__.get('SETTINGS', 'LCD_PAGES'))
+        except:
+            return parse_lcd_pages(lcd_renderer.DEFAULT_PAGES)
+
+    def get_temp_probe_definitions(self):
+        """
+        Returns the named temperature probes.
+        """
+
+        try:
+            return parse_probe_definitions(
+                self.__config_parser__.get('SETTINGS', 'TEMP_PROBES'))
+        except:
+            return []
+
+    def get_temp_probe_resolutions(self):
+        """
+        Returns the resolution of each temperature probe
+        that is not at the default resolution.
+        """
+
+        try:
+            resolutions = parse_probe_resolutions(
+                self.__config_parser__.get('SETTINGS', 'TEMP_PROBE_RESOLUTIONS'))
+        except:
+            resolutions = {}
+
+        for probe_definition in self.temp_probe_definitions:
+            if probe_definition.resolution is not None:
+                resolutions[probe_definition.probe_id] = probe_definition.resolution
+
+        return resolutions
+
+    def __get_optional_string__(self, setting_name, default_value):
+        """ returns a text setting, or the default if it is not set. """
+
+        try:
+            return self.__config_parser__.get('SETTINGS', setting_name)
+        except:
+            return default_value
+
+    def __get_optional_boolean__(self, setting_name, default_value):
+        """ returns a True/False setting, or the default if it is not set. """
+
+        try:
+            return self.__config_parser__.getboolean('SETTINGS', setting_name)
+        except:
+            return default_value
+
+    def __get_optional_float__(self, setting_name, default_value):
+        """ returns a decimal setting, or the default if it is not set. """
+
+        try:
+            return self.__config_parser__.getfloat('SETTINGS', setting_name)
+        except:
+            return default_value
+
+    def __get_optional_int__(self, setting_name, default_value):
+        """ returns an integer setting, or the default if it is not set. """
+
+        try:
+            return self.__config_parser__.getint('SETTINGS', setting_name)
+        except:
+            return default_value
+
     def __init__(self):
         print "SETTINGS" + get_config_file_location()
 
@@ -49,8 +252,18 @@ class Configuration(object):
             'SETTINGS', 'HEATER_PIN')
         self.is_mq2_enabled = self.__config_parser__.getboolean(
             'SETTINGS', 'MQ2')
+        self.gas_sample_hz = self.__get_optional_float__(
+            'GAS_SAMPLE_HZ', gas_sampler.DEFAULT_SAMPLE_HZ)
+        self.gas_median_window = self.__get_optional_int__(
+            'GAS_MEDIAN_WINDOW', gas_sampler.DEFAULT_MEDIAN_WINDOW)
+        self.gas_ewma_alpha = self.__get_optional_float__(
+            'GAS_EWMA_ALPHA', gas_sampler.DEFAULT_EWMA_ALPHA)
         self.is_temp_probe_enabled = self.__config_parser__.getboolean(
             'SETTINGS', 'TEMP')
+        self.temp_probe_resolution = self.__get_optional_int__(
+            'TEMP_PROBE_RESOLUTION', temp_probe.DEFAULT_RESOLUTION)
+        self.temp_probe_definitions = self.get_temp_probe_definitions()
+        self.temp_probe_resolutions = self.get_temp_probe_resolutions()
         self.is_light_sensor_enabled = self.__config_parser__.getboolean(
             'SETTINGS', 'LIGHT_SENSOR')
         self.hangar_dark = self.__config_parser__.getint(
@@ -59,6 +272,12 @@ class Configuration(object):
             'SETTINGS', 'HANGAR_DIM')
         self.hangar_lit = self.__config_parser__.getint(
             'SETTINGS', 'HANGAR_LIT')
+        self.is_light_auto_range_enabled = self.__get_optional_boolean__(
+            'LIGHT_AUTO_RANGE', True)
+        self.light_sensor_interrupt_pin = self.__get_optional_int__(
+            'LIGHT_SENSOR_INT_PIN', 0)
+        self.is_light_alert_enabled = self.__get_optional_boolean__(
+            'LIGHT_ALERTS', True)
         self.allowed_phone_numbers = self.__config_parser__.get(
             'SETTINGS', 'ALLOWED_PHONE_NUMBERS')
         self.allowed_phone_numbers = self.allowed_phone_numbers.split(',')
@@ -70,6 +289,41 @@ class Configuration(object):
         self.utc_offset = self.__config_parser__.getint(
             'SETTINGS', 'UTC_OFFSET')
 
+        self.lcd_pages = self.__get_lcd_pages__()
+        self.diagnostics_port = self.__get_optional_int__(
+            'DIAGNOSTICS_PORT', DEFAULT_DIAGNOSTICS_PORT)
+        self.is_history_enabled = self.__get_optional_boolean__(
+            'HISTORY', True)
+        self.history_directory = self.__get_optional_string__(
+            'HISTORY_DIRECTORY', self.get_log_directory() + "history/")
+        self.history_raw_days = self.__get_optional_int__(
+            'HISTORY_RAW_DAYS', DEFAULT_HISTORY_RAW_DAYS)
+        self.history_rollup_days = {
+            series_rollup.ONE_MINUTE: self.__get_optional_int__(
+                'HISTORY_MINUTE_DAYS',
+                series_rollup.DEFAULT_RETENTION_DAYS[series_rollup.ONE_MINUTE]),
+            series_rollup.ONE_HOUR: self.__get_optional_int__(
+                'HISTORY_HOUR_DAYS',
+                series_rollup.DEFAULT_RETENTION_DAYS[series_rollup.ONE_HOUR]),
+            series_rollup.ONE_DAY: self.__get_optional_int__(
+                'HISTORY_DAY_DAYS',
+                series_rollup.DEFAULT_RETENTION_DAYS[series_rollup.ONE_DAY])}
+        self.relays = self.__get_relay_definitions__()
+        self.load_budget_watts = self.__get_optional_int__(
+            'LOAD_BUDGET_WATTS', DEFAULT_LOAD_BUDGET_WATTS)
+        self.relay_stagger_seconds = self.__get_optional_int__(
+            'RELAY_STAGGER_SECONDS', load_scheduler.DEFAULT_STAGGER_SECONDS)
+        self.duty_cycle_minutes = self.__get_optional_int__(
+            'DUTY_CYCLE_MINUTES', load_scheduler.DEFAULT_DUTY_CYCLE_SECONDS / 60)
+        self.hardware_backend = self.__get_optional_string__(
+            'HARDWARE', None)
+        self.hardware_waveforms = self.__get_optional_string__(
+            'HARDWARE_WAVEFORMS', None)
+        self.hardware_replay_file = self.__get_optional_string__(
+            'HARDWARE_REPLAY', None)
+        self.hardware_recording_file = self.__get_optional_string__(
+            'HARDWARE_RECORDING', self.get_log_directory() + hardware.DEFAULT_RECORDING_FILE)
+
         try:
             self.test_mode = self.__config_parser__.getboolean(
                 'SETTINGS', 'TEST_MODE')
@@ -5,11 +5,10 @@ the Fona in a thread safe way.
 import sys
 import threading
 import time
-from multiprocessing import Queue as MPQueue
 import text
-import lib.local_debug as local_debug
 import lib.fona as fona
 from lib.recurring_task import RecurringTask
+from lib.channel import Channel
 
 
 class FonaManager(object):
@@ -44,6 +43,16 @@ class FonaManager(object):
         self.__process_status_updates__()
         self.__process_send_messages__()
 
+    def get_channels(self):
+        """
+        Returns the channels that update() and
+        the message processing service.
+        """
+
+        return [self.__update_status_queue__,
+                self.__send_message_queue__,
+                self.__fona__.get_message_waiting_channel()]
+
     def send_message(self,
                      phone_number,
                      text_message,
@@ -135,6 +144,13 @@ class FonaManager(object):
         """
         self.__current_battery_state__ = self.__fona__.get_current_battery_condition()
 
+        if self.__series_store__ is not None \
+                and not self.__current_battery_state__.error_state:
+            self.__series_store__.add(
+                "BATTERY_PCT", self.__current_battery_state__.get_percent_battery())
+            self.__series_store__.add(
+                "BATTERY_V", self.__current_battery_state__.get_voltage())
+
     def __update_signal_strength__(self):
         """
         Updates the battery state.
@@ -142,6 +158,10 @@ class FonaManager(object):
 
         self.__current_signal_strength__ = self.__fona__.get_signal_strength()
 
+        if self.__series_store__ is not None:
+            self.__series_store__.add(
+                "CSQ", self.__current_signal_strength__.get_signal_strength())
+
     def __process_status_updates__(self):
         """
         Handles updating the cell signal
@@ -230,13 +250,17 @@ class FonaManager(object):
                  serial_connection,
                  power_status_pin,
                  ring_indicator_pin,
-                 utc_offset):
+                 utc_offset,
+                 series_store=None):
         """
         Initializes the Fona.
+        Signal and battery readings are recorded
+        in the series store, if one is given.
         """
 
         fona.TIMEZONE_OFFSET = utc_offset
         self.__logger__ = logger
+        self.__series_store__ = series_store
         self.__lock__ = threading.Lock()
         self.__fona__ = fona.Fona(logger,
                                   serial_connection,
@@ -244,8 +268,8 @@ class FonaManager(object):
                                   ring_indicator_pin)
         self.__current_battery_state__ = None
         self.__current_signal_strength__ = None
-        self.__update_status_queue__ = MPQueue()
-        self.__send_message_queue__ = MPQueue()
+        self.__update_status_queue__ = Channel()
+        self.__send_message_queue__ = Channel()
 
         # Update the status now as we dont
         # know how long it will be until
@@ -265,14 +289,11 @@ class FonaManager(object):
 
 
 if __name__ == '__main__':
-    import serial
+    import lib.hardware as hardware
 
     PHONE_NUMBER = "2061234567"
 
-    if local_debug.is_debug():
-        SERIAL_CONNECTION = None
-    else:
-        SERIAL_CONNECTION = serial.Serial('/dev/ttyUSB0', 9600)
+    SERIAL_CONNECTION = hardware.open_serial('/dev/ttyUSB0', 9600)
 
     FONA_MANAGER = FonaManager(None,
                                SERIAL_CONNECTION,
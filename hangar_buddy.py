@@ -37,6 +37,7 @@ import logging
 import logging.handlers
 import configuration
 from lib.logger import Logger
+import lib.task_scheduler as task_scheduler
 import command_processor
 
 
@@ -55,4 +56,9 @@ LOGGER.addHandler(HANDLER)
 if __name__ == '__main__':
     COMMAND_PROCESSOR = command_processor.CommandProcessor(
         CONFIGURATION, Logger(LOGGER))
-    COMMAND_PROCESSOR.run_hangar_buddy()
+
+    try:
+        COMMAND_PROCESSOR.run_hangar_buddy()
+    finally:
+        COMMAND_PROCESSOR.close()
+        task_scheduler.shutdown()
@@ -0,0 +1,206 @@
+"""
+Module with a light weight event channel for passing
+messages between threads of the same process.
+
+Unlike multiprocessing.Queue there is no feeder thread,
+no pipe, and no pickling. empty() and qsize() are exact.
+"""
+
+import threading
+import Queue
+import clock
+from collections import deque
+
+
+class Channel(object):
+    """
+    A thread safe FIFO of items.
+
+    >>> channel = Channel()
+    >>> channel.empty()
+    True
+    >>> channel.put("A")
+    >>> channel.put("B")
+    >>> channel.qsize()
+    2
+    >>> channel.get()
+    'A'
+    >>> channel.drain()
+    ['B']
+    >>> channel.get(timeout=0.01)
+    Traceback (most recent call last):
+    ...
+    Empty
+    """
+
+    def put(self, item):
+        """
+        Adds an item and wakes up anyone waiting for one.
+        """
+
+        self.__condition__.acquire()
+        try:
+            self.__items__.append(item)
+            self.__condition__.notify()
+            listeners = list(self.__listeners__)
+        finally:
+            self.__condition__.release()
+
+        # Notify outside of our own lock so select()
+        # can never deadlock against put()
+        for listener in listeners:
+            listener.acquire()
+            try:
+                listener.notify_all()
+            finally:
+                listener.release()
+
+    def get(self, block=True, timeout=None):
+        """
+        Removes and returns the oldest item.
+        Raises Queue.Empty if there is no item in time.
+        """
+
+        self.__condition__.acquire()
+        try:
+            if block:
+                end_time = None if timeout is None else clock.get_time() + timeout
+
+                while not self.__items__:
+                    if end_time is None:
+                        self.__condition__.wait()
+                    else:
+                        remaining = end_time - clock.get_time()
+                        if remaining <= 0:
+                            break
+                        self.__condition__.wait(clock.to_real_seconds(remaining))
+
+            if not self.__items__:
+                raise Queue.Empty
+
+            return self.__items__.popleft()
+        finally:
+            self.__condition__.release()
+
+    def get_nowait(self):
+        """
+        Removes and returns the oldest item without waiting.
+        """
+
+        return self.get(False)
+
+    def drain(self):
+        """
+        Removes and returns all of the items, oldest first.
+        """
+
+        self.__condition__.acquire()
+        try:
+            items = list(self.__items__)
+            self.__items__.clear()
+        finally:
+            self.__condition__.release()
+
+        return items
+
+    def clear(self):
+        """
+        Throws away any items. Returns how many were removed.
+        """
+
+        return len(self.drain())
+
+    def empty(self):
+        """
+        Returns True if there are no items.
+        """
+
+        return len(self.__items__) == 0
+
+    def qsize(self):
+        """
+        Returns the number of items.
+        """
+
+        return len(self.__items__)
+
+    def __add_listener__(self, listener):
+        self.__condition__.acquire()
+        try:
+            self.__listeners__.append(listener)
+        finally:
+            self.__condition__.release()
+
+    def __remove_listener__(self, listener):
+        self.__condition__.acquire()
+        try:
+            self.__listeners__.remove(listener)
+        finally:
+            self.__condition__.release()
+
+    def __init__(self):
+        self.__items__ = deque()
+        self.__condition__ = threading.Condition()
+        self.__listeners__ = []
+
+
+def select(channels, timeout=None):
+    """
+    Waits until at least one of the channels has an item.
+    Returns the list of channels that have items, which is
+    empty if the timeout expired first. Does not remove anything.
+
+    >>> first = Channel()
+    >>> second = Channel()
+    >>> select([first, second], 0.01)
+    []
+    >>> second.put(1)
+    >>> select([first, second]) == [second]
+    True
+    """
+
+    def ready_channels():
+        return [channel for channel in channels if not channel.empty()]
+
+    ready = ready_channels()
+    if ready or (timeout is not None and timeout <= 0):
+        return ready
+
+    listener = threading.Condition()
+    for channel in channels:
+        channel.__add_listener__(listener)
+
+    try:
+        end_time = None if timeout is None else clock.get_time() + timeout
+
+        listener.acquire()
+        try:
+            ready = ready_channels()
+
+            while not ready:
+                if end_time is None:
+                    listener.wait()
+                else:
+                    remaining = end_time - clock.get_time()
+                    if remaining <= 0:
+                        break
+                    listener.wait(clock.to_real_seconds(remaining))
+
+                ready = ready_channels()
+        finally:
+            listener.release()
+    finally:
+        for channel in channels:
+            channel.__remove_listener__(listener)
+
+    return ready
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+
+    print "Tests finished"
@@ -0,0 +1,205 @@
+"""
+Module to give every component the same idea of the time.
+
+The components read the time, sleep and wait through here
+instead of calling time.time() and time.sleep() themselves,
+so the whole application can be run against a clock that is
+faster than the wall clock. A soak test can then cover days
+of the hangar in minutes.
+
+RealClock   The wall clock. The default.
+ScaledClock Starts at the wall clock (or a given time) and
+            runs "speed" times faster.
+
+Timeouts handed to threading waits (Condition.wait, Event.wait)
+are in real seconds, so convert them with to_real_seconds().
+
+Measurements of how long code takes to run, like the I2C
+transaction times and the sensor read deadlines, stay on
+the wall clock.
+"""
+
+import datetime
+import threading
+import time
+
+
+class RealClock(object):
+    """
+    The wall clock.
+    """
+
+    speed = 1.0
+
+    def get_time(self):
+        """
+        Returns the seconds since the epoch.
+        """
+
+        return time.time()
+
+    def sleep(self, seconds):
+        """
+        Sleeps for the given seconds.
+        """
+
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def to_real_seconds(self, seconds):
+        """
+        Returns how many real seconds the given seconds take.
+        """
+
+        return seconds
+
+
+class ScaledClock(object):
+    """
+    A clock that runs at a multiple of the wall clock.
+
+    >>> scaled_clock = ScaledClock(1000.0, start_time=0.0)
+    >>> scaled_clock.to_real_seconds(60.0)
+    0.06
+    >>> 0.0 <= scaled_clock.get_time() < 60.0
+    True
+    """
+
+    def get_time(self):
+        """
+        Returns the seconds since the epoch, on this clock.
+        """
+
+        return self.start_time \
+            + (time.time() - self.__real_start_time__) * self.speed
+
+    def sleep(self, seconds):
+        """
+        Sleeps for the given seconds of this clock.
+        """
+
+        if seconds > 0:
+            time.sleep(self.to_real_seconds(seconds))
+
+    def to_real_seconds(self, seconds):
+        """
+        Returns how many real seconds the given seconds take.
+        """
+
+        return seconds / self.speed
+
+    def __init__(self, speed, start_time=None):
+        """
+        Creates a clock that runs speed times faster than the
+        wall clock. It starts at start_time, or now.
+        """
+
+        if speed <= 0:
+            raise ValueError("The clock speed has to be above zero.")
+
+        self.speed = float(speed)
+        self.__real_start_time__ = time.time()
+        self.start_time = self.__real_start_time__ if start_time is None \
+            else start_time
+
+
+__CLOCKS__ = {"selected": RealClock()}
+__CLOCKS_LOCK__ = threading.Lock()
+
+
+def set_clock(clock):
+    """
+    Selects the clock every component uses from now on.
+    Select it before the components are created.
+    Returns the clock that was selected before.
+    """
+
+    __CLOCKS_LOCK__.acquire()
+    try:
+        previous_clock = __CLOCKS__["selected"]
+        __CLOCKS__["selected"] = clock
+
+        return previous_clock
+    finally:
+        __CLOCKS_LOCK__.release()
+
+
+def get_clock():
+    """
+    Returns the selected clock.
+    """
+
+    return __CLOCKS__["selected"]
+
+
+def get_time():
+    """
+    Returns the seconds since the epoch, like time.time().
+    """
+
+    return get_clock().get_time()
+
+
+def get_now():
+    """
+    Returns the local time as a datetime, like datetime.datetime.now().
+    """
+
+    return datetime.datetime.fromtimestamp(get_clock().get_time())
+
+
+def sleep(seconds):
+    """
+    Sleeps like time.sleep().
+    """
+
+    get_clock().sleep(seconds)
+
+
+def to_real_seconds(seconds):
+    """
+    Returns the real seconds to wait for the given seconds to pass.
+    """
+
+    return get_clock().to_real_seconds(seconds)
+
+
+##############
+# UNIT TESTS #
+##############
+
+def test_scaled_clock():
+    """
+    Test that a selected scaled clock is the one
+    the module functions use.
+    """
+
+    previous_clock = set_clock(ScaledClock(100.0, start_time=1000.0))
+
+    try:
+        start_time = get_time()
+        real_start_time = time.time()
+        sleep(5.0)
+        elapsed = get_time() - start_time
+
+        assert 1000.0 <= start_time < 1001.0
+        assert time.time() - real_start_time < 1.0
+        assert 5.0 <= elapsed < 6.0
+        assert to_real_seconds(10.0) == 0.1
+        assert (get_now() - datetime.datetime.fromtimestamp(1000.0)).total_seconds() < 10
+    finally:
+        set_clock(previous_clock)
+
+    assert isinstance(get_clock(), RealClock)
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+
+    test_scaled_clock()
+
+    print "Tests finished"
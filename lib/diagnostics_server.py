@@ -0,0 +1,94 @@
+"""
+Module to serve diagnostics text over a local socket.
+
+Connect with something like "nc localhost 8740" and send
+the name of a report (ie "STATS"). An empty line lists
+the reports that are available.
+"""
+
+import sys
+import threading
+import SocketServer
+
+DEFAULT_DIAGNOSTICS_PORT = 8740
+LOCALHOST = "127.0.0.1"
+
+
+class DiagnosticsRequestHandler(SocketServer.StreamRequestHandler):
+    """
+    Handles a single diagnostics request.
+    """
+
+    def handle(self):
+        """
+        Reads the report name and writes the report back.
+        """
+
+        report_name = self.rfile.readline().strip().upper()
+        self.wfile.write(self.server.get_report(report_name) + "\n")
+
+
+class DiagnosticsServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """
+    Serves reports from registered providers.
+    Only listens on the loopback interface.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def add_report(self, report_name, report_provider):
+        """
+        Registers a function that returns the report text.
+        """
+
+        self.__report_providers__[report_name.upper()] = report_provider
+
+    def get_report(self, report_name):
+        """
+        Returns the text of the report.
+        """
+
+        if report_name not in self.__report_providers__:
+            return "REPORTS: " + " ".join(sorted(self.__report_providers__.keys()))
+
+        try:
+            return self.__report_providers__[report_name]()
+        except:
+            return "ERROR: " + str(sys.exc_info()[0])
+
+    def start(self):
+        """
+        Starts serving requests on a daemon thread.
+        """
+
+        thread = threading.Thread(target=self.serve_forever,
+                                  name="diagnostics_server")
+        thread.daemon = True
+        thread.start()
+
+        return thread
+
+    def __init__(self, port=DEFAULT_DIAGNOSTICS_PORT):
+        self.__report_providers__ = {}
+        SocketServer.TCPServer.__init__(self,
+                                        (LOCALHOST, port),
+                                        DiagnosticsRequestHandler)
+
+
+if __name__ == '__main__':
+    import socket
+
+    print "Starting tests."
+
+    SERVER = DiagnosticsServer(0)
+    SERVER.add_report("PING", lambda: "PONG")
+    SERVER.start()
+
+    CLIENT = socket.create_connection(SERVER.server_address)
+    CLIENT.sendall("ping\n")
+    assert CLIENT.makefile().readline().strip() == "PONG"
+    CLIENT.close()
+    SERVER.shutdown()
+
+    print "Tests finished"
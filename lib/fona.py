@@ -3,16 +3,17 @@ Module to help with tha AdaFruit Fona modules
 """
 import time
 import threading
-from multiprocessing import Queue as MPQueue
 import datetime
+import clock
 import local_debug
+import hardware
 import utilities
 from logger import Logger
-
-if not local_debug.is_debug():
-    import RPi.GPIO as GPIO
+from recurring_task import RecurringTask
+from channel import Channel
 
 SECONDS_TO_WAIT_AFTER_SEND = 5
+MESSAGE_POLL_INTERVAL = 60
 BATTERY_CRITICAL = 40
 BATTERY_WARNING = 60
 DEFAULT_RESPONSE_READ_TIMEOUT = 5
@@ -176,7 +177,7 @@ class SmsMessage(object):
         self.sender_number = None
         self.message_status = None
         self.message_text = None
-        self.received_time = datetime.datetime.now()
+        self.received_time = clock.get_now()
         self.sent_time = None
 
         try:
@@ -217,14 +218,14 @@ class Fona(object):
         Returns TRUE if the power is on.
         """
 
-        if local_debug.is_debug():
-            return True
-
         if self.__use_gpio_pins__():
-            pin_value = GPIO.input(self.power_status_pin)
+            pin_value = self.__gpio__.input(self.power_status_pin)
             self.__logger__.log_info_message(
                 "Power... PIN=" + str(self.power_status_pin) + ", VAL=" + str(pin_value))
-            return GPIO.input(self.power_status_pin) == GPIO.HIGH
+            return pin_value == self.__gpio__.HIGH
+
+        if local_debug.is_debug():
+            return True
 
         # If we are not using the power pins
         # then use the existance of the serial
@@ -238,6 +239,14 @@ class Fona(object):
 
         return not self.__message_waiting_queue__.empty()
 
+    def get_message_waiting_channel(self):
+        """
+        Returns the channel that gets an event when
+        a message may be waiting.
+        """
+
+        return self.__message_waiting_queue__
+
     def get_carrier(self):
         """
         Returns the carrier.
@@ -261,7 +270,7 @@ class Fona(object):
         Returns an object representing the current battery state.
         """
         self.__logger__.log_info_message("Sending CBC command")
-        time.sleep(5)
+        clock.sleep(5)
         command_result = self.__send_command__("AT+CBC")
 
         for result in command_result:
@@ -320,6 +329,7 @@ class Fona(object):
         """
 
         if self.serial_connection is None:
+            self.__clear_messages_waiting_queue__()
             return []
 
         # put into SMS mode
@@ -327,7 +337,7 @@ class Fona(object):
         self.__set_sms_mode__()
         # get all text messages currently on SIM Card
         self.serial_connection.write('AT+CMGL="ALL"\r')
-        time.sleep(3)
+        clock.sleep(3)
         messages = []
         while self.serial_connection.inWaiting() > 0:
             message_header = self.serial_connection.readline().strip()
@@ -338,7 +348,7 @@ class Fona(object):
                                          message_text)
                 messages.append(new_message)
 
-                time.sleep(1)
+                clock.sleep(1)
 
         self.__clear_messages_waiting_queue__()
 
@@ -412,9 +422,13 @@ class Fona(object):
 
         self.__read_from_fona__(10)
 
-        self.__message_waiting_queue__ = MPQueue()
+        self.__message_waiting_queue__ = Channel()
+        self.__gpio__ = None
         self.__initialize_gpio_pins__()
-        self.__poll_for_messages__()
+        self.__poll_task__ = RecurringTask("poll_for_messages",
+                                           MESSAGE_POLL_INTERVAL,
+                                           self.__poll_for_messages__,
+                                           self.__logger__)
 
     def __use_gpio_pins__(self):
         """
@@ -440,13 +454,14 @@ class Fona(object):
         # a text message is received
         self.__send_command__("AT+CFGRI=1")
 
-        if not local_debug.is_debug():
-            GPIO.setwarnings(False)
-            GPIO.setmode(GPIO.BOARD)
-            GPIO.setup(self.ring_indicator_pin, GPIO.IN)
-            GPIO.setup(self.power_status_pin, GPIO.IN)
-            GPIO.add_event_detect(self.ring_indicator_pin,
-                                  GPIO.RISING, self.__ring_indicator_pulsed__)
+        self.__gpio__ = hardware.get_gpio()
+        self.__gpio__.setwarnings(False)
+        self.__gpio__.setmode(self.__gpio__.BOARD)
+        self.__gpio__.setup(self.ring_indicator_pin, self.__gpio__.IN)
+        self.__gpio__.setup(self.power_status_pin, self.__gpio__.IN)
+        self.__gpio__.add_event_detect(self.ring_indicator_pin,
+                                       self.__gpio__.RISING,
+                                       self.__ring_indicator_pulsed__)
 
         return True
 
@@ -455,7 +470,6 @@ class Fona(object):
         Check for messages every 60 seconds.
         """
         self.__message_waiting_queue__.put("POLL")
-        threading.Timer(60, self.__poll_for_messages__).start()
 
     def __ring_indicator_pulsed__(self, io_pin):
         """
@@ -492,7 +506,7 @@ class Fona(object):
         Read back from the Fona in a safe manner.
         """
         read_buffer = ""
-        start_time = time.time()
+        start_time = clock.get_time()
 
         if self.serial_connection is None:
             return "NOCON"
@@ -500,7 +514,7 @@ class Fona(object):
         self.__logger__.log_info_message("   starting read")
         while self.serial_connection.inWaiting() > 0:
             read_buffer += self.serial_connection.read(1)
-            time_elapsed = time.time() - start_time
+            time_elapsed = clock.get_time() - start_time
             if time_elapsed > response_timeout:
                 self.__logger__.log_warning_message("TIMEOUT")
                 break
@@ -520,7 +534,7 @@ class Fona(object):
 
             if self.serial_connection is not None:
                 self.serial_connection.write(command)
-                time.sleep(2)
+                clock.sleep(2)
 
             ret = []
 
@@ -565,12 +579,12 @@ class Fona(object):
         """
 
         read_text = ""
-        start_time = time.time()
+        start_time = clock.get_time()
 
         while text not in read_text:
             self.__wait_for_command_response__()
             read_text += self.__read_from_fona__(2)
-            elapsed_time = time.time() - start_time
+            elapsed_time = clock.get_time() - start_time
 
             if elapsed_time > 10:
                 self.__logger__.log_warning_message("TIMEOUT")
@@ -586,9 +600,9 @@ class Fona(object):
         if self.serial_connection is None:
             return False
 
-        start_time = time.time()
-        while time.time() - start_time < 2 and self.serial_connection.inWaiting() < 1:
-            time.sleep(0.5)
+        start_time = clock.get_time()
+        while clock.get_time() - start_time < 2 and self.serial_connection.inWaiting() < 1:
+            clock.sleep(0.5)
 
         return self.serial_connection.inWaiting() > 0
 
@@ -609,7 +623,6 @@ class Fona(object):
 
 
 if __name__ == '__main__':
-    import serial
     import logging
 
     if not local_debug.is_debug():
@@ -617,10 +630,7 @@ if __name__ == '__main__':
     else:
         PHONE_NUMBER = "2061234567"
 
-    if local_debug.is_debug():
-        SERIAL_CONNECTION = None
-    else:
-        SERIAL_CONNECTION = serial.Serial('/dev/ttyUSB0', 9600)
+    SERIAL_CONNECTION = hardware.open_serial('/dev/ttyUSB0', 9600)
 
     FONA = Fona(Logger(logging.getLogger("fona")),
                 SERIAL_CONNECTION,
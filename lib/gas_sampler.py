@@ -0,0 +1,239 @@
+"""
+Module to sample the gas sensor several times a second and
+filter out the noise before deciding if there is gas.
+
+Each raw reading goes through a median of the last few readings,
+which throws away single sample spikes, and then an exponentially
+weighted moving average, which smooths what is left. The trigger
+and all clear thresholds are applied to the filtered value.
+"""
+
+import threading
+import clock
+from collections import deque
+
+from gas_sensor import GasHysteresis, GasSensorResult, \
+    DEFAULT_TRIGGER_THRESHOLD, DEFAULT_ALL_CLEAR_THRESHOLD
+from recurring_task import RecurringTask
+from ring_buffer import RingBuffer
+
+DEFAULT_SAMPLE_HZ = 4
+DEFAULT_MEDIAN_WINDOW = 5
+DEFAULT_EWMA_ALPHA = 0.3
+DEFAULT_HISTORY_SECONDS = 60
+
+
+class MedianEwmaFilter(object):
+    """
+    Median of the last median_window samples, followed by an EWMA.
+
+    >>> gas_filter = MedianEwmaFilter(median_window=3, ewma_alpha=0.5)
+    >>> [gas_filter.add(value) for value in [100, 100, 255, 100, 200, 200]]
+    [100.0, 100.0, 100.0, 100.0, 150.0, 175.0]
+    """
+
+    def add(self, value):
+        """
+        Adds a raw sample and returns the new filtered value.
+        """
+
+        self.__window__.append(value)
+        ordered = sorted(self.__window__)
+        median = ordered[len(ordered) / 2]
+
+        if len(ordered) % 2 == 0:
+            median = (median + ordered[len(ordered) / 2 - 1]) / 2.0
+
+        if self.value is None:
+            self.value = float(median)
+        else:
+            self.value += self.ewma_alpha * (median - self.value)
+
+        return self.value
+
+    def __init__(self,
+                 median_window=DEFAULT_MEDIAN_WINDOW,
+                 ewma_alpha=DEFAULT_EWMA_ALPHA):
+        self.median_window = median_window
+        self.ewma_alpha = ewma_alpha
+        self.value = None
+        self.__window__ = deque(maxlen=median_window)
+
+
+class GasSampler(object):
+    """
+    Reads the gas sensor at sample_hz and keeps the recent
+    raw and filtered series.
+
+    detection_callback is called with a GasSensorResult as
+    soon as the filtered value crosses a threshold.
+
+    With a sensor_worker the reads are handed to it, and the
+    samples are added on its thread as they come back.
+    """
+
+    def update(self):
+        """
+        Takes one sample. Called sample_hz times a second.
+        """
+
+        if not self.__gas_sensor__.enabled:
+            return None
+
+        if self.__sensor_worker__ is not None:
+            self.__sensor_worker__.submit(self.__gas_sensor__.read,
+                                          self.__raw_value_read__)
+            return None
+
+        raw_value = self.__gas_sensor__.read()
+
+        if raw_value is None:
+            return None
+
+        return self.add_sample(raw_value, clock.get_time())
+
+    def add_sample(self, raw_value, sample_time):
+        """
+        Filters a raw sample and runs the thresholds on it.
+        Returns the GasSensorResult.
+        """
+
+        self.__lock__.acquire()
+        try:
+            filtered_value = self.__filter__.add(raw_value)
+            was_detected = self.__hysteresis__.is_gas_detected
+            is_detected = self.__hysteresis__.update(filtered_value)
+
+            self.__times__.append(sample_time)
+            self.__raw_values__.append(raw_value)
+            self.__filtered_values__.append(filtered_value)
+
+            self.current_result = GasSensorResult(is_detected,
+                                                  round(filtered_value, 1))
+        finally:
+            self.__lock__.release()
+
+        if is_detected != was_detected and self.__detection_callback__ is not None:
+            self.__detection_callback__(self.current_result)
+
+        return self.current_result
+
+    def __raw_value_read__(self, raw_value):
+        """
+        Called by the sensor worker with a raw reading.
+        """
+
+        self.add_sample(raw_value, clock.get_time())
+
+    def get_raw_series(self):
+        """
+        Returns the recent (time, raw value) samples, oldest first.
+        """
+
+        self.__lock__.acquire()
+        try:
+            return zip(self.__times__.values(), self.__raw_values__.values())
+        finally:
+            self.__lock__.release()
+
+    def get_filtered_series(self):
+        """
+        Returns the recent (time, filtered value) samples, oldest first.
+        """
+
+        self.__lock__.acquire()
+        try:
+            return zip(self.__times__.values(), self.__filtered_values__.values())
+        finally:
+            self.__lock__.release()
+
+    def get_latest_raw_value(self):
+        """
+        Returns the newest raw sample, or None.
+        """
+
+        return self.__raw_values__.get_latest()
+
+    def start(self, logger=None):
+        """
+        Starts sampling on the scheduler.
+        """
+
+        self.__task__ = RecurringTask("__update_gas_sampler__",
+                                      1.0 / self.sample_hz,
+                                      self.update, logger)
+
+    def stop(self):
+        """
+        Stops sampling.
+        """
+
+        if self.__task__ is not None:
+            self.__task__.stop()
+            self.__task__ = None
+
+    def __init__(self,
+                 gas_sensor,
+                 sample_hz=DEFAULT_SAMPLE_HZ,
+                 median_window=DEFAULT_MEDIAN_WINDOW,
+                 ewma_alpha=DEFAULT_EWMA_ALPHA,
+                 detection_callback=None,
+                 history_seconds=DEFAULT_HISTORY_SECONDS,
+                 sensor_worker=None):
+        history_size = int(sample_hz * history_seconds)
+
+        self.sample_hz = sample_hz
+        self.current_result = None
+        self.__gas_sensor__ = gas_sensor
+        self.__filter__ = MedianEwmaFilter(median_window, ewma_alpha)
+        self.__hysteresis__ = GasHysteresis(gas_sensor.sensor_trigger_threshold,
+                                            gas_sensor.sensor_all_clear_threshold)
+        self.__detection_callback__ = detection_callback
+        self.__sensor_worker__ = sensor_worker
+        self.__lock__ = threading.Lock()
+        self.__times__ = RingBuffer(history_size)
+        self.__raw_values__ = RingBuffer(history_size)
+        self.__filtered_values__ = RingBuffer(history_size)
+        self.__task__ = None
+
+
+def replay(raw_values,
+           median_window=DEFAULT_MEDIAN_WINDOW,
+           ewma_alpha=DEFAULT_EWMA_ALPHA,
+           trigger_threshold=DEFAULT_TRIGGER_THRESHOLD,
+           all_clear_threshold=DEFAULT_ALL_CLEAR_THRESHOLD):
+    """
+    Runs a recorded trace of raw values through the filter and
+    thresholds. Returns the list of (sample number, is_detected)
+    changes. A median_window of 1 and ewma_alpha of 1.0 give the
+    unfiltered behavior.
+
+    >>> replay([200, 250, 200, 200, 250, 250, 250, 250, 250, 200, 200],
+    ...        median_window=3, ewma_alpha=1.0)
+    [(5, True), (10, False)]
+    >>> replay([200, 250, 200, 200], median_window=1, ewma_alpha=1.0)
+    [(1, True), (2, False)]
+    """
+
+    gas_filter = MedianEwmaFilter(median_window, ewma_alpha)
+    hysteresis = GasHysteresis(trigger_threshold, all_clear_threshold)
+    changes = []
+
+    for sample_number, raw_value in enumerate(raw_values):
+        was_detected = hysteresis.is_gas_detected
+        is_detected = hysteresis.update(gas_filter.add(raw_value))
+
+        if is_detected != was_detected:
+            changes.append((sample_number, is_detected))
+
+    return changes
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+
+    print "Tests finished"
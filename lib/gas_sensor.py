@@ -1,19 +1,54 @@
 """ Module to help with the gas sensor. """
 
 import time
-import local_debug
-
-if not local_debug.is_debug():
-    import smbus
+from i2c_bus import get_bus
 
 DEFAULT_IC2_BUS = 1
 DEFAULT_IC2_ADDRESS = 0x48
 DEVICE_REG_MODW1 = 0x00
-DEFAULT_CHANNEL_READ_OFFSET = 0x40
 DEFAULT_DEVICE_CHANNEL = 0
+CHANNEL_COUNT = 4
+
+# Analog output (DAC) enabled, auto-increment, starting at channel 0
+AUTO_INCREMENT_CONTROL = 0x44
 DEFAULT_TRIGGER_THRESHOLD = 245
 DEFAULT_ALL_CLEAR_THRESHOLD = 235
 
+
+class GasHysteresis(object):
+    """
+    Decides if gas is detected from a level.
+
+    For the warning to be removed, the level must drop below an
+    all clear level that is lower than the trigger level.
+    This protects against the alarm triggering over and over
+    again if the sensor is close to the detection level.
+
+    >>> hysteresis = GasHysteresis(245, 235)
+    >>> [hysteresis.update(level) for level in [240, 245, 240, 235]]
+    [False, True, True, False]
+    """
+
+    def update(self, level):
+        """
+        Returns True if gas is detected at the level.
+        """
+
+        if self.is_gas_detected:
+            self.is_gas_detected = level > self.all_clear_threshold
+
+        self.is_gas_detected |= level >= self.trigger_threshold
+
+        return self.is_gas_detected
+
+    def __init__(self,
+                 trigger_threshold=DEFAULT_TRIGGER_THRESHOLD,
+                 all_clear_threshold=DEFAULT_ALL_CLEAR_THRESHOLD):
+        self.trigger_threshold = trigger_threshold
+        self.all_clear_threshold = all_clear_threshold
+        self.is_gas_detected = False
+
+
 class GasSensorResult(object):
     """
     Object to handle the results from the gas sensor.
@@ -27,92 +62,127 @@ class GasSensorResult(object):
 class GasSensor(object):
     """
     Class to help with the gas sensor.
+
+    The PCF8591 is read in auto-increment mode, so one block read
+    returns all four analog channels. The gas sensor is on
+    device_channel, and the other channels are free for other
+    analog sensors.
     """
 
     def __init__(self,
                  sensor_trigger_threshold=DEFAULT_TRIGGER_THRESHOLD,
-                 sensor_all_clear_threshold=DEFAULT_ALL_CLEAR_THRESHOLD):
-        print "Starting init"
-
+                 sensor_all_clear_threshold=DEFAULT_ALL_CLEAR_THRESHOLD,
+                 device_channel=DEFAULT_DEVICE_CHANNEL):
         self.enabled = True
 
-        if local_debug.is_debug():
+        try:
+            self.ic2_bus = get_bus(DEFAULT_IC2_BUS)
+        except:
             self.ic2_bus = None
-        else:
-            try:
-                self.ic2_bus = smbus.SMBus(DEFAULT_IC2_BUS)
-            except:
-                self.enabled = False
+            self.enabled = False
 
         self.is_gas_detected = False
         self.sensor_trigger_threshold = sensor_trigger_threshold
         self.sensor_all_clear_threshold = sensor_all_clear_threshold
+        self.device_channel = device_channel
+        self.__hysteresis__ = GasHysteresis(sensor_trigger_threshold,
+                                            sensor_all_clear_threshold)
         self.current_value = DEFAULT_ALL_CLEAR_THRESHOLD
-        self.simulator_direction = 1
+        self.channel_values = [0] * CHANNEL_COUNT
 
-    def __read__(self, read_offset=DEFAULT_CHANNEL_READ_OFFSET):
+        # Last value written to the DAC (the LED)
+        self.__dac_value__ = None
+
+        # For working out the I2C transactions per sample
+        self.i2c_transaction_count = 0
+        self.sample_count = 0
+        self.read_error_count = 0
+
+    def read_channels(self):
         """
-        Read from the ic2 device.
+        Reads all four analog channels in a single transaction.
+        Returns the list of raw values, or None if the ADC can
+        not be read.
         """
 
         if not self.enabled:
             return None
 
-        # Provide a mock/simulator for debugging on Mac/Windows
-        if local_debug.is_debug():
-            bounce_up_threshold = DEFAULT_ALL_CLEAR_THRESHOLD * 0.9
-            bounce_down_threshold = DEFAULT_TRIGGER_THRESHOLD * 1.1
-            if self.simulator_direction < 0 and self.current_value is None \
-                    or (self.current_value <= 0 or self.current_value < bounce_up_threshold):
-                self.simulator_direction = 1
-                self.current_value = DEFAULT_ALL_CLEAR_THRESHOLD * 0.9
-            elif self.simulator_direction > 0 and self.current_value > bounce_down_threshold:
-                self.current_value = (DEFAULT_TRIGGER_THRESHOLD * 1.2)
-                self.simulator_direction = -1
-
-            self.current_value += self.simulator_direction
-            return int(self.current_value)
-
         try:
-            self.ic2_bus.write_byte(DEFAULT_IC2_ADDRESS,
-                                    read_offset)
+            # Writes the control byte, then reads back the byte from
+            # the previous conversion followed by each channel.
+            block = self.ic2_bus.read_i2c_block_data(DEFAULT_IC2_ADDRESS,
+                                                     AUTO_INCREMENT_CONTROL,
+                                                     CHANNEL_COUNT + 1)
+            self.i2c_transaction_count += 1
+            self.sample_count += 1
+            self.channel_values = block[1:]
+
+            self.__update_dac__(self.channel_values[self.device_channel])
+
+            return self.channel_values
+        except:
+            # A bad read is not the end of the sensor. The caller
+            # decides when to stop trying.
+            self.read_error_count += 1
+            return None
+
+    def get_transactions_per_sample(self):
+        """
+        Returns the average number of I2C transactions each
+        sample has taken.
+        """
 
-            # Needs a "dummy read" for the conversion to happen
-            # The write back needs to compress the range of values
-            # from 0-255 to 125 to 255.
-            # This makes the LED light up
-            self.ic2_bus.read_byte(DEFAULT_IC2_ADDRESS)
+        if self.sample_count == 0:
+            return 0.0
 
-            raw_value = self.ic2_bus.read_byte(DEFAULT_IC2_ADDRESS)
-            converted_value = raw_value * (255.0 - 125.0) / 255.0 + 125.0
-            print "RAW=" + str(raw_value) + ", CONV=" + str(converted_value)
+        return self.i2c_transaction_count / float(self.sample_count)
 
-            self.ic2_bus.write_byte_data(
-                DEFAULT_IC2_ADDRESS, 0x40, int(converted_value))
+    def __update_dac__(self, raw_value):
+        """
+        Drives the LED from the gas level. The value is compressed
+        from 0-255 to 125-255 so the LED lights up, and is only
+        written when it changes.
+        """
 
-            return raw_value
-        except:
-            self.enabled = False
+        dac_value = int(raw_value * (255.0 - 125.0) / 255.0 + 125.0)
+
+        if dac_value == self.__dac_value__:
+            return
+
+        self.ic2_bus.write_byte_data(DEFAULT_IC2_ADDRESS,
+                                     AUTO_INCREMENT_CONTROL,
+                                     dac_value)
+        self.i2c_transaction_count += 1
+        self.__dac_value__ = dac_value
+
+    def read(self, channel=None):
+        """
+        Returns a single raw reading of the channel (the gas
+        sensor by default), or None if the sensor can not be read.
+        """
+
+        if channel is None:
+            channel = self.device_channel
+
+        channel_values = self.read_channels()
+
+        if channel_values is None:
             return None
 
-    def update(self, read_offset=DEFAULT_CHANNEL_READ_OFFSET):
+        return channel_values[channel]
+
+    def update(self):
         """
         Attempts to look for gas.
         """
 
-        self.current_value = self.__read__(read_offset)
+        self.current_value = self.read()
 
         if self.current_value is None or not self.enabled:
             return GasSensorResult(False, DEFAULT_ALL_CLEAR_THRESHOLD) 
 
-        # For the warning to be removed, it must drop below an
-        # all clear level that is lower than the trigger level.
-        # This protects against the alarm triggering over and over
-        # again if the sensor is close to the detection level.
-        if self.is_gas_detected:
-            self.is_gas_detected = self.current_value > self.sensor_all_clear_threshold
-
-        self.is_gas_detected |= self.current_value >= self.sensor_trigger_threshold
+        self.is_gas_detected = self.__hysteresis__.update(self.current_value)
 
         return GasSensorResult(self.is_gas_detected, self.current_value)
 
@@ -123,5 +193,7 @@ if __name__ == '__main__':
     while SENSOR.enabled:
         IS_GAS_DETECTED = SENSOR.update()
         print "LVL:" + str(IS_GAS_DETECTED.current_value) + ", " \
-            + str(IS_GAS_DETECTED.is_gas_detected)
+            + str(IS_GAS_DETECTED.is_gas_detected) + ", CH:" \
+            + str(SENSOR.channel_values) + ", I2C/sample:" \
+            + str(round(SENSOR.get_transactions_per_sample(), 2))
         time.sleep(0.2)
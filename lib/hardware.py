@@ -0,0 +1,500 @@
+"""
+Module to pick the hardware that the drivers talk to.
+
+The drivers get their GPIO, I2C buses, serial port and 1-Wire
+files from here instead of importing RPi.GPIO, smbus and serial
+themselves, so the whole application can run without a Raspberry
+Pi. The backends are:
+
+real       The Raspberry Pi. The default on Linux.
+simulated  Devices that follow scripted waveforms, or replay a CSV.
+           The default on a Mac or Windows.
+recording  The real hardware, with every call written to a CSV.
+
+The backend comes from the HARDWARE setting, unless the
+HANGARBUDDY_HARDWARE environment variable is set. It has to be
+selected before the drivers are created.
+"""
+
+import csv
+import os
+import sys
+import threading
+import time
+
+import local_debug
+
+REAL = "real"
+SIMULATED = "simulated"
+RECORDING = "recording"
+BACKEND_NAMES = [REAL, SIMULATED, RECORDING]
+
+BACKEND_ENVIRONMENT_VARIABLE = "HANGARBUDDY_HARDWARE"
+WAVEFORMS_ENVIRONMENT_VARIABLE = "HANGARBUDDY_HARDWARE_WAVEFORMS"
+REPLAY_ENVIRONMENT_VARIABLE = "HANGARBUDDY_HARDWARE_REPLAY"
+RECORDING_ENVIRONMENT_VARIABLE = "HANGARBUDDY_HARDWARE_RECORDING"
+
+DEFAULT_RECORDING_FILE = "hardware.csv"
+
+
+class SysfsFiles(object):
+    """
+    The files the kernel drivers expose, ie the 1-Wire bus.
+    """
+
+    def list_directory(self, path):
+        return os.listdir(path)
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def read_file(self, path):
+        with open(path, "r") as sysfs_file:
+            return sysfs_file.read()
+
+    def write_file(self, path, text):
+        with open(path, "w") as sysfs_file:
+            sysfs_file.write(text + "\n")
+
+
+class RealBackend(object):
+    """
+    The GPIO, I2C and 1-Wire of the Raspberry Pi.
+    """
+
+    name = REAL
+
+    def get_gpio(self):
+        """
+        Returns the RPi.GPIO module.
+        """
+
+        import RPi.GPIO as GPIO
+
+        return GPIO
+
+    def open_smbus(self, bus_id):
+        """
+        Opens an SMBus.
+        """
+
+        import smbus
+
+        return smbus.SMBus(bus_id)
+
+    def open_serial(self, port, baud_rate):
+        """
+        Opens a serial port. Requires "pyserial".
+        """
+
+        import serial
+
+        return serial.Serial(port, baud_rate)
+
+    def get_sysfs(self):
+        return self.__sysfs__
+
+    def close(self):
+        pass
+
+    def __init__(self):
+        self.__sysfs__ = SysfsFiles()
+
+
+def format_value(value):
+    """
+    Returns the text a value is recorded as.
+
+    >>> format_value([1, 0x29])
+    '[1 41]'
+    >>> format_value(format_value)
+    'format_value'
+    >>> format_value(None)
+    ''
+    """
+
+    if value is None:
+        return ""
+
+    if isinstance(value, (list, tuple)):
+        return "[" + " ".join([format_value(item) for item in value]) + "]"
+
+    if callable(value):
+        return getattr(value, "__name__", "callback")
+
+    return str(value).strip()
+
+
+class Recorder(object):
+    """
+    Writes each hardware call as a CSV row of
+    seconds,interface,operation,arguments,result
+
+    An operation that raised has "!" and the exception
+    name as its result.
+    """
+
+    def record(self, interface_name, operation_name, arguments, result):
+        """
+        Writes one call.
+        """
+
+        row = [round(self.__clock__() - self.start_time, 6),
+               interface_name,
+               operation_name,
+               " ".join([format_value(argument) for argument in arguments]),
+               format_value(result)]
+
+        self.__lock__.acquire()
+        try:
+            if self.__file__ is None:
+                return
+
+            self.__writer__.writerow(row)
+            self.__file__.flush()
+            self.row_count += 1
+        finally:
+            self.__lock__.release()
+
+    def close(self):
+        """
+        Closes the file.
+        """
+
+        self.__lock__.acquire()
+        try:
+            if self.__file__ is not None:
+                self.__file__.close()
+                self.__file__ = None
+        finally:
+            self.__lock__.release()
+
+    def __init__(self, recording_file, clock=time.time):
+        self.recording_file = recording_file
+        self.row_count = 0
+        self.__clock__ = clock
+        self.start_time = clock()
+        self.__lock__ = threading.Lock()
+        self.__file__ = open(recording_file, "wb")
+        self.__writer__ = csv.writer(self.__file__)
+        self.__writer__.writerow(["seconds", "interface", "operation",
+                                  "arguments", "result"])
+
+
+class RecordingProxy(object):
+    """
+    Passes every call on to the target, and records it.
+    Constants, like GPIO.HIGH, are passed through. Callbacks
+    given to the target, like an edge callback, are recorded
+    when they are called.
+    """
+
+    def __getattr__(self, name):
+        attribute = getattr(self.__target__, name)
+
+        if not callable(attribute):
+            return attribute
+
+        def record_call(*arguments, **keywords):
+            arguments = [self.__wrap_callback__(argument) for argument in arguments]
+            keywords = dict([(keyword, self.__wrap_callback__(value))
+                             for keyword, value in keywords.items()])
+            recorded_arguments = arguments \
+                + [keyword + "=" + format_value(keywords[keyword])
+                   for keyword in sorted(keywords.keys())]
+
+            try:
+                result = attribute(*arguments, **keywords)
+            except:
+                self.__recorder__.record(self.__interface_name__, name,
+                                         recorded_arguments,
+                                         "!" + sys.exc_info()[0].__name__)
+                raise
+
+            self.__recorder__.record(self.__interface_name__, name,
+                                     recorded_arguments, result)
+
+            return result
+
+        return record_call
+
+    def __wrap_callback__(self, argument):
+        """
+        Returns a callback that records its calls.
+        """
+
+        if not callable(argument):
+            return argument
+
+        def record_callback(*arguments):
+            self.__recorder__.record(self.__interface_name__,
+                                     format_value(argument),
+                                     arguments, None)
+
+            return argument(*arguments)
+
+        record_callback.__name__ = format_value(argument)
+
+        return record_callback
+
+    def __init__(self, target, interface_name, recorder):
+        self.__target__ = target
+        self.__interface_name__ = interface_name
+        self.__recorder__ = recorder
+
+
+class RecordingBackend(object):
+    """
+    Another backend (the real one by default), with every
+    call written to recording_file.
+    """
+
+    name = RECORDING
+
+    def get_gpio(self):
+        if self.__gpio__ is None:
+            self.__gpio__ = RecordingProxy(self.source_backend.get_gpio(),
+                                           "GPIO", self.recorder)
+
+        return self.__gpio__
+
+    def open_smbus(self, bus_id):
+        return RecordingProxy(self.source_backend.open_smbus(bus_id),
+                              "I2C" + str(bus_id), self.recorder)
+
+    def open_serial(self, port, baud_rate):
+        return RecordingProxy(self.source_backend.open_serial(port, baud_rate),
+                              "SERIAL", self.recorder)
+
+    def get_sysfs(self):
+        return self.__sysfs__
+
+    def close(self):
+        self.recorder.close()
+        self.source_backend.close()
+
+    def __init__(self, source_backend, recording_file=DEFAULT_RECORDING_FILE):
+        self.source_backend = source_backend
+        self.recorder = Recorder(recording_file)
+        self.__gpio__ = None
+        self.__sysfs__ = RecordingProxy(source_backend.get_sysfs(), "SYSFS",
+                                        self.recorder)
+
+
+def get_default_backend_name():
+    """
+    Returns the backend to use when none is set.
+    """
+
+    if local_debug.is_debug():
+        return SIMULATED
+
+    return REAL
+
+
+def create_backend(backend_name,
+                   waveform_definitions=None,
+                   replay_file=None,
+                   recording_file=None,
+                   light_interrupt_pin=None,
+                   ring_indicator_pin=None):
+    """
+    Creates a backend. Raises ValueError for an unknown name.
+    """
+
+    if backend_name == REAL:
+        return RealBackend()
+
+    if backend_name == SIMULATED:
+        from simulated_hardware import SimulatedBackend
+
+        return SimulatedBackend(waveform_definitions, replay_file,
+                                light_interrupt_pin=light_interrupt_pin,
+                                ring_indicator_pin=ring_indicator_pin)
+
+    if backend_name == RECORDING:
+        if recording_file is None:
+            recording_file = DEFAULT_RECORDING_FILE
+
+        return RecordingBackend(RealBackend(), recording_file)
+
+    raise ValueError("Unknown hardware backend " + str(backend_name))
+
+
+__BACKENDS__ = {}
+__BACKENDS_LOCK__ = threading.Lock()
+
+
+def select_backend(backend_name=None,
+                   waveform_definitions=None,
+                   replay_file=None,
+                   recording_file=None,
+                   light_interrupt_pin=None,
+                   ring_indicator_pin=None):
+    """
+    Selects the backend every driver created from now on uses.
+    The environment variables win over the arguments.
+    Returns the backend.
+    """
+
+    backend_name = os.environ.get(BACKEND_ENVIRONMENT_VARIABLE, backend_name)
+    waveform_definitions = os.environ.get(WAVEFORMS_ENVIRONMENT_VARIABLE,
+                                          waveform_definitions)
+    replay_file = os.environ.get(REPLAY_ENVIRONMENT_VARIABLE, replay_file)
+    recording_file = os.environ.get(RECORDING_ENVIRONMENT_VARIABLE,
+                                    recording_file)
+
+    if not backend_name:
+        backend_name = get_default_backend_name()
+
+    backend = create_backend(backend_name.strip().lower(),
+                             waveform_definitions,
+                             replay_file,
+                             recording_file,
+                             light_interrupt_pin,
+                             ring_indicator_pin)
+
+    __BACKENDS_LOCK__.acquire()
+    try:
+        if "selected" in __BACKENDS__:
+            __BACKENDS__["selected"].close()
+
+        __BACKENDS__["selected"] = backend
+    finally:
+        __BACKENDS_LOCK__.release()
+
+    return backend
+
+
+def get_backend():
+    """
+    Returns the selected backend. Selects the default
+    (or the environment's) if none has been.
+    """
+
+    __BACKENDS_LOCK__.acquire()
+    try:
+        backend = __BACKENDS__.get("selected")
+    finally:
+        __BACKENDS_LOCK__.release()
+
+    if backend is None:
+        backend = select_backend()
+
+    return backend
+
+
+def close_backend():
+    """
+    Closes the selected backend, ie finishes the recording.
+    """
+
+    __BACKENDS_LOCK__.acquire()
+    try:
+        backend = __BACKENDS__.pop("selected", None)
+    finally:
+        __BACKENDS_LOCK__.release()
+
+    if backend is not None:
+        backend.close()
+
+
+def get_gpio():
+    """
+    Returns the GPIO, with the interface of RPi.GPIO.
+    """
+
+    return get_backend().get_gpio()
+
+
+def open_smbus(bus_id):
+    """
+    Opens an I2C bus, with the interface of smbus.SMBus.
+    Raises if there is no such bus.
+    """
+
+    return get_backend().open_smbus(bus_id)
+
+
+def open_serial(port, baud_rate):
+    """
+    Opens a serial port, with the interface of serial.Serial.
+    Raises if the port can not be opened.
+    """
+
+    return get_backend().open_serial(port, baud_rate)
+
+
+def get_sysfs():
+    """
+    Returns the SysfsFiles of the kernel drivers.
+    """
+
+    return get_backend().get_sysfs()
+
+
+##############
+# UNIT TESTS #
+##############
+
+def test_recording():
+    """
+    Test that the recording backend writes down the
+    calls it passes on, and their callbacks.
+    """
+
+    import tempfile
+    from simulated_hardware import SimulatedBackend
+
+    recording_file = tempfile.mktemp(suffix=".csv")
+    backend = RecordingBackend(SimulatedBackend("PIN18:constant:0",
+                                                tick_seconds=None),
+                               recording_file)
+    edges = []
+
+    try:
+        gpio = backend.get_gpio()
+        gpio.setup(18, gpio.IN, pull_up_down=gpio.PUD_UP)
+        gpio.add_event_detect(18, gpio.FALLING, edges.append)
+        backend.source_backend.update()
+        assert gpio.input(18) == gpio.LOW
+        assert edges == [18]
+
+        bus = backend.open_smbus(1)
+        bus.write_byte(0x27, 0x08)
+
+        try:
+            bus.read_byte(0x10)
+            assert False
+        except IOError:
+            pass
+
+        backend.close()
+
+        with open(recording_file, "rb") as recording:
+            rows = list(csv.reader(recording))
+
+        assert rows[0] == ["seconds", "interface", "operation",
+                           "arguments", "result"]
+        assert [row[1:3] for row in rows[1:]] == [
+            ["GPIO", "setup"], ["GPIO", "add_event_detect"],
+            ["GPIO", "append"], ["GPIO", "input"],
+            ["I2C1", "write_byte"], ["I2C1", "read_byte"]]
+        assert rows[1][3] == "18 1 pull_up_down=22"
+        assert rows[4][4] == "0"
+        assert rows[6][4] == "!IOError"
+    finally:
+        backend.close()
+        os.remove(recording_file)
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+
+    test_recording()
+
+    print "Tests finished"
@@ -0,0 +1,353 @@
+"""
+Module to share an I2C bus between the drivers.
+
+The gas sensor, light sensor and LCD are all on bus 1, and are
+driven from different threads. Every transaction goes through
+the one I2cBus for the bus, which only lets one run at a time.
+A driver that needs several transactions in a row without
+another device in between can hold the bus for the whole
+sequence with transaction(). The LCD does not need to, as
+each of its block writes carries whole nibbles, and the
+PCF8574 keeps its pins as they are between writes.
+
+The time each device spends on the bus, and waiting for it,
+is kept for the STATS report.
+"""
+
+import threading
+import time
+
+import hardware
+from ring_buffer import RingBuffer
+
+DEFAULT_BUS = 1
+
+# How many transactions of each device are kept for the metrics
+DEFAULT_METRICS_SAMPLES = 256
+
+
+class DeviceStats(object):
+    """
+    Transaction counts and latencies of one device.
+
+    >>> stats = DeviceStats(0x29)
+    >>> stats.add(0.0004, 0.0001)
+    >>> stats.add(0.0012, 0.0, is_error=True)
+    >>> stats.get_stats_text()
+    '0x29:n=2 bus=0.8/1.2ms wait=0.05/0.1ms err=1'
+    """
+
+    def add(self, bus_seconds, wait_seconds, is_error=False):
+        """
+        Records one transaction.
+        """
+
+        self.transaction_count += 1
+        self.bus_times.append(bus_seconds)
+        self.wait_times.append(wait_seconds)
+
+        if is_error:
+            self.error_count += 1
+
+    def get_stats_text(self):
+        """
+        Returns a one line summary. Times are mean/max in milliseconds.
+        """
+
+        if self.transaction_count == 0:
+            return hex(self.address) + ":n=0"
+
+        return hex(self.address) + ":n=" + str(self.transaction_count) \
+            + " bus=" + __to_ms__(self.bus_times.get_mean()) \
+            + "/" + __to_ms__(self.bus_times.get_max()) + "ms" \
+            + " wait=" + __to_ms__(self.wait_times.get_mean()) \
+            + "/" + __to_ms__(self.wait_times.get_max()) + "ms" \
+            + " err=" + str(self.error_count)
+
+    def __init__(self, address):
+        self.address = address
+        self.transaction_count = 0
+        self.error_count = 0
+        self.bus_times = RingBuffer(DEFAULT_METRICS_SAMPLES)
+        self.wait_times = RingBuffer(DEFAULT_METRICS_SAMPLES)
+
+
+def __to_ms__(seconds):
+    """
+    Formats seconds as milliseconds, to a hundredth of a millisecond.
+
+    >>> __to_ms__(0.01234)
+    '12.34'
+    """
+
+    return str(round(seconds * 1000, 2))
+
+
+class I2cTransaction(object):
+    """
+    Holds the bus for a sequence of transactions with one device.
+    Use I2cBus.transaction() in a "with" statement.
+    """
+
+    def __enter__(self):
+        self.__bus__.acquire(self.address)
+        return self.__bus__
+
+    def __exit__(self, exception_type, exception_value, exception_traceback):
+        self.__bus__.release()
+        return False
+
+    def __init__(self, bus, address):
+        self.__bus__ = bus
+        self.address = address
+
+
+class I2cBus(object):
+    """
+    Owns an SMBus and serialises every transaction on it.
+
+    The methods are the smbus ones the drivers use. The SMBus
+    comes from the hardware backend, so it may be simulated.
+    """
+
+    def transaction(self, address):
+        """
+        Returns a context that holds the bus for a sequence
+        of transactions with the device at address.
+        """
+
+        return I2cTransaction(self, address)
+
+    def read_byte(self, address):
+        return self.__run__(address, "read_byte", address)
+
+    def write_byte(self, address, value):
+        return self.__run__(address, "write_byte", address, value)
+
+    def read_byte_data(self, address, register):
+        return self.__run__(address, "read_byte_data", address, register)
+
+    def write_byte_data(self, address, register, value):
+        return self.__run__(address, "write_byte_data", address, register, value)
+
+    def read_i2c_block_data(self, address, register, length):
+        return self.__run__(address, "read_i2c_block_data", address, register, length)
+
+    def write_i2c_block_data(self, address, register, data):
+        return self.__run__(address, "write_i2c_block_data", address, register, data)
+
+    def get_device_stats(self, address):
+        """
+        Returns the DeviceStats of a device.
+        """
+
+        self.__stats_lock__.acquire()
+        try:
+            if address not in self.__device_stats__:
+                self.__device_stats__[address] = DeviceStats(address)
+
+            return self.__device_stats__[address]
+        finally:
+            self.__stats_lock__.release()
+
+    def get_stats_text(self):
+        """
+        Returns the transaction summary of each device,
+        one line per device.
+        """
+
+        self.__stats_lock__.acquire()
+        try:
+            addresses = sorted(self.__device_stats__.keys())
+        finally:
+            self.__stats_lock__.release()
+
+        return "\n".join(["I2C" + str(self.bus_id) + " "
+                          + self.get_device_stats(address).get_stats_text()
+                          for address in addresses])
+
+    def acquire(self, address):
+        """
+        Takes the bus. Returns how long it took to get it.
+        Prefer transaction().
+        """
+
+        start_time = time.time()
+        self.__lock__.acquire()
+
+        if self.__holder_depth__ == 0:
+            self.__holder_address__ = address
+            self.__wait_seconds__ = time.time() - start_time
+
+        self.__holder_depth__ += 1
+
+        return self.__wait_seconds__
+
+    def release(self):
+        """
+        Gives the bus back.
+        """
+
+        self.__holder_depth__ -= 1
+
+        if self.__holder_depth__ == 0:
+            self.__holder_address__ = None
+
+        self.__lock__.release()
+
+    def __run__(self, address, operation_name, *arguments):
+        """
+        Runs one smbus operation while holding the bus,
+        and records it against the device.
+        """
+
+        wait_seconds = self.acquire(address)
+        is_error = True
+        start_time = time.time()
+
+        try:
+            result = getattr(self.__smbus__, operation_name)(*arguments)
+            is_error = False
+
+            return result
+        finally:
+            # Only the first transaction of a sequence waited
+            self.__wait_seconds__ = 0.0
+            self.release()
+            self.get_device_stats(address).add(time.time() - start_time,
+                                               wait_seconds, is_error)
+
+    def __init__(self, bus_id=DEFAULT_BUS, sm_bus=None):
+        """
+        Opens the bus. Use get_bus() so the drivers share it.
+        sm_bus replaces the SMBus of the hardware backend.
+        """
+
+        self.bus_id = bus_id
+        self.__smbus__ = sm_bus
+
+        if self.__smbus__ is None:
+            self.__smbus__ = hardware.open_smbus(bus_id)
+
+        self.__lock__ = threading.RLock()
+        self.__holder_address__ = None
+        self.__holder_depth__ = 0
+        self.__wait_seconds__ = 0.0
+        self.__stats_lock__ = threading.Lock()
+        self.__device_stats__ = {}
+
+
+__BUSES__ = {}
+__BUSES_LOCK__ = threading.Lock()
+
+
+def get_bus(bus_id=DEFAULT_BUS):
+    """
+    Returns the I2cBus shared by every driver on the bus.
+    Raises if the bus can not be opened.
+    """
+
+    __BUSES_LOCK__.acquire()
+    try:
+        if bus_id not in __BUSES__:
+            __BUSES__[bus_id] = I2cBus(bus_id)
+
+        return __BUSES__[bus_id]
+    finally:
+        __BUSES_LOCK__.release()
+
+
+def get_stats_text():
+    """
+    Returns the transaction summary of every bus that is open.
+    """
+
+    __BUSES_LOCK__.acquire()
+    try:
+        buses = [__BUSES__[bus_id] for bus_id in sorted(__BUSES__.keys())]
+    finally:
+        __BUSES_LOCK__.release()
+
+    return "\n".join([bus.get_stats_text() for bus in buses
+                      if bus.get_stats_text()])
+
+
+##############
+# UNIT TESTS #
+##############
+
+class __RecordingSmBus__(object):
+    """
+    Stands in for an SMBus, and remembers what was written.
+    """
+
+    def write_byte(self, address, value):
+        self.writes.append((threading.current_thread().name, value))
+        time.sleep(0.0005)
+
+    def __init__(self):
+        self.writes = []
+
+
+def test_sequences_are_not_split():
+    """
+    Test that a sequence of writes from one thread is not
+    interleaved with the writes of another.
+    """
+
+    sm_bus = __RecordingSmBus__()
+    bus = I2cBus(0, sm_bus)
+
+    def write_sequences():
+        for _ in range(5):
+            with bus.transaction(0x27):
+                for value in range(4):
+                    bus.write_byte(0x27, value)
+
+    threads = [threading.Thread(target=write_sequences, name=str(number))
+               for number in range(3)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert len(sm_bus.writes) == 60
+
+    for index in range(0, 60, 4):
+        sequence = sm_bus.writes[index:index + 4]
+        assert [value for _, value in sequence] == [0, 1, 2, 3]
+        assert len(set([name for name, _ in sequence])) == 1
+
+    assert bus.get_device_stats(0x27).transaction_count == 60
+
+
+def test_errors_are_counted():
+    """
+    Test that a failed transaction is counted and raised.
+    """
+
+    bus = I2cBus(0, __RecordingSmBus__())
+
+    try:
+        bus.read_byte(0x29)
+        assert False
+    except AttributeError:
+        pass
+
+    assert bus.get_device_stats(0x29).error_count == 1
+    assert bus.get_stats_text().startswith("I2C0 0x29:n=1")
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+
+    test_sequences_are_not_split()
+    test_errors_are_counted()
+
+    print "Tests finished"
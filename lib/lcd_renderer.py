@@ -0,0 +1,474 @@
+"""
+Module to draw the status pages on the LCD from their own thread.
+
+The pages are registered by name, each with a function that
+builds its text. refresh() builds and caches the text of every
+page, on the thread that calls it, so a page that is slow or
+raises never holds up the screen. The render thread rotates
+through the cached pages in the configured order, showing each
+for its duration, and skips a page whose text is None.
+
+Frames reach the render thread through a slot that only holds
+the latest one. If a frame is put before the last one was drawn,
+the last one is dropped, so the screen never falls behind.
+
+The HD44780 has room for eight custom characters. GLYPHS are
+stored in it when the renderer starts, so a page can show signal
+bars, the battery, the heater flame and gas in one cell each.
+"""
+
+import sys
+import threading
+import clock
+
+DEFAULT_PAGES = "SUMMARY:5, SIGNAL:5, HEATER:5, GAS:5, LIGHT:5, TEMP:5, UPTIME:5"
+
+# How long to wait before looking again when no page has text
+NO_PAGE_RETRY_SECONDS = 1.0
+
+# The custom characters, shown by writing the character.
+# Rows are top down, five bits each. The last row is left
+# empty, as that is where the cursor would be.
+SIGNAL_1 = chr(0)
+SIGNAL_2 = chr(1)
+SIGNAL_3 = chr(2)
+BATTERY_FULL = chr(3)
+BATTERY_HALF = chr(4)
+BATTERY_LOW = chr(5)
+FLAME = chr(6)
+GAS = chr(7)
+
+GLYPHS = {
+    SIGNAL_1: [0x00, 0x00, 0x00, 0x00, 0x00, 0x10, 0x10, 0x00],
+    SIGNAL_2: [0x00, 0x00, 0x00, 0x04, 0x04, 0x14, 0x14, 0x00],
+    SIGNAL_3: [0x01, 0x01, 0x01, 0x05, 0x05, 0x15, 0x15, 0x00],
+    BATTERY_FULL: [0x0E, 0x1F, 0x1F, 0x1F, 0x1F, 0x1F, 0x1F, 0x00],
+    BATTERY_HALF: [0x0E, 0x11, 0x11, 0x11, 0x1F, 0x1F, 0x1F, 0x00],
+    BATTERY_LOW: [0x0E, 0x11, 0x11, 0x11, 0x11, 0x11, 0x1F, 0x00],
+    FLAME: [0x04, 0x04, 0x0A, 0x0A, 0x11, 0x15, 0x0E, 0x00],
+    GAS: [0x08, 0x15, 0x02, 0x00, 0x08, 0x15, 0x02, 0x00]
+}
+
+
+def get_signal_glyph(signal_strength):
+    """
+    Returns the signal bars for a CSQ reading, using the
+    same steps as the Fona's classification.
+
+    >>> [get_signal_glyph(csq) for csq in [None, 0, 99, 5, 12, 25]]
+    ['?', 'x', 'x', '\\x00', '\\x01', '\\x02']
+    """
+
+    if signal_strength is None:
+        return "?"
+
+    if signal_strength <= 0 or signal_strength == 99:
+        return "x"
+
+    if signal_strength <= 9:
+        return SIGNAL_1
+
+    if signal_strength <= 14:
+        return SIGNAL_2
+
+    return SIGNAL_3
+
+
+def get_battery_glyph(percent):
+    """
+    Returns the battery for the percent of charge.
+
+    >>> [get_battery_glyph(percent) for percent in [95, 50, 10]]
+    ['\\x03', '\\x04', '\\x05']
+    """
+
+    if percent >= 70:
+        return BATTERY_FULL
+
+    if percent >= 30:
+        return BATTERY_HALF
+
+    return BATTERY_LOW
+
+
+class FrameSlot(object):
+    """
+    Holds the latest frame for the render thread.
+
+    >>> slot = FrameSlot()
+    >>> slot.put("A")
+    >>> slot.put("B")
+    >>> slot.take(0)
+    'B'
+    >>> slot.take(0.01) is None
+    True
+    >>> slot.dropped_count
+    1
+    """
+
+    def put(self, frame):
+        """
+        Replaces the frame in the slot, and wakes the taker.
+        """
+
+        self.__condition__.acquire()
+        try:
+            if self.__has_frame__:
+                self.dropped_count += 1
+
+            self.__frame__ = frame
+            self.__has_frame__ = True
+            self.__condition__.notify()
+        finally:
+            self.__condition__.release()
+
+    def take(self, timeout=None):
+        """
+        Removes and returns the frame. Waits up to timeout
+        seconds for one, or until wake() is called, and
+        returns None if there is none by then.
+        """
+
+        self.__condition__.acquire()
+        try:
+            if not self.__has_frame__ and not self.__is_woken__ \
+                    and (timeout is None or timeout > 0):
+                if timeout is None:
+                    self.__condition__.wait()
+                else:
+                    self.__condition__.wait(clock.to_real_seconds(timeout))
+
+            self.__is_woken__ = False
+
+            if not self.__has_frame__:
+                return None
+
+            frame = self.__frame__
+            self.__frame__ = None
+            self.__has_frame__ = False
+
+            return frame
+        finally:
+            self.__condition__.release()
+
+    def wake(self):
+        """
+        Makes take() return, even without a frame.
+        """
+
+        self.__condition__.acquire()
+        try:
+            self.__is_woken__ = True
+            self.__condition__.notify()
+        finally:
+            self.__condition__.release()
+
+    def __init__(self):
+        self.dropped_count = 0
+        self.__condition__ = threading.Condition()
+        self.__frame__ = None
+        self.__has_frame__ = False
+        self.__is_woken__ = False
+
+
+class LcdRenderer(object):
+    """
+    Draws the pages, and any message shown, on the LCD
+    from its own thread.
+    """
+
+    def register_page(self, name, build_text):
+        """
+        Adds a page. build_text returns the text of the page,
+        rows split by a new line, or None to skip the page.
+        Only the pages in the configured order are shown.
+        """
+
+        self.__lock__.acquire()
+        try:
+            self.__page_builders__[name] = build_text
+        finally:
+            self.__lock__.release()
+
+    def refresh(self):
+        """
+        Builds and caches the text of every page that is shown.
+        A page that raises shows an error instead.
+        """
+
+        for name, _ in self.pages:
+            build_text = self.__page_builders__.get(name)
+
+            if build_text is None:
+                continue
+
+            try:
+                page_text = build_text()
+            except:
+                page_text = name + "\nERROR"
+                self.error_count += 1
+
+                if self.__logger__ is not None:
+                    self.__logger__.log_warning_message(
+                        "LCD page " + name + " failed: "
+                        + str(sys.exc_info()[0].__name__))
+
+            self.__lock__.acquire()
+            try:
+                self.__page_texts__[name] = page_text
+            finally:
+                self.__lock__.release()
+
+    def get_page_text(self, name):
+        """
+        Returns the cached text of a page.
+        """
+
+        self.__lock__.acquire()
+        try:
+            return self.__page_texts__.get(name)
+        finally:
+            self.__lock__.release()
+
+    def show(self, text):
+        """
+        Puts the text on the screen straight away, and holds
+        the rotation until start_rotation() is called.
+        """
+
+        self.__lock__.acquire()
+        try:
+            self.__is_rotating__ = False
+        finally:
+            self.__lock__.release()
+
+        self.__slot__.put(text)
+
+    def start_rotation(self, delay_seconds=0):
+        """
+        Starts, or goes back to, rotating through the pages.
+        The next page is shown after the delay.
+        """
+
+        self.__lock__.acquire()
+        try:
+            self.__is_rotating__ = True
+            self.__next_page_time__ = clock.get_time() + delay_seconds
+        finally:
+            self.__lock__.release()
+
+        self.__slot__.wake()
+
+    def stop(self, timeout=5.0):
+        """
+        Draws the frame that was shown last, if it has not
+        been drawn yet, then stops the render thread.
+        """
+
+        self.__stop_event__.set()
+        self.__slot__.wake()
+        self.__thread__.join(timeout)
+
+    def get_stats_text(self):
+        """
+        Returns the LCD frame stats, and how many frames
+        were dropped for a newer one and failed to draw.
+        """
+
+        return self.__lcd__.get_stats_text() \
+            + " dropped=" + str(self.__slot__.dropped_count) \
+            + " errors=" + str(self.error_count)
+
+    def __run__(self):
+        """
+        The render thread.
+        """
+
+        while not self.__stop_event__.is_set():
+            frame = self.__slot__.take(self.__get_wait_seconds__())
+
+            if frame is None:
+                frame = self.__get_due_page__()
+
+            if frame is not None:
+                self.__render__(frame)
+
+        frame = self.__slot__.take(0)
+
+        if frame is not None:
+            self.__render__(frame)
+
+    def __get_wait_seconds__(self):
+        """
+        Returns how long until the next page is due,
+        or None if the pages are not rotating.
+        """
+
+        self.__lock__.acquire()
+        try:
+            if not self.__is_rotating__:
+                return None
+
+            return max(0.0, self.__next_page_time__ - clock.get_time())
+        finally:
+            self.__lock__.release()
+
+    def __get_due_page__(self):
+        """
+        Moves on to the next page with text, if it is time to.
+        Returns its text, or None.
+        """
+
+        now = clock.get_time()
+
+        self.__lock__.acquire()
+        try:
+            if not self.__is_rotating__ or now < self.__next_page_time__:
+                return None
+
+            for _ in range(len(self.pages)):
+                self.__page_index__ = (self.__page_index__ + 1) % len(self.pages)
+                name, seconds = self.pages[self.__page_index__]
+                page_text = self.__page_texts__.get(name)
+
+                if page_text is not None:
+                    self.__next_page_time__ = now + seconds
+                    return page_text
+
+            self.__next_page_time__ = now + NO_PAGE_RETRY_SECONDS
+
+            return None
+        finally:
+            self.__lock__.release()
+
+    def __render__(self, frame):
+        """
+        Draws a frame. A failure is counted, and the
+        LCD sends the next frame in full.
+        """
+
+        try:
+            self.__lcd__.write_text(frame)
+        except:
+            self.error_count += 1
+
+            if self.__logger__ is not None:
+                self.__logger__.log_warning_message(
+                    "LCD update failed: " + str(sys.exc_info()[0].__name__))
+
+    def __define_glyphs__(self, glyphs):
+        """
+        Stores the custom characters in the LCD.
+        """
+
+        try:
+            for character in sorted(glyphs.keys()):
+                self.__lcd__.define_glyph(ord(character), glyphs[character])
+        except:
+            self.error_count += 1
+
+            if self.__logger__ is not None:
+                self.__logger__.log_warning_message(
+                    "Unable to store the LCD glyphs.")
+
+    def __init__(self, lcd, pages, logger=None, glyphs=None):
+        """
+        Starts drawing on the LCD.
+
+        Arguments:
+            lcd {LcdDisplay} -- The display to draw on.
+            pages {list} -- The (name, seconds) of each page, in order.
+            logger {Logger} -- Where to log failures.
+            glyphs {dict} -- The custom characters, GLYPHS by default.
+        """
+
+        self.pages = pages
+        self.error_count = 0
+        self.__lcd__ = lcd
+        self.__logger__ = logger
+        self.__lock__ = threading.Lock()
+        self.__page_builders__ = {}
+        self.__page_texts__ = {}
+        self.__page_index__ = -1
+        self.__is_rotating__ = False
+        self.__next_page_time__ = 0.0
+        self.__slot__ = FrameSlot()
+        self.__stop_event__ = threading.Event()
+        self.__define_glyphs__(GLYPHS if glyphs is None else glyphs)
+        self.__thread__ = threading.Thread(target=self.__run__, name="lcd_render")
+        self.__thread__.daemon = True
+        self.__thread__.start()
+
+
+##############
+# UNIT TESTS #
+##############
+
+def test_pages_rotate():
+    """
+    Test that the pages rotate in order, for their durations,
+    that empty and failing pages do not stall the rotation,
+    and that a shown message holds it.
+    """
+
+    import hardware
+    from sf_1602_lcd import LcdDisplay
+
+    backend = hardware.select_backend(hardware.SIMULATED)
+    previous_clock = clock.set_clock(clock.ScaledClock(100.0))
+
+    def raise_error():
+        raise ValueError()
+
+    try:
+        renderer = LcdRenderer(LcdDisplay(),
+                               [("A", 2), ("EMPTY", 2), ("BROKEN", 2), ("B", 4)])
+        renderer.register_page("A", lambda: "Page A\n" + SIGNAL_3 + GAS)
+        renderer.register_page("EMPTY", lambda: None)
+        renderer.register_page("BROKEN", raise_error)
+        renderer.register_page("B", lambda: "Page B")
+        renderer.refresh()
+
+        assert renderer.get_page_text("BROKEN") == "BROKEN\nERROR"
+        assert renderer.error_count == 1
+        assert backend.lcd.glyphs[ord(FLAME)] == GLYPHS[FLAME]
+
+        renderer.show("Ready")
+        clock.sleep(1)
+
+        assert backend.lcd.get_lines()[0] == "Ready           "
+
+        renderer.start_rotation()
+        shown = []
+
+        for _ in range(80):
+            clock.sleep(0.25)
+            lines = backend.lcd.get_lines()
+
+            if not shown or shown[-1] != lines:
+                shown.append(lines)
+
+        assert [lines[0].strip() for lines in shown[:4]] == \
+            ["Page A", "BROKEN", "Page B", "Page A"]
+        assert shown[0][1] == "\x02\x07              "
+
+        renderer.show("Shutting down...")
+        renderer.stop()
+
+        assert backend.lcd.get_lines()[0] == "Shutting down..."
+        assert " errors=1" in renderer.get_stats_text()
+    finally:
+        clock.set_clock(previous_clock)
+        hardware.close_backend()
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+
+    test_pages_rotate()
+
+    print "Tests finished"
@@ -0,0 +1,227 @@
+"""
+Module to tell when the hangar lights go on or off.
+
+The light sensor is armed with an ALS interrupt window around the
+current state, so the sensor only pulls its INT pin low when the
+light crosses into the other state. The INT pin is wired to a GPIO
+input, and the edge callback asks for the one reading that is needed.
+The reading is taken by whoever is asked, not on the GPIO thread,
+which also runs the Fona's ring indicator callback.
+Without an INT pin the same crossings are found by polling.
+"""
+
+import threading
+
+import hardware
+from light_sensor import MAX_COUNT
+
+
+class LightStateMonitor(object):
+    """
+    Keeps track of whether the hangar is lit, with hysteresis
+    between dark_lux and lit_lux.
+
+    state_callback is called with (is_lit, LightSensorResult)
+    only when the state changes.
+
+    >>> changes = []
+    >>> monitor = LightStateMonitor(None, 20, 90,
+    ...                             lambda is_lit, result: changes.append(is_lit))
+    >>> [monitor.update(__FakeResult__(lux)) for lux in [5, 50, 95, 50, 25, 10]]
+    [False, False, True, True, True, False]
+    >>> changes
+    [True, False]
+    """
+
+    def update(self, light_sensor_result):
+        """
+        Applies a reading. Re-arms the interrupt window if the
+        interrupt is in use. Returns True if the hangar is lit.
+        """
+
+        if light_sensor_result is None or not light_sensor_result.enabled:
+            return self.is_lit
+
+        self.__lock__.acquire()
+        try:
+            was_lit = self.is_lit
+            lux = light_sensor_result.lux
+
+            if lux >= self.lit_lux:
+                self.is_lit = True
+            elif lux <= self.dark_lux or self.is_lit is None:
+                self.is_lit = False
+
+            if self.interrupt_pin is not None:
+                self.__arm__(light_sensor_result)
+        finally:
+            self.__lock__.release()
+
+        if was_lit is not None and was_lit != self.is_lit \
+                and self.__state_callback__ is not None:
+            self.__state_callback__(self.is_lit, light_sensor_result)
+
+        return self.is_lit
+
+    def start_interrupts(self, interrupt_pin, request_reading):
+        """
+        Watches the INT pin (physical pin numbering). Each
+        interrupt clears the sensor's interrupt and calls
+        request_reading(), which must not block. It is expected
+        to have the sensor read elsewhere (ie on its SensorWorker)
+        and the LightSensorResult passed on to update.
+        One reading is requested straight away.
+        """
+
+        if not self.__light_sensor__.enabled:
+            return False
+
+        self.__request_reading__ = request_reading
+        self.interrupt_pin = interrupt_pin
+        self.__gpio__ = hardware.get_gpio()
+
+        # The INT pin is open drain and active low
+        self.__gpio__.setwarnings(False)
+        self.__gpio__.setmode(self.__gpio__.BOARD)
+        self.__gpio__.setup(interrupt_pin, self.__gpio__.IN,
+                            pull_up_down=self.__gpio__.PUD_UP)
+        self.__gpio__.add_event_detect(interrupt_pin, self.__gpio__.FALLING,
+                                       self.__interrupt_triggered__)
+
+        self.__request_reading__()
+
+        return True
+
+    def stop_interrupts(self):
+        """
+        Stops watching the INT pin, and disarms the sensor.
+        """
+
+        if self.interrupt_pin is None:
+            return
+
+        self.__gpio__.remove_event_detect(self.interrupt_pin)
+
+        self.interrupt_pin = None
+        self.__light_sensor__.disable_interrupts()
+
+    def get_interrupt_window(self, light_sensor_result):
+        """
+        Returns the (low, high) channel 0 counts that leave the
+        current state. The lux thresholds are converted using
+        the mix of visible and infrared in the reading, and the
+        window always contains the reading so it does not fire
+        again straight away.
+        """
+
+        counts_per_lux = None
+
+        if light_sensor_result.lux > 0:
+            counts_per_lux = light_sensor_result.full_spectrum \
+                / float(light_sensor_result.lux)
+
+        full = light_sensor_result.full_spectrum
+
+        if self.is_lit:
+            dark_count = self.__light_sensor__.lux_to_counts(self.dark_lux,
+                                                             counts_per_lux)
+            return min(dark_count, full - 1), MAX_COUNT
+
+        # If the lit level is past saturation in a sensitive
+        # range, saturating fires the interrupt instead.
+        lit_count = min(self.__light_sensor__.lux_to_counts(self.lit_lux,
+                                                            counts_per_lux),
+                        self.__light_sensor__.get_max_count() - 1)
+        return 0, max(lit_count, full + 1)
+
+    def __arm__(self, light_sensor_result):
+        """
+        Programs the interrupt window for the current state.
+        """
+
+        low_count, high_count = self.get_interrupt_window(light_sensor_result)
+        self.__light_sensor__.set_interrupt_thresholds(low_count, high_count)
+
+    def __interrupt_triggered__(self, channel):
+        """
+        Called from the GPIO thread when the INT pin goes low.
+        Only hands the reading off, so a hung sensor can not
+        hold up the other edge callbacks.
+        """
+
+        self.interrupt_count += 1
+        self.__light_sensor__.clear_interrupt()
+
+        if self.__request_reading__ is not None:
+            self.__request_reading__()
+
+    def __init__(self, light_sensor, dark_lux, lit_lux, state_callback=None):
+        self.dark_lux = dark_lux
+        self.lit_lux = lit_lux
+        self.is_lit = None
+        self.interrupt_pin = None
+        self.interrupt_count = 0
+        self.__light_sensor__ = light_sensor
+        self.__state_callback__ = state_callback
+        self.__request_reading__ = None
+        self.__gpio__ = None
+        self.__lock__ = threading.Lock()
+
+
+class __FakeResult__(object):
+    """
+    Stands in for a LightSensorResult in the tests.
+    """
+
+    def __init__(self, lux, full_spectrum=None):
+        self.lux = lux
+        self.full_spectrum = full_spectrum if full_spectrum is not None else int(lux * 2)
+        self.infrared = 0
+        self.enabled = True
+
+
+def test_interrupt_hands_off_the_reading():
+    """
+    Test that an interrupt asks for a reading, and
+    does not read the sensor on the GPIO thread.
+    """
+
+    from light_sensor import LightSensor
+
+    backend = hardware.select_backend(hardware.SIMULATED)
+    interrupt_pin = 37
+    requests = []
+
+    try:
+        light_sensor = LightSensor()
+        monitor = LightStateMonitor(light_sensor, 20, 90)
+
+        def read_light_sensor():
+            raise AssertionError("Read on the GPIO thread")
+
+        light_sensor.read_channels = read_light_sensor
+
+        assert monitor.start_interrupts(interrupt_pin,
+                                        lambda: requests.append(True))
+        assert len(requests) == 1
+
+        backend.gpio.drive(interrupt_pin, 0)
+
+        assert monitor.interrupt_count == 1
+        assert len(requests) == 2
+
+        monitor.stop_interrupts()
+    finally:
+        hardware.close_backend()
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+
+    test_interrupt_hands_off_the_reading()
+
+    print "Tests finished"
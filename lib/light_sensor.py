@@ -12,10 +12,9 @@ Taken from https://github.com/maxlklaxl/python-tsl2591/blob/master/tsl2591/read_
 
 '''
 
-import time
-import local_debug
-if not local_debug.is_debug():
-    import smbus
+import threading
+import clock
+from i2c_bus import get_bus
 
 VISIBLE = 2  # channel 0 - channel 1
 INFRARED = 1  # channel 1
@@ -31,6 +30,7 @@ ENABLE_POWERON = 0x01
 ENABLE_POWEROFF = 0x00
 ENABLE_AEN = 0x02
 ENABLE_AIEN = 0x10
+SPECIAL_FUNCTION_CLEAR_ALS_INTERRUPT = 0x06  # with COMMAND_BIT | CLEAR_BIT
 CONTROL_RESET = 0x80
 LUX_DF = 408.0
 LUX_COEFB = 1.64  # CH0 coefficient
@@ -39,13 +39,13 @@ LUX_COEFD = 0.86  # CH2 coefficient B
 
 REGISTER_ENABLE = 0x00
 REGISTER_CONTROL = 0x01
-REGISTER_THRESHHOLDL_LOW = 0x02
-REGISTER_THRESHHOLDL_HIGH = 0x03
-REGISTER_THRESHHOLDH_LOW = 0x04
-REGISTER_THRESHHOLDH_HIGH = 0x05
-REGISTER_INTERRUPT = 0x06
-REGISTER_CRC = 0x08
-REGISTER_ID = 0x0A
+REGISTER_THRESHOLD_AILTL = 0x04  # ALS low threshold, low byte
+REGISTER_THRESHOLD_AILTH = 0x05  # ALS low threshold, high byte
+REGISTER_THRESHOLD_AIHTL = 0x06  # ALS high threshold, low byte
+REGISTER_THRESHOLD_AIHTH = 0x07  # ALS high threshold, high byte
+REGISTER_PERSIST = 0x0C
+REGISTER_ID = 0x12
+REGISTER_STATUS = 0x13
 REGISTER_CHAN0_LOW = 0x14
 REGISTER_CHAN0_HIGH = 0x15
 REGISTER_CHAN1_LOW = 0x16
@@ -62,76 +62,216 @@ GAIN_MED = 0x10  # medium gain (25x)
 GAIN_HIGH = 0x20  # medium gain (428x)
 GAIN_MAX = 0x30  # max gain (9876x)
 
+STATUS_AVALID = 0x01  # an integration cycle has completed
+
+# How many cycles in a row must be outside the thresholds
+# before the INT pin is pulled low.
+PERSIST_EVERY_CYCLE = 0x00
+PERSIST_2_CYCLES = 0x02
+PERSIST_3_CYCLES = 0x03
+PERSIST_5_CYCLES = 0x04
+
+MAX_COUNT = 0xFFFF
+MAX_COUNT_100MS = 0x8FFF  # the ADC tops out early at 100ms
+
+# Ranges from least to most sensitive. Gain goes up first, and
+# integration only gets longer once the gain is at its maximum,
+# so long integrations are only used when it is really dark.
+AUTO_RANGES = [
+    (INTEGRATIONTIME_100MS, GAIN_LOW),
+    (INTEGRATIONTIME_100MS, GAIN_MED),
+    (INTEGRATIONTIME_100MS, GAIN_HIGH),
+    (INTEGRATIONTIME_100MS, GAIN_MAX),
+    (INTEGRATIONTIME_200MS, GAIN_MAX),
+    (INTEGRATIONTIME_300MS, GAIN_MAX),
+    (INTEGRATIONTIME_400MS, GAIN_MAX),
+    (INTEGRATIONTIME_500MS, GAIN_MAX),
+    (INTEGRATIONTIME_600MS, GAIN_MAX),
+]
+
+# Channel 0 counts below this do not give a usable lux.
+AUTO_RANGE_LOW_COUNT = 100
+# Fraction of the maximum count above which to step down.
+AUTO_RANGE_HIGH_FRACTION = 0.8
+# Fraction of the maximum count to aim for after a change.
+AUTO_RANGE_TARGET_FRACTION = 0.5
+# Saturated -> least sensitive -> predicted range.
+MAX_AUTO_RANGE_READS = 3
+
+# Extra time to wait past the end of an integration cycle.
+INTEGRATION_MARGIN_SECONDS = 0.02
+
+# Integration time, in milliseconds, of each setting
+INTEGRATION_TIMES_MS = {
+    INTEGRATIONTIME_100MS: 100.,
+    INTEGRATIONTIME_200MS: 200.,
+    INTEGRATIONTIME_300MS: 300.,
+    INTEGRATIONTIME_400MS: 400.,
+    INTEGRATIONTIME_500MS: 500.,
+    INTEGRATIONTIME_600MS: 600.,
+}
+
+# Multiplier of each gain setting
+GAIN_MULTIPLIERS = {
+    GAIN_LOW: 1.,
+    GAIN_MED: 25.,
+    GAIN_HIGH: 428.,
+    GAIN_MAX: 9876.,
+}
+
+# Counts per lux (ATIME * AGAIN) / DF for every setting
+COUNTS_PER_LUX = dict(
+    [((integration, gain), (integration_ms * multiplier) / LUX_DF)
+     for integration, integration_ms in INTEGRATION_TIMES_MS.items()
+     for gain, multiplier in GAIN_MULTIPLIERS.items()])
+
+
+def get_max_count(integration):
+    """
+    Returns the count a channel saturates at.
+
+    >>> get_max_count(INTEGRATIONTIME_100MS)
+    36863
+    >>> get_max_count(INTEGRATIONTIME_600MS)
+    65535
+    """
+
+    if integration == INTEGRATIONTIME_100MS:
+        return MAX_COUNT_100MS
+
+    return MAX_COUNT
+
+
+def get_range_text(integration, gain):
+    """
+    Returns a short description of a range.
+
+    >>> get_range_text(INTEGRATIONTIME_300MS, GAIN_MAX)
+    '300ms/9876x'
+    """
+
+    return str(int(INTEGRATION_TIMES_MS.get(integration, 0))) + "ms/" \
+        + str(int(GAIN_MULTIPLIERS.get(gain, 0))) + "x"
+
+
+def choose_auto_range(range_index, full, is_forced=False):
+    """
+    Returns the index into AUTO_RANGES to use next, given the
+    channel 0 count read with AUTO_RANGES[range_index].
+    A saturated reading goes to the least sensitive range, since
+    nothing can be predicted from it. Otherwise, if the count is
+    not usable or is_forced, the most sensitive range that should
+    land below the target count is picked.
+
+    >>> choose_auto_range(0, 1000)
+    0
+    >>> choose_auto_range(0, 10)
+    2
+    >>> choose_auto_range(3, MAX_COUNT_100MS)
+    0
+    >>> choose_auto_range(0, 0)
+    5
+    >>> choose_auto_range(2, 33000)
+    1
+    >>> choose_auto_range(0, 150, is_forced=True)
+    1
+    """
+
+    integration, gain = AUTO_RANGES[range_index]
+    max_count = get_max_count(integration)
+
+    if full >= max_count:
+        return 0
+
+    if not is_forced \
+            and AUTO_RANGE_LOW_COUNT <= full <= max_count * AUTO_RANGE_HIGH_FRACTION:
+        return range_index
+
+    counts_per_lux = COUNTS_PER_LUX[(integration, gain)]
+    best_index = 0
+
+    for index, (next_integration, next_gain) in enumerate(AUTO_RANGES):
+        predicted = max(full, 1) * COUNTS_PER_LUX[(next_integration, next_gain)] \
+            / counts_per_lux
+
+        if predicted <= get_max_count(next_integration) * AUTO_RANGE_TARGET_FRACTION:
+            best_index = index
+
+    return best_index
+
 
 class LightSensor(object):
     """
     Object to handle the Adafruit light sensor.
+
+    The sensor is left running in continuous mode, so the
+    channel registers always hold the last integration cycle.
+    A reading is a single block read of the status register
+    and both channels.
+
+    The ALS interrupt can be armed with a window of channel 0
+    counts, so the INT pin goes low when the light leaves it.
+
+    With auto_range the gain and integration time follow the
+    light. The range is kept between readings, and only changes
+    when the counts are too low to be useful or near saturation.
     """
     def __init__(
             self,
             i2c_bus=1,
             sensor_address=0x29,
             integration=INTEGRATIONTIME_100MS,
-            gain=GAIN_LOW
+            gain=GAIN_LOW,
+            auto_range=False
     ):
         self.enabled = False
+        self.auto_range = auto_range
+        self.range_change_count = 0
+        self.sensor_address = sensor_address
+        self.integration_time = integration
+        self.gain = gain
+        self.__counts_per_lux__ = self.__get_counts_per_lux__()
+
+        # Last valid (full, ir), and when the settings last changed
+        self.__latest_luminosity__ = None
+        self.__settings_changed_time__ = clock.get_time()
+
+        # The INT pin callback reads from its own thread. The bus
+        # serialises the transactions, this keeps the settings whole.
+        self.__lock__ = threading.RLock()
+        self.__is_running__ = False
+        self.__interrupts_enabled__ = False
+        self.interrupt_thresholds = None
+        self.i2c_transaction_count = 0
 
         try:
-            if not local_debug.is_debug():
-                print "Initializing i2c bus"
-                self.bus = smbus.SMBus(i2c_bus)
+            self.bus = get_bus(i2c_bus)
 
-            self.sensor_address = sensor_address
-            self.integration_time = integration
-            self.gain = gain
             self.enabled = True
 
-            print "Setting timing"
-            self.set_timing(self.integration_time)
-            self.set_gain(self.gain)
-            self.disable()  # to be sure
-            print "Enabled"
+            self.__write_control__()
+            self.enable()
         except:
-            print "Failed to initialize"
             self.enabled = False
 
     def set_timing(self, integration):
-        if not self.enabled:
-            print "set_timing:Not enbabled"
-            return
+        """
+        Sets the integration time.
+        """
 
-        print "set_timing:Enabling"
-        self.enable()
         self.integration_time = integration
-        if not local_debug.is_debug():
-            print "set_timing:Writing data byte"
-            self.bus.write_byte_data(
-                self.sensor_address,
-                COMMAND_BIT | REGISTER_CONTROL,
-                self.integration_time | self.gain
-            )
-        print "Disabling"
-        self.disable()
+        self.__write_control__()
 
     def get_timing(self):
         return self.integration_time
 
     def set_gain(self, gain):
-        self.enable()
-        self.gain = gain
-
-        if not self.enabled:
-            return
-
-        if local_debug.is_debug():
-            return
+        """
+        Sets the gain.
+        """
 
-        self.bus.write_byte_data(
-            self.sensor_address,
-            COMMAND_BIT | REGISTER_CONTROL,
-            self.integration_time | self.gain
-        )
-        self.disable()
+        self.gain = gain
+        self.__write_control__()
 
     def get_gain(self):
         """
@@ -139,38 +279,34 @@ class LightSensor(object):
         """
         return self.gain
 
+    def get_integration_seconds(self):
+        """
+        Returns how long one integration cycle takes.
+        """
+
+        return INTEGRATION_TIMES_MS.get(self.integration_time, 100.) / 1000.0
+
+    def get_range_text(self):
+        """
+        Returns the current range, ie "100ms/25x".
+        """
+
+        return get_range_text(self.integration_time, self.gain)
+
+    def get_max_count(self):
+        """
+        Returns the count a channel saturates at in the current range.
+        """
+
+        return get_max_count(self.integration_time)
+
     def calculate_lux(self, full, ir):
         # Check for overflow conditions first
-        if (full == 0xFFFF) | (ir == 0xFFFF):
+        max_count = get_max_count(self.integration_time)
+        if (full >= max_count) | (ir >= max_count):
             return 0
 
-        case_integ = {
-            INTEGRATIONTIME_100MS: 100.,
-            INTEGRATIONTIME_200MS: 200.,
-            INTEGRATIONTIME_300MS: 300.,
-            INTEGRATIONTIME_400MS: 400.,
-            INTEGRATIONTIME_500MS: 500.,
-            INTEGRATIONTIME_600MS: 600.,
-        }
-        if self.integration_time in case_integ.keys():
-            atime = case_integ[self.integration_time]
-        else:
-            atime = 100.
-
-        case_gain = {
-            GAIN_LOW: 1.,
-            GAIN_MED: 25.,
-            GAIN_HIGH: 428.,
-            GAIN_MAX: 9876.,
-        }
-
-        if self.gain in case_gain.keys():
-            again = case_gain[self.gain]
-        else:
-            again = 1.
-
-        # cpl = (ATIME * AGAIN) / DF
-        cpl = (atime * again) / LUX_DF
+        cpl = self.__counts_per_lux__
         lux1 = (full - (LUX_COEFB * ir)) / cpl
 
         lux2 = ((LUX_COEFC * full) - (LUX_COEFD * ir)) / cpl
@@ -179,50 +315,211 @@ class LightSensor(object):
         return max([lux1, lux2])
 
     def enable(self):
-        print "Entering enable"
-        if local_debug.is_debug():
-            print "Local debug"
-            return
+        """
+        Powers the sensor on, and starts continuous integration.
+        """
+
         if not self.enabled:
-            print "Not enabled"
             return
 
-        print "enable:writing to data bus."
-        self.bus.write_byte_data(
-            self.sensor_address,
-            COMMAND_BIT | REGISTER_ENABLE,
-            ENABLE_POWERON | ENABLE_AEN | ENABLE_AIEN
-        )  # Enable
-        print "Done enabling"
+        enable_value = ENABLE_POWERON | ENABLE_AEN
+
+        if self.__interrupts_enabled__:
+            enable_value |= ENABLE_AIEN
+
+        self.__write_byte_data__(REGISTER_ENABLE, enable_value)  # Enable
+
+        # Turning the interrupt on or off does not restart integration
+        if not self.__is_running__:
+            self.__settings_changed_time__ = clock.get_time()
+            self.__is_running__ = True
 
     def disable(self):
-        if not self.enabled or local_debug.is_debug():
+        if not self.enabled:
+            return
+
+        self.__write_byte_data__(REGISTER_ENABLE, ENABLE_POWEROFF)
+        self.__is_running__ = False
+
+    def lux_to_counts(self, lux, counts_per_lux=None):
+        """
+        Returns the channel 0 count for a lux level, using the
+        counts per lux of the current settings unless given.
+        """
+
+        if counts_per_lux is None:
+            counts_per_lux = self.__counts_per_lux__
+
+        return int(min(MAX_COUNT, max(0, round(lux * counts_per_lux))))
+
+    def set_interrupt_thresholds(self, low_count, high_count,
+                                 persist=PERSIST_3_CYCLES):
+        """
+        Arms the ALS interrupt to fire when channel 0 is below
+        low_count or above high_count for persist cycles.
+        Only talks to the sensor if the thresholds changed.
+        """
+
+        low_count = int(min(MAX_COUNT, max(0, low_count)))
+        high_count = int(min(MAX_COUNT, max(0, high_count)))
+
+        self.__lock__.acquire()
+        try:
+            if not self.__interrupts_enabled__:
+                self.__write_byte_data__(REGISTER_PERSIST, persist)
+                self.__interrupts_enabled__ = True
+                self.enable()
+
+            if (low_count, high_count) == self.interrupt_thresholds:
+                return
+
+            if self.enabled:
+                # One block write of all four threshold registers
+                self.bus.write_i2c_block_data(
+                    self.sensor_address,
+                    COMMAND_BIT | REGISTER_THRESHOLD_AILTL,
+                    [low_count & 0xFF, low_count >> 8,
+                     high_count & 0xFF, high_count >> 8])
+                self.i2c_transaction_count += 1
+
+            self.interrupt_thresholds = (low_count, high_count)
+            self.clear_interrupt()
+        finally:
+            self.__lock__.release()
+
+    def disable_interrupts(self):
+        """
+        Stops the sensor from pulling the INT pin low.
+        """
+
+        self.__lock__.acquire()
+        try:
+            if self.__interrupts_enabled__:
+                self.__interrupts_enabled__ = False
+                self.interrupt_thresholds = None
+                self.enable()
+                self.clear_interrupt()
+        finally:
+            self.__lock__.release()
+
+    def clear_interrupt(self):
+        """
+        Clears a pending ALS interrupt, releasing the INT pin.
+        """
+
+        if not self.enabled:
             return
 
-        self.bus.write_byte_data(
-            self.sensor_address,
-            COMMAND_BIT | REGISTER_ENABLE,
-            ENABLE_POWEROFF
-        )
+        self.__lock__.acquire()
+        try:
+            self.bus.write_byte(
+                self.sensor_address,
+                COMMAND_BIT | CLEAR_BIT | SPECIAL_FUNCTION_CLEAR_ALS_INTERRUPT)
+            self.i2c_transaction_count += 1
+        finally:
+            self.__lock__.release()
+
+    def read_channels(self):
+        """
+        Reads the status and both channels in one block read.
+        Returns (full, ir) if an integration cycle has completed
+        with the current settings, otherwise None.
+        """
+
+        if not self.enabled:
+            return None
+
+        # The registers still hold a cycle from before the
+        # settings changed until a full cycle has passed.
+        if clock.get_time() - self.__settings_changed_time__ \
+                < self.get_integration_seconds():
+            return None
+
+        self.__lock__.acquire()
+        try:
+            block = self.bus.read_i2c_block_data(
+                self.sensor_address, COMMAND_BIT | REGISTER_STATUS, 5)
+            self.i2c_transaction_count += 1
+        finally:
+            self.__lock__.release()
+
+        if not block[0] & STATUS_AVALID:
+            return None
+
+        full = block[1] | (block[2] << 8)
+        ir = block[3] | (block[4] << 8)
+        self.__latest_luminosity__ = (full, ir)
+
+        return full, ir
 
     def get_full_luminosity(self):
-        self.enable()
-        # not sure if we need it "// Wait x ms for ADC to complete"
-        time.sleep(0.120 * self.integration_time + 1)
+        """
+        Returns the (full, ir) of the last completed integration
+        cycle. Only waits for a cycle to complete if there has
+        never been a reading with the current settings.
+        """
 
-        if not self.enabled or local_debug.is_debug():
+        if not self.enabled:
             return 0, 0
 
-        full = self.bus.read_word_data(
-            self.sensor_address, COMMAND_BIT | REGISTER_CHAN0_LOW
-        )
-        ir = self.bus.read_word_data(
-            self.sensor_address, COMMAND_BIT | REGISTER_CHAN1_LOW
-        )
-        self.disable()
-        return full, ir
+        if self.auto_range:
+            return self.__read_auto_ranged__()
 
-        
+        return self.__read_luminosity__()
+
+    def __read_auto_ranged__(self):
+        """
+        Reads, and moves to a better range until the reading is
+        usable or MAX_AUTO_RANGE_READS have been taken.
+        """
+
+        luminosity = self.__read_luminosity__()
+        was_saturated = False
+
+        for _ in range(MAX_AUTO_RANGE_READS - 1):
+            current_range = (self.integration_time, self.gain)
+
+            if current_range not in AUTO_RANGES:
+                current_range = AUTO_RANGES[0]
+
+            # Coming down from saturation only tells us it is
+            # bright, so pick the range from the next reading.
+            range_index = AUTO_RANGES.index(current_range)
+            next_index = choose_auto_range(range_index, luminosity[0],
+                                           was_saturated)
+
+            if next_index == range_index \
+                    and current_range == (self.integration_time, self.gain):
+                break
+
+            was_saturated = luminosity[0] >= get_max_count(self.integration_time)
+            self.integration_time, self.gain = AUTO_RANGES[next_index]
+            self.range_change_count += 1
+            self.__write_control__()
+            luminosity = self.__read_luminosity__()
+
+        return luminosity
+
+    def __read_luminosity__(self):
+        """
+        Returns the last completed cycle with the current settings.
+        """
+
+        luminosity = self.read_channels()
+
+        if luminosity is None and self.__latest_luminosity__ is None:
+            clock.sleep(max(0.0, self.get_integration_seconds()
+                           - (clock.get_time() - self.__settings_changed_time__))
+                       + INTEGRATION_MARGIN_SECONDS)
+            luminosity = self.read_channels()
+
+        if luminosity is None:
+            luminosity = self.__latest_luminosity__
+
+        if luminosity is None:
+            return 0, 0
+
+        return luminosity
 
     def get_luminosity(self, channel):
         full, ir = self.get_full_luminosity()
@@ -239,6 +536,39 @@ class LightSensor(object):
         # unknown channel!
         return 0
 
+    def __get_counts_per_lux__(self):
+        return COUNTS_PER_LUX.get((self.integration_time, self.gain),
+                                  COUNTS_PER_LUX[(INTEGRATIONTIME_100MS, GAIN_LOW)])
+
+    def __write_control__(self):
+        """
+        Writes the integration time and gain. Readings taken
+        with the old settings are thrown away.
+        """
+
+        self.__counts_per_lux__ = self.__get_counts_per_lux__()
+        self.__latest_luminosity__ = None
+        self.__settings_changed_time__ = clock.get_time()
+
+        self.__write_byte_data__(REGISTER_CONTROL,
+                                 self.integration_time | self.gain)
+
+    def __write_byte_data__(self, register, value):
+        """
+        Writes one register.
+        """
+
+        if not self.enabled:
+            return
+
+        self.__lock__.acquire()
+        try:
+            self.bus.write_byte_data(
+                self.sensor_address, COMMAND_BIT | register, value)
+            self.i2c_transaction_count += 1
+        finally:
+            self.__lock__.release()
+
 
 class LightSensorResult(object):
     """
@@ -257,20 +587,29 @@ class LightSensorResult(object):
             self.full_spectrum = full
             self.infrared = ir
             self.lux = lux
+            self.range_text = tsl_sensor.get_range_text()
             self.enabled = True
         except:
             self.full_spectrum = 0
             self.infrared = 0
             self.lux = 0
+            self.range_text = None
             self.enabled = False
 
 
 if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+
+    print "Tests finished"
 
-    TSL = LightSensor()  # initialize
+    TSL = LightSensor(auto_range=True)  # initialize
 
 #    tsl.set_gain(GAIN_MED)
 #    tsl.set_timing(INTEGRATIONTIME_100MS)
 
     RESULT = LightSensorResult(TSL)
-    print "Lux=" + str(RESULT.lux)
+    print "Lux=" + str(RESULT.lux) + ", Range=" + str(RESULT.range_text)
@@ -0,0 +1,253 @@
+"""
+Module to share a limited electrical circuit between several loads.
+
+Loads that are requested are energized in request order as long as
+the total wattage fits in the budget. Switch-ons are staggered so
+the inrush of two heaters never lands at the same moment.
+
+When loads are waiting for room, the load that has been energized
+the longest is switched off once it has run for a full duty cycle
+slice and goes to the back of the line. This duty cycles the loads
+so they share the circuit.
+
+Every event is a heap push or pop, so the cost of a decision is
+O(log n) in the number of loads.
+"""
+
+import heapq
+import itertools
+
+DEFAULT_STAGGER_SECONDS = 5
+DEFAULT_DUTY_CYCLE_SECONDS = 10 * 60
+
+LOAD_OFF = "OFF"
+LOAD_ON = "ON"
+LOAD_WAITING = "WAITING"
+
+
+class Load(object):
+    """
+    A single load on the circuit.
+    """
+
+    def __init__(self, name, watts):
+        self.name = name
+        self.watts = watts
+        self.is_requested = False
+        self.is_energized = False
+        self.energized_time = None
+
+        # Bumped whenever the load changes state so stale
+        # heap entries can be recognized and thrown away.
+        self.token = 0
+
+    def get_state(self):
+        """
+        Returns LOAD_ON, LOAD_WAITING, or LOAD_OFF.
+        """
+
+        if self.is_energized:
+            return LOAD_ON
+
+        if self.is_requested:
+            return LOAD_WAITING
+
+        return LOAD_OFF
+
+
+class LoadScheduler(object):
+    """
+    Decides which of the requested loads are energized.
+
+    >>> scheduler = LoadScheduler(2000, stagger_seconds=5, duty_cycle_seconds=60)
+    >>> scheduler.add_load("ENGINE", 1500)
+    >>> scheduler.add_load("CABIN", 1500)
+    >>> scheduler.request("ENGINE", 0)
+    True
+    >>> scheduler.request("CABIN", 0)
+    True
+    >>> scheduler.update(0)
+    [('ENGINE', True)]
+    >>> scheduler.update(30)
+    []
+    >>> scheduler.update(60)
+    [('ENGINE', False), ('CABIN', True)]
+    >>> scheduler.release("CABIN", 61)
+    True
+    >>> scheduler.update(66)
+    [('ENGINE', True)]
+    >>> scheduler.get_used_watts()
+    1500
+    """
+
+    def add_load(self, name, watts):
+        """
+        Adds a load to the circuit.
+        """
+
+        self.__loads__[name] = Load(name, watts)
+
+    def get_load(self, name):
+        """
+        Returns the load with the given name.
+        """
+
+        return self.__loads__[name]
+
+    def get_used_watts(self):
+        """
+        Returns the wattage of the energized loads.
+        """
+
+        return self.__used_watts__
+
+    def request(self, name, current_time):
+        """
+        Asks for the load to be energized.
+        Returns False if the load can never fit in the budget.
+        """
+
+        load = self.__loads__[name]
+
+        if load.watts > self.budget_watts:
+            return False
+
+        if not load.is_requested:
+            load.is_requested = True
+            self.__enqueue_waiting__(load)
+
+        return True
+
+    def release(self, name, current_time):
+        """
+        The load is no longer wanted.
+        Returns True if it was energized and must be switched off.
+        """
+
+        load = self.__loads__[name]
+        was_energized = load.is_energized
+
+        load.is_requested = False
+
+        if was_energized:
+            self.__deenergize__(load)
+        else:
+            load.token += 1
+
+        return was_energized
+
+    def update(self, current_time):
+        """
+        Returns the list of (name, should_be_energized) changes
+        that need to be made to the relays.
+        """
+
+        changes = []
+
+        self.__rotate__(current_time, changes)
+        self.__admit__(current_time, changes)
+
+        return changes
+
+    def __rotate__(self, current_time, changes):
+        """
+        Switches the longest running load off if its slice
+        is over and something else is waiting.
+        """
+
+        if self.__peek__(self.__waiting__) is None:
+            return
+
+        entry = self.__peek__(self.__running__)
+
+        if entry is None or entry[0] > current_time:
+            return
+
+        load = entry[2]
+        heapq.heappop(self.__running__)
+        self.__deenergize__(load)
+        self.__enqueue_waiting__(load)
+        changes.append((load.name, False))
+
+    def __admit__(self, current_time, changes):
+        """
+        Energizes loads from the head of the line while they fit
+        and the stagger time has passed.
+        """
+
+        while current_time >= self.__next_switch_on_time__:
+            entry = self.__peek__(self.__waiting__)
+
+            if entry is None:
+                return
+
+            load = entry[2]
+
+            if self.__used_watts__ + load.watts > self.budget_watts:
+                return
+
+            heapq.heappop(self.__waiting__)
+            load.is_energized = True
+            load.energized_time = current_time
+            load.token += 1
+            self.__used_watts__ += load.watts
+            self.__next_switch_on_time__ = current_time + self.stagger_seconds
+
+            heapq.heappush(self.__running__,
+                           (current_time + self.duty_cycle_seconds,
+                            next(self.__sequence__), load, load.token))
+            changes.append((load.name, True))
+
+    def __deenergize__(self, load):
+        load.is_energized = False
+        load.energized_time = None
+        load.token += 1
+        self.__used_watts__ -= load.watts
+
+    def __enqueue_waiting__(self, load):
+        load.token += 1
+        heapq.heappush(self.__waiting__,
+                       (next(self.__sequence__), None, load, load.token))
+
+    def __peek__(self, heap):
+        """
+        Returns the first entry that is still valid, throwing
+        away stale ones.
+        """
+
+        while heap:
+            entry = heap[0]
+            if entry[2].token == entry[3]:
+                return entry
+
+            heapq.heappop(heap)
+
+        return None
+
+    def __init__(self,
+                 budget_watts,
+                 stagger_seconds=DEFAULT_STAGGER_SECONDS,
+                 duty_cycle_seconds=DEFAULT_DUTY_CYCLE_SECONDS):
+        self.budget_watts = budget_watts
+        self.stagger_seconds = stagger_seconds
+        self.duty_cycle_seconds = duty_cycle_seconds
+        self.__loads__ = {}
+        self.__used_watts__ = 0
+        self.__next_switch_on_time__ = 0
+        self.__sequence__ = itertools.count()
+
+        # (sequence, None, load, token)
+        self.__waiting__ = []
+
+        # (slice end time, sequence, load, token)
+        self.__running__ = []
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+
+    print "Tests finished"
@@ -2,9 +2,9 @@
 Module to handle tasks that occur on a regularly scheduled interval.
 """
 
-import threading
-import sys
 import time
+import task_scheduler
+from task_scheduler import FIXED_RATE
 
 FUNCTION_A_COUNT = 0
 FUNCTION_B_COUNT = 0
@@ -12,6 +12,9 @@ FUNCTION_B_COUNT = 0
 class RecurringTask(object):
     """
     Object to control and handle a recurring task.
+
+    All recurring tasks share the single scheduler thread
+    from task_scheduler.
     """
 
     def is_running(self):
@@ -24,10 +27,17 @@ class RecurringTask(object):
     def start(self):
         """
         Starts the task if it is not already running.
+        The first run happens after the initial delay.
         """
         if self.__task_callback__ is not None and not self.__is_running__:
             self.__is_running__ = True
-            self.__run_task__()
+            self.__scheduled_task__ = self.__scheduler__.schedule(
+                self.__task_name__,
+                self.__task_interval__,
+                self.__task_callback__,
+                self.__mode__,
+                self.__logger__,
+                self.__initial_delay__)
 
             return True
 
@@ -40,26 +50,25 @@ class RecurringTask(object):
 
         if self.is_running():
             self.__is_running__ = False
+            self.__scheduled_task__.cancel()
+            self.__scheduled_task__ = None
 
-    def __run_task__(self):
+    def stop(self):
         """
-        Runs the callback.
+        Stops the task. Same as pause, it can be started again.
         """
 
-        if not self.__is_running__:
-            return False
+        self.pause()
 
-        try:
-            self.__task_callback__()
-        except:
-            if self.__logger__ is not None:
-                error_mesage = "EX(" + self.__task_name__ + ")=" + sys.exc_info()[0]
-                self.__logger__.info(error_mesage)
+    def get_scheduled_task(self):
+        """
+        Returns the scheduler's record of the task, or None if not running.
+        """
 
-        if self.__is_running__:
-            threading.Timer(int(self.__task_interval__), self.__run_task__).start()
+        return self.__scheduled_task__
 
-    def __init__(self, task_name, task_interval, task_callback, logger=None):
+    def __init__(self, task_name, task_interval, task_callback, logger=None,
+                 mode=FIXED_RATE, scheduler=None, initial_delay=0):
         """
         Creates a new reocurring task.
         The call back is called at the given time schedule.
@@ -69,7 +78,15 @@ class RecurringTask(object):
         self.__task_interval__ = task_interval
         self.__task_callback__ = task_callback
         self.__logger__ = logger
+        self.__mode__ = mode
+        self.__initial_delay__ = initial_delay
         self.__is_running__ = False
+        self.__scheduled_task__ = None
+
+        if scheduler is None:
+            scheduler = task_scheduler.get_scheduler()
+
+        self.__scheduler__ = scheduler
 
         self.start()
 
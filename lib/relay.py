@@ -2,14 +2,22 @@
 Module to handle sending commands to the power relay.
 """
 import time
-import local_debug
-
-if not local_debug.is_debug():
-    import RPi.GPIO as GPIO
+import clock
+import hardware
 
 DEFAULT_RELAY_TYPE = "always_off"
 DEFAULT_PIN = 22
 
+# How long the relay contacts take to settle after a write
+DEFAULT_SETTLE_SECONDS = 3
+
+# How often the cached state is checked against the pin
+DEFAULT_VERIFY_INTERVAL = 30
+
+# While the pin keeps disagreeing, the time between checks
+# doubles, up to this many verify intervals.
+MAX_VERIFY_BACKOFF = 16
+
 
 class PowerRelay(object):
     """
@@ -19,9 +27,25 @@ class PowerRelay(object):
     name: Relay name (IE - Heater, Light, etc.
     GPIO_PIN: (BOARD) GPIO PIN on rasperry pi that
     the AC/D control relay is plugged into
+
+    Switching never blocks. The relay is given settle_seconds
+    to physically change, after which update() calls
+    state_changed_callback(relay, pin_status).
+
+    The state written to the pin is cached and is what
+    get_io_pin_status() returns. update() reads the pin back
+    after settling and then every verify_interval seconds,
+    calling mismatch_callback(relay, expected, actual) if the
+    pin does not match the cache. The callback can rewrite()
+    the pin. While it keeps disagreeing, the checks back off
+    to MAX_VERIFY_BACKOFF verify intervals apart.
     """
 
-    def __init__(self, name, GPIO_PIN, relay_type=DEFAULT_RELAY_TYPE):
+    def __init__(self, name, GPIO_PIN, relay_type=DEFAULT_RELAY_TYPE,
+                 settle_seconds=DEFAULT_SETTLE_SECONDS,
+                 state_changed_callback=None,
+                 mismatch_callback=None,
+                 verify_interval=DEFAULT_VERIFY_INTERVAL):
         """
         Creates a relay controller.
         """
@@ -29,30 +53,33 @@ class PowerRelay(object):
         self.gpio_pin = GPIO_PIN
         self.type = relay_type
         self.expected_status = 0
+        self.settle_seconds = settle_seconds
+        self.verify_interval = verify_interval
+        self.__state_changed_callback__ = state_changed_callback
+        self.__mismatch_callback__ = mismatch_callback
+        self.__settle_deadline__ = None
+        self.__next_verify_time__ = clock.get_time() + verify_interval
+        self.mismatch_count = 0
 
         # setup GPIO Pins
+        self.__gpio__ = hardware.get_gpio()
 
-        if not local_debug.is_debug():
-            print "Setting " + str(GPIO_PIN) + " to BOARD/OUT"
-            self.expected_status = GPIO.LOW
-            GPIO.setwarnings(False)
-            GPIO.setmode(GPIO.BOARD)
-            GPIO.setup(GPIO_PIN, GPIO.OUT)
+        print "Setting " + str(GPIO_PIN) + " to BOARD/OUT"
+        self.expected_status = self.__gpio__.LOW
+        self.__gpio__.setwarnings(False)
+        self.__gpio__.setmode(self.__gpio__.BOARD)
+        self.__gpio__.setup(GPIO_PIN, self.__gpio__.OUT)
 
     def switch_high(self):
         """
         Sets the GPIO pin to HIGH
         """
 
-        if local_debug.is_debug():
-            self.expected_status = 1
-            return True
-
         try:
             print "Setting to OUT/HIGH"
-            self.expected_status = GPIO.HIGH
-            GPIO.output(self.gpio_pin, GPIO.HIGH)
-            time.sleep(3)
+            self.expected_status = self.__gpio__.HIGH
+            self.__gpio__.output(self.gpio_pin, self.__gpio__.HIGH)
+            self.__start_settling__()
         except:
             return False
         return True
@@ -62,30 +89,118 @@ class PowerRelay(object):
         Sets the GPIO pin to LOW
         """
 
-        if local_debug.is_debug():
-            self.expected_status = 0
+        try:
+            print "Setting to OUT/LOW"
+            self.expected_status = self.__gpio__.LOW
+            self.__gpio__.output(self.gpio_pin, self.__gpio__.LOW)
+            self.__start_settling__()
+        except:
+            return False
+
+        return True
+
+    def is_settled(self):
+        """
+        Returns True if the relay is not in the middle of changing.
+        """
+
+        return self.__settle_deadline__ is None
+
+    def update(self):
+        """
+        Call regularly. Once the last write has settled,
+        reports the new state and verifies it against the pin.
+        Otherwise verifies the pin every verify_interval.
+        Returns True if the relay finished settling.
+        """
+
+        current_time = clock.get_time()
+
+        if self.__settle_deadline__ is not None:
+            if current_time < self.__settle_deadline__:
+                return False
+
+            self.__settle_deadline__ = None
+            pin_status = self.__check_pin__()
+
+            if self.__state_changed_callback__ is not None:
+                self.__state_changed_callback__(self, pin_status)
+
             return True
 
+        if current_time >= self.__next_verify_time__:
+            self.verify()
+
+        return False
+
+    def verify(self):
+        """
+        Reads the pin and compares it to the cached state.
+        Returns True if they match.
+        """
+
+        return self.__check_pin__() == self.expected_status
+
+    def rewrite(self):
+        """
+        Writes the cached state to the pin again, without
+        settling or reporting a change of state.
+        """
+
         try:
-            print "Setting to OUT/LOW"
-            self.expected_status = GPIO.LOW
-            GPIO.output(self.gpio_pin, GPIO.LOW)
-            time.sleep(3)
+            self.__gpio__.output(self.gpio_pin, self.expected_status)
         except:
             return False
 
         return True
 
+    def __check_pin__(self):
+        """
+        Reads the pin, calls the mismatch callback if it does
+        not match the cached state, and schedules the next check.
+        Returns what the pin read.
+        """
+
+        pin_status = self.read_io_pin()
+
+        if pin_status == self.expected_status:
+            self.mismatch_count = 0
+        else:
+            self.mismatch_count += 1
+
+        backoff = min(2 ** max(self.mismatch_count - 1, 0), MAX_VERIFY_BACKOFF)
+        self.__next_verify_time__ = clock.get_time() + self.verify_interval * backoff
+
+        if pin_status != self.expected_status \
+                and self.__mismatch_callback__ is not None:
+            self.__mismatch_callback__(self, self.expected_status, pin_status)
+
+        return pin_status
+
+    def __start_settling__(self):
+        """
+        Starts (or restarts) the settle period.
+        A new state starts with no mismatches.
+        """
+
+        self.mismatch_count = 0
+        self.__settle_deadline__ = clock.get_time() + self.settle_seconds
+
     def get_io_pin_status(self):
         """
         return current status of switch, 0 or 1
+        This is the cached state and does not touch the pin.
         """
 
-        if local_debug.is_debug():
-            return self.expected_status
+        return self.expected_status
+
+    def read_io_pin(self):
+        """
+        Reads the status of the pin, 0 or 1
+        """
 
         try:
-            return GPIO.input(self.gpio_pin)
+            return self.__gpio__.input(self.gpio_pin)
         except:
             return 0
 
@@ -122,6 +237,78 @@ def test_off():
     assert power_relay.get_io_pin_status() == 1
 
 
+class __SteppedClock__(object):
+    """
+    A clock that only moves when told to.
+    """
+
+    def get_time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(seconds, 0)
+
+    def to_real_seconds(self, seconds):
+        return 0
+
+    def __init__(self, now):
+        self.now = now
+
+
+class __StuckGpio__(object):
+    """
+    Passes everything to a GPIO, but its pins always read LOW.
+    """
+
+    def input(self, pin):
+        return self.LOW
+
+    def __getattr__(self, name):
+        return getattr(self.__target__, name)
+
+    def __init__(self, target):
+        self.__target__ = target
+
+
+def test_stuck_pin():
+    """
+    Test that a pin that will not change is rewritten on a back
+    off, without settling again, and that the settled state is
+    the one read from the pin.
+    """
+
+    hardware.select_backend(hardware.SIMULATED)
+    stepped_clock = __SteppedClock__(1000.0)
+    previous_clock = clock.set_clock(stepped_clock)
+    settled = []
+    mismatch_times = []
+
+    def rewrite(relay, expected_status, pin_status):
+        mismatch_times.append(clock.get_time())
+        relay.rewrite()
+
+    try:
+        power_relay = PowerRelay("Heater", DEFAULT_PIN, settle_seconds=3,
+                                 state_changed_callback=lambda relay, status:
+                                 settled.append(status),
+                                 mismatch_callback=rewrite,
+                                 verify_interval=30)
+        power_relay.__gpio__ = __StuckGpio__(power_relay.__gpio__)
+        power_relay.switch_high()
+
+        for _ in range(1000):
+            stepped_clock.sleep(1)
+            power_relay.update()
+
+        assert settled == [0]
+        assert mismatch_times == [1003.0, 1033.0, 1093.0, 1213.0, 1453.0, 1933.0]
+        assert power_relay.is_settled()
+        assert power_relay.get_io_pin_status() == 1
+    finally:
+        clock.set_clock(previous_clock)
+        hardware.close_backend()
+
+
 if __name__ == '__main__':
     import doctest
 
@@ -129,6 +316,8 @@ if __name__ == '__main__':
 
     doctest.testmod()
 
+    test_stuck_pin()
+
     print "Tests finished"
 
     TEST_RELAY = PowerRelay("Heater", DEFAULT_PIN)
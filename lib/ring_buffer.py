@@ -0,0 +1,126 @@
+"""
+Module with a fixed size ring buffer of numbers.
+"""
+
+from array import array
+
+
+class RingBuffer(object):
+    """
+    Fixed capacity buffer of floats. Once full, the oldest
+    value is overwritten. Memory use never grows.
+
+    >>> buffer = RingBuffer(3)
+    >>> buffer.get_mean()
+    >>> for value in [1, 2, 3, 4]:
+    ...     buffer.append(value)
+    >>> buffer.values()
+    [2.0, 3.0, 4.0]
+    >>> len(buffer)
+    3
+    >>> buffer.get_total_count()
+    4
+    >>> buffer.get_mean()
+    3.0
+    >>> buffer.get_max()
+    4.0
+    >>> buffer.get_percentile(50)
+    3.0
+    """
+
+    def append(self, value):
+        """
+        Adds a value, overwriting the oldest one if full.
+        """
+
+        self.__values__[self.__next_index__] = value
+        self.__next_index__ = (self.__next_index__ + 1) % self.__capacity__
+        self.__total_count__ += 1
+
+        if self.__count__ < self.__capacity__:
+            self.__count__ += 1
+
+    def values(self):
+        """
+        Returns the values, oldest first.
+        """
+
+        if self.__count__ < self.__capacity__:
+            return list(self.__values__[0:self.__count__])
+
+        return list(self.__values__[self.__next_index__:]) \
+            + list(self.__values__[0:self.__next_index__])
+
+    def get_latest(self):
+        """
+        Returns the newest value, or None if empty.
+        """
+
+        if self.__count__ == 0:
+            return None
+
+        return self.__values__[self.__next_index__ - 1]
+
+    def get_total_count(self):
+        """
+        Returns how many values have ever been added.
+        """
+
+        return self.__total_count__
+
+    def get_mean(self):
+        """
+        Returns the mean of the values held, or None if empty.
+        """
+
+        if self.__count__ == 0:
+            return None
+
+        return sum(self.__values__[0:self.__count__]) / self.__count__
+
+    def get_max(self):
+        """
+        Returns the largest value held, or None if empty.
+        """
+
+        if self.__count__ == 0:
+            return None
+
+        return max(self.__values__[0:self.__count__])
+
+    def get_percentile(self, percentile):
+        """
+        Returns the nearest-rank percentile of the values held.
+        """
+
+        if self.__count__ == 0:
+            return None
+
+        ordered = sorted(self.__values__[0:self.__count__])
+        index = int(round((percentile / 100.0) * (self.__count__ - 1)))
+
+        return ordered[index]
+
+    def __len__(self):
+        return self.__count__
+
+    def __init__(self, capacity):
+        """
+        Creates a buffer that holds up to capacity values.
+        """
+
+        self.__capacity__ = capacity
+        self.__values__ = array('d', [0.0] * capacity)
+        self.__next_index__ = 0
+        self.__count__ = 0
+        self.__total_count__ = 0
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+
+    print "Tests finished"
@@ -0,0 +1,333 @@
+"""
+Module of vectorized analytics over imported sensor history.
+
+Every function takes the (times, values) columns from a
+SensorData and works on whole arrays at once. Times are
+seconds since the epoch in local time, so days run from
+local midnight to midnight.
+
+Requires NumPy.
+"""
+
+import numpy as np
+
+import sensor_log_import
+
+SECONDS_PER_HOUR = 60 * 60
+SECONDS_PER_DAY = 24 * SECONDS_PER_HOUR
+
+DEFAULT_LIT_THRESHOLD = 90
+
+
+def get_days(times):
+    """
+    Returns the day number (days since the epoch) of each time.
+
+    >>> get_days(np.array([0.0, 86399.0, 86400.0]))
+    array([0, 0, 1])
+    """
+
+    return np.floor_divide(times, SECONDS_PER_DAY).astype(np.int64)
+
+
+def get_day_groups(times):
+    """
+    Returns the distinct days, and the index of the first
+    sample of each, for times that are in order.
+    """
+
+    days = get_days(times)
+    starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+
+    return days[starts], starts
+
+
+def get_daily_extremes(times, values):
+    """
+    Returns (days, lows, highs, means) for each day that has samples.
+    days are numpy datetime64[D].
+
+    >>> days, lows, highs, means = get_daily_extremes(
+    ...     np.array([0.0, 3600.0, 86400.0]), np.array([10.0, 20.0, 5.0]))
+    >>> str(days[1]), list(lows), list(highs), list(means)
+    ('1970-01-02', [10.0, 5.0], [20.0, 5.0], [15.0, 5.0])
+    """
+
+    if len(times) == 0:
+        return (np.empty(0, dtype='datetime64[D]'),
+                np.empty(0), np.empty(0), np.empty(0))
+
+    days, starts = get_day_groups(times)
+    counts = np.diff(np.r_[starts, len(values)])
+
+    return (days.astype('datetime64[D]'),
+            np.minimum.reduceat(values, starts),
+            np.maximum.reduceat(values, starts),
+            np.add.reduceat(values, starts) / counts)
+
+
+def get_hourly_profile(times, values):
+    """
+    Returns the mean value for each hour of the day (24 values),
+    which is the typical daily curve. Hours without samples are NaN.
+    """
+
+    hours = np.floor_divide(np.mod(times, SECONDS_PER_DAY),
+                            SECONDS_PER_HOUR).astype(np.int64)
+    totals = np.bincount(hours, weights=values, minlength=24)
+    counts = np.bincount(hours, minlength=24).astype(np.float64)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return totals / counts
+
+
+def get_state_changes(times, states):
+    """
+    Returns the (times, new_states) where a 0/1 series changes.
+    The first sample counts as a change.
+    """
+
+    states = np.asarray(states) > 0
+
+    if len(states) == 0:
+        return np.empty(0), np.empty(0, dtype=bool)
+
+    changes = np.flatnonzero(np.r_[True, states[1:] != states[:-1]])
+
+    return times[changes], states[changes]
+
+
+def get_on_periods(times, states):
+    """
+    Returns (on_times, off_times) of each period a 0/1 series
+    was on. A period still on at the end closes at the last sample.
+    """
+
+    change_times, new_states = get_state_changes(times, states)
+    on_times = change_times[new_states]
+    off_times = change_times[~new_states]
+
+    # Drop an "off" that comes before the first "on"
+    if len(off_times) and len(on_times) and off_times[0] < on_times[0]:
+        off_times = off_times[1:]
+    elif len(off_times) and not len(on_times):
+        off_times = off_times[:0]
+
+    if len(off_times) < len(on_times):
+        off_times = np.r_[off_times, times[-1]]
+
+    return on_times, off_times
+
+
+def get_warm_up_rates(temperature_times, temperatures, on_times, off_times):
+    """
+    Returns the rate of warming, in degrees per hour, while
+    the heater was on for each on period. The rate is the least
+    squares slope of the temperatures inside the period, NaN
+    if there are fewer than two.
+    """
+
+    first = np.searchsorted(temperature_times, on_times, side='left')
+    last = np.searchsorted(temperature_times, off_times, side='right')
+    counts = (last - first).astype(np.float64)
+
+    # Prefix sums give the sums over every period at once
+    hours = (temperature_times - temperature_times[0]) / SECONDS_PER_HOUR \
+        if len(temperature_times) else temperature_times
+
+    def get_sums(column):
+        prefix = np.r_[0.0, np.cumsum(column)]
+        return prefix[last] - prefix[first]
+
+    sum_x = get_sums(hours)
+    sum_y = get_sums(temperatures)
+    sum_xx = get_sums(hours * hours)
+    sum_xy = get_sums(hours * temperatures)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slopes = (counts * sum_xy - sum_x * sum_y) / (counts * sum_xx - sum_x * sum_x)
+
+    slopes[counts < 2] = np.nan
+
+    return slopes
+
+
+def get_daily_medians(times, values):
+    """
+    Returns (days, medians) of the values of each day.
+    """
+
+    if len(times) == 0:
+        return np.empty(0, dtype='datetime64[D]'), np.empty(0)
+
+    days = get_days(times)
+
+    # Sort by day, then value, so each day's median
+    # is the middle of its run.
+    order = np.lexsort((values, days))
+    sorted_days = days[order]
+    sorted_values = values[order]
+    starts = np.flatnonzero(np.r_[True, sorted_days[1:] != sorted_days[:-1]])
+    counts = np.diff(np.r_[starts, len(sorted_values)])
+    lower = sorted_values[starts + (counts - 1) // 2]
+    upper = sorted_values[starts + counts // 2]
+
+    return sorted_days[starts].astype('datetime64[D]'), (lower + upper) / 2.0
+
+
+def get_baseline_drift(times, values):
+    """
+    Returns (days, baselines, drift_per_day). The baseline is
+    the daily median, which ignores short gas events, and the
+    drift is the slope of a line fitted through the baselines.
+    """
+
+    days, baselines = get_daily_medians(times, values)
+
+    if len(days) < 2:
+        return days, baselines, np.nan
+
+    day_numbers = days.astype(np.int64).astype(np.float64)
+    drift_per_day = np.polyfit(day_numbers, baselines, 1)[0]
+
+    return days, baselines, drift_per_day
+
+
+def get_light_periods(times, lux, lit_threshold=DEFAULT_LIT_THRESHOLD):
+    """
+    Returns (on_times, off_times) of each time the hangar lights
+    were on, meaning the lux was above the threshold.
+    """
+
+    return get_on_periods(times, lux > lit_threshold)
+
+
+def format_day(day):
+    """
+    Returns a datetime64[D] as MM/DD.
+
+    >>> format_day(np.datetime64('2017-07-14'))
+    '07/14'
+    """
+
+    return str(day)[5:].replace("-", "/")
+
+
+def get_report_text(sensor_data, lit_threshold=DEFAULT_LIT_THRESHOLD):
+    """
+    Returns a plain text report of everything in the SensorData.
+    """
+
+    lines = []
+
+    times, temperatures = sensor_data.get(sensor_log_import.TEMPERATURE_CHANNEL)
+    if len(times):
+        days, lows, highs, means = get_daily_extremes(times, temperatures)
+        lines.append("Daily temperature (low/high/mean):")
+        lines.extend(["  " + str(day) + " " + str(round(low, 1)) + "/"
+                      + str(round(high, 1)) + "/" + str(round(mean, 1))
+                      for day, low, high, mean in zip(days, lows, highs, means)])
+
+        profile = get_hourly_profile(times, temperatures)
+        lines.append("Typical day (hour: mean):")
+        lines.extend(["  " + str(hour).zfill(2) + ": " + str(round(profile[hour], 1))
+                      for hour in range(24) if not np.isnan(profile[hour])])
+
+        heater_times, heater_states = sensor_data.get(
+            sensor_log_import.HEATER_CHANNEL)
+        if len(heater_times):
+            on_times, off_times = get_on_periods(heater_times, heater_states)
+            rates = get_warm_up_rates(times, temperatures, on_times, off_times)
+            valid_rates = rates[~np.isnan(rates)]
+            lines.append("Heater: " + str(len(on_times)) + " runs")
+            if len(valid_rates):
+                lines.append("  warm up " + str(round(np.median(valid_rates), 1))
+                             + "F/h median, " + str(round(valid_rates.min(), 1))
+                             + " to " + str(round(valid_rates.max(), 1)))
+
+    times, levels = sensor_data.get(sensor_log_import.GAS_CHANNEL)
+    if len(times):
+        days, baselines, drift_per_day = get_baseline_drift(times, levels)
+        lines.append("Gas baseline: " + str(round(baselines[0], 1)) + " on "
+                     + format_day(days[0]) + ", " + str(round(baselines[-1], 1))
+                     + " on " + format_day(days[-1]) + ", drift "
+                     + str(round(drift_per_day * 30, 2)) + "/month")
+
+    times, lux = sensor_data.get(sensor_log_import.LIGHT_CHANNEL)
+    if len(times):
+        on_times, off_times = get_light_periods(times, lux, lit_threshold)
+        durations = off_times - on_times
+        lines.append("Lights: on " + str(len(on_times)) + " times, "
+                     + str(round(durations.sum() / SECONDS_PER_HOUR, 1))
+                     + " hours total")
+        if len(durations):
+            longest = np.argmax(durations)
+            lines.append("  longest " + str(round(durations[longest] / SECONDS_PER_HOUR, 1))
+                         + " hours from "
+                         + str(np.datetime64(int(on_times[longest]), 's')))
+
+    return "\n".join(lines)
+
+
+##############
+# UNIT TESTS #
+##############
+
+def test_warm_up_rates():
+    """
+    Test that the slope is found for each heater run.
+    """
+
+    minutes = np.arange(0, 6 * 60, dtype=np.float64)
+    times = minutes * 60
+    temperatures = np.where(minutes < 120, 20.0 + minutes / 6.0, 40.0)
+
+    rates = get_warm_up_rates(times, temperatures,
+                              np.array([0.0, 200 * 60.0, 10000 * 60.0]),
+                              np.array([119 * 60.0, 300 * 60.0, 10001 * 60.0]))
+
+    assert abs(rates[0] - 10.0) < 1e-6
+    assert abs(rates[1]) < 1e-6
+    assert np.isnan(rates[2])
+
+
+def test_light_periods():
+    """
+    Test that lights left on are found.
+    """
+
+    times = np.arange(10, dtype=np.float64) * 60
+    lux = np.array([0, 0, 200, 200, 200, 0, 0, 150, 150, 150], dtype=np.float64)
+    on_times, off_times = get_light_periods(times, lux)
+
+    assert list(on_times) == [120.0, 420.0]
+    assert list(off_times) == [300.0, 540.0]
+
+
+def test_baseline_drift():
+    """
+    Test that short gas events do not move the baseline.
+    """
+
+    times = np.arange(0, 30 * 24 * 60, dtype=np.float64) * 60
+    levels = 50.0 + get_days(times) * 0.5
+    levels[::97] = 900.0
+
+    days, baselines, drift_per_day = get_baseline_drift(times, levels)
+
+    assert len(days) == 30
+    assert baselines[0] == 50.0
+    assert abs(drift_per_day - 0.5) < 1e-6
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+    test_warm_up_rates()
+    test_light_periods()
+    test_baseline_drift()
+
+    print "Tests finished"
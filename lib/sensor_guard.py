@@ -0,0 +1,416 @@
+"""
+Module to keep one bad sensor from stalling the others.
+
+Each sensor is read on its own worker thread, so the scheduler only
+hands the read off and never waits on the bus. A read that takes
+longer than its deadline, raises, or returns None is a failure.
+After a few failures in a row the circuit breaker opens and the
+sensor is left alone for a while. The wait doubles with each trip
+(with some jitter, so sensors on the same bus do not retry in lock
+step), then a single trial read decides whether the breaker closes.
+
+The backoff is on the application clock, so it runs faster with
+the rest of the application under a ScaledClock. The read deadlines
+measure how long a read really takes, so they stay on the wall clock.
+"""
+
+import random
+import sys
+import threading
+import time
+from Queue import Queue
+import clock
+
+CLOSED = "OK"
+OPEN = "OPEN"
+HALF_OPEN = "TRIAL"
+
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_BASE_BACKOFF = 5.0
+DEFAULT_MAX_BACKOFF = 600.0
+DEFAULT_JITTER = 0.2
+
+
+class CircuitBreaker(object):
+    """
+    Counts the failures of a sensor and decides when to try it.
+
+    >>> breaker = CircuitBreaker("GAS", failure_threshold=2, base_backoff=10,
+    ...                          jitter=0.0)
+    >>> breaker.record_failure("timeout", 0)
+    >>> breaker.state, breaker.is_call_allowed(1)
+    ('OK', True)
+    >>> breaker.record_failure("timeout", 1)
+    >>> breaker.state, breaker.is_call_allowed(5), breaker.is_call_allowed(11)
+    ('OPEN', False, True)
+    >>> breaker.state, breaker.is_call_allowed(11)
+    ('TRIAL', False)
+    >>> breaker.record_failure("timeout", 12)
+    >>> breaker.retry_time
+    32.0
+    >>> breaker.is_call_allowed(33)
+    True
+    >>> breaker.record_success()
+    >>> breaker.state, breaker.trip_count
+    ('OK', 2)
+    """
+
+    def is_call_allowed(self, now=None):
+        """
+        Returns True if the sensor should be read now. Once the
+        backoff has passed, only one trial read is allowed.
+        """
+
+        if now is None:
+            now = clock.get_time()
+
+        self.__lock__.acquire()
+        try:
+            if self.state == CLOSED:
+                return True
+
+            if self.state == OPEN and now >= self.retry_time:
+                self.state = HALF_OPEN
+                return True
+
+            return False
+        finally:
+            self.__lock__.release()
+
+    def record_success(self):
+        """
+        Closes the breaker.
+        """
+
+        self.__lock__.acquire()
+        try:
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self.__backoff__ = self.base_backoff
+        finally:
+            self.__lock__.release()
+
+    def record_failure(self, reason, now=None):
+        """
+        Counts a failure, and opens the breaker once there
+        have been failure_threshold in a row, or the trial failed.
+        """
+
+        if now is None:
+            now = clock.get_time()
+
+        self.__lock__.acquire()
+        try:
+            self.consecutive_failures += 1
+            self.failure_count += 1
+            self.last_failure = reason
+
+            if self.state == HALF_OPEN \
+                    or self.consecutive_failures >= self.failure_threshold:
+                if self.state == HALF_OPEN:
+                    self.__backoff__ = min(self.__backoff__ * 2, self.max_backoff)
+
+                self.trip_count += 1
+                self.state = OPEN
+                self.retry_time = now + self.__backoff__ \
+                    * random.uniform(1.0 - self.jitter, 1.0 + self.jitter)
+        finally:
+            self.__lock__.release()
+
+    def get_status_text(self, now=None):
+        """
+        Returns a short status, ie "GAS=OK" or
+        "LIGHT=OPEN(4 fails, deadline, retry 40s)".
+        """
+
+        if now is None:
+            now = clock.get_time()
+
+        if self.state == CLOSED:
+            return self.name + "=" + self.state
+
+        return self.name + "=" + self.state + "(" \
+            + str(self.consecutive_failures) + " fails, " \
+            + str(self.last_failure) + ", retry " \
+            + str(int(max(0, self.retry_time - now))) + "s)"
+
+    def __init__(self, name,
+                 failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 base_backoff=DEFAULT_BASE_BACKOFF,
+                 max_backoff=DEFAULT_MAX_BACKOFF,
+                 jitter=DEFAULT_JITTER):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_backoff = float(base_backoff)
+        self.max_backoff = float(max_backoff)
+        self.jitter = jitter
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.failure_count = 0
+        self.trip_count = 0
+        self.last_failure = None
+        self.retry_time = 0.0
+        self.__backoff__ = self.base_backoff
+        self.__lock__ = threading.Lock()
+
+
+class SensorWorker(object):
+    """
+    Reads one sensor on its own thread, with a deadline and
+    a circuit breaker.
+
+    submit() never blocks. The result of a read that finishes
+    in time is handed to its callback, on the worker thread.
+    A read that is still running past its deadline is counted
+    as a failure, and its result is thrown away when it does
+    finish. Nothing else is read until the stuck read returns,
+    and every read that could not be started meanwhile is also
+    counted as a failure.
+    """
+
+    def submit(self, read_function, result_callback):
+        """
+        Queues a read. Returns False if the breaker is open or
+        the previous read has not finished.
+        """
+
+        now = time.time()
+
+        self.__lock__.acquire()
+        try:
+            if self.__started_time__ is not None:
+                # Keep counting while a read is stuck, so the
+                # breaker opens and says so.
+                if self.__is_late__:
+                    self.breaker.record_failure("stuck")
+                else:
+                    self.__check_deadline__(now)
+
+                return False
+
+            if not self.breaker.is_call_allowed():
+                return False
+
+            self.__started_time__ = now
+            self.__is_late__ = False
+            self.__start_thread__()
+        finally:
+            self.__lock__.release()
+
+        self.__queue__.put((read_function, result_callback))
+
+        return True
+
+    def is_busy(self):
+        """
+        Returns True if a read is running. Counts it as a
+        failure if it is past its deadline.
+        """
+
+        self.__lock__.acquire()
+        try:
+            if self.__started_time__ is None:
+                return False
+
+            self.__check_deadline__(time.time())
+            return True
+        finally:
+            self.__lock__.release()
+
+    def is_healthy(self):
+        """
+        Returns True if the breaker is closed and no read is stuck.
+        """
+
+        is_stuck = self.is_busy() and self.__is_late__
+
+        return not is_stuck and self.breaker.state == CLOSED
+
+    def get_status_text(self):
+        """
+        Returns the breaker status of the sensor, or how
+        long a stuck read has been running.
+        """
+
+        started_time = self.__started_time__
+
+        if self.is_busy() and self.__is_late__ and self.breaker.state == CLOSED \
+                and started_time is not None:
+            return self.breaker.name + "=STUCK(" \
+                + str(int(time.time() - started_time)) + "s)"
+
+        return self.breaker.get_status_text()
+
+    def __check_deadline__(self, now):
+        """
+        Counts a read that is past its deadline once.
+        now is the wall clock. Must hold the lock.
+        """
+
+        if not self.__is_late__ \
+                and now - self.__started_time__ > self.deadline_seconds:
+            self.__is_late__ = True
+            self.late_count += 1
+            self.breaker.record_failure("deadline")
+
+    def __start_thread__(self):
+        """
+        Starts the worker thread if needed. Must hold the lock.
+        """
+
+        if self.__thread__ is not None:
+            return
+
+        self.__thread__ = threading.Thread(target=self.__run__,
+                                           name=self.breaker.name + "_reader")
+        self.__thread__.daemon = True
+        self.__thread__.start()
+
+    def __run__(self):
+        """
+        The worker thread.
+        """
+
+        while True:
+            read_function, result_callback = self.__queue__.get()
+            result = None
+            failure = None
+
+            try:
+                result = read_function()
+
+                if result is None:
+                    failure = "no reading"
+            except:
+                failure = str(sys.exc_info()[0].__name__)
+
+            self.__lock__.acquire()
+            try:
+                self.__check_deadline__(time.time())
+                is_late = self.__is_late__
+                self.__started_time__ = None
+            finally:
+                self.__lock__.release()
+
+            if is_late:
+                continue
+
+            if failure is not None:
+                self.breaker.record_failure(failure)
+                continue
+
+            self.breaker.record_success()
+
+            try:
+                result_callback(result)
+            except:
+                pass
+
+    def __init__(self, name, deadline_seconds, breaker=None):
+        self.deadline_seconds = deadline_seconds
+        self.breaker = breaker if breaker is not None else CircuitBreaker(name)
+        self.late_count = 0
+        self.__queue__ = Queue()
+        self.__lock__ = threading.Lock()
+        self.__thread__ = None
+        self.__started_time__ = None
+        self.__is_late__ = False
+
+
+##############
+# UNIT TESTS #
+##############
+
+def test_deadline():
+    """
+    Test that a hung read is a failure, and blocks nothing
+    but its own sensor.
+    """
+
+    release = threading.Event()
+    results = []
+    worker = SensorWorker("HUNG", 0.05,
+                          CircuitBreaker("HUNG", failure_threshold=1,
+                                         base_backoff=60))
+
+    assert worker.submit(release.wait, results.append)
+    assert not worker.submit(release.wait, results.append)
+    time.sleep(0.1)
+    assert worker.is_busy()
+    assert worker.breaker.state == OPEN
+    assert not worker.is_healthy()
+    release.set()
+    time.sleep(0.05)
+    assert not worker.is_busy()
+    assert results == []
+    assert not worker.submit(lambda: 1, results.append)
+
+
+def test_failures_open_the_breaker():
+    """
+    Test that errors and missing readings open the breaker,
+    and a good trial read closes it.
+    """
+
+    results = []
+    worker = SensorWorker("BAD", 1.0,
+                          CircuitBreaker("BAD", failure_threshold=2,
+                                         base_backoff=0.05, jitter=0.0))
+
+    def fail():
+        raise IOError("bus")
+
+    worker.submit(fail, results.append)
+    time.sleep(0.02)
+    worker.submit(lambda: None, results.append)
+    time.sleep(0.02)
+    assert worker.breaker.state == OPEN
+    assert not worker.submit(lambda: 1, results.append)
+    time.sleep(0.06)
+    assert worker.submit(lambda: 42, results.append)
+    time.sleep(0.02)
+    assert worker.breaker.state == CLOSED
+    assert worker.is_healthy()
+    assert results == [42]
+
+
+def test_backoff_follows_the_clock():
+    """
+    Test that an open breaker waits out its backoff on the
+    application clock, so it recovers under a ScaledClock.
+    """
+
+    previous_clock = clock.set_clock(clock.ScaledClock(1000.0))
+
+    try:
+        breaker = CircuitBreaker("SCALED", failure_threshold=1,
+                                 base_backoff=60, jitter=0.0)
+        breaker.record_failure("timeout")
+
+        assert breaker.state == OPEN
+        assert not breaker.is_call_allowed()
+        # The retry is reported in seconds of the scaled clock
+        retry_seconds = int(breaker.get_status_text().split("retry ")[1].rstrip("s)"))
+        assert 30 <= retry_seconds <= 60
+
+        # 60 seconds of the scaled clock are 60 real milliseconds
+        time.sleep(0.1)
+
+        assert breaker.is_call_allowed()
+        assert breaker.state == HALF_OPEN
+    finally:
+        clock.set_clock(previous_clock)
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+
+    test_deadline()
+    test_failures_open_the_breaker()
+    test_backoff_follows_the_clock()
+
+    print "Tests finished"
@@ -0,0 +1,359 @@
+"""
+Module to keep a fixed amount of recent history for each sensor.
+
+Each channel is a pair of array backed ring buffers (time and
+value) sized for the longest window. Every window keeps its
+sum, and monotonic min/max queues, up to date as samples
+arrive and age out, so min, max, mean and rate of change
+are O(1) to read.
+"""
+
+import math
+import threading
+import clock
+from array import array
+from collections import deque
+
+FIVE_MINUTES = 5 * 60
+ONE_HOUR = 60 * 60
+ONE_DAY = 24 * 60 * 60
+
+DEFAULT_WINDOWS = [FIVE_MINUTES, ONE_HOUR, ONE_DAY]
+
+
+class WindowSummary(object):
+    """
+    The aggregates of a window at the time it was read.
+    rate_per_hour is the change from the oldest to the
+    newest sample, scaled to an hour.
+    """
+
+    def __init__(self, window_seconds, count, minimum, maximum, mean, rate_per_hour):
+        self.window_seconds = window_seconds
+        self.count = count
+        self.minimum = minimum
+        self.maximum = maximum
+        self.mean = mean
+        self.rate_per_hour = rate_per_hour
+
+
+class SensorWindow(object):
+    """
+    Incrementally maintained aggregates over the most
+    recent window_seconds of a channel.
+    """
+
+    def __init__(self, channel, window_seconds):
+        self.window_seconds = window_seconds
+        self.__channel__ = channel
+        self.__first_sequence__ = 0
+        self.__sum__ = 0.0
+
+        # Sequence numbers whose values are increasing (for the min)
+        # and decreasing (for the max).
+        self.__min_sequences__ = deque()
+        self.__max_sequences__ = deque()
+
+    def add(self, sequence, value):
+        """
+        Adds the sample that was just written at sequence.
+        """
+
+        self.__sum__ += value
+
+        while self.__min_sequences__ \
+                and self.__channel__.get_value(self.__min_sequences__[-1]) >= value:
+            self.__min_sequences__.pop()
+        self.__min_sequences__.append(sequence)
+
+        while self.__max_sequences__ \
+                and self.__channel__.get_value(self.__max_sequences__[-1]) <= value:
+            self.__max_sequences__.pop()
+        self.__max_sequences__.append(sequence)
+
+    def expire(self, current_time, oldest_sequence):
+        """
+        Drops samples that are older than the window, or that
+        have been overwritten in the ring buffer.
+        """
+
+        oldest_time = current_time - self.window_seconds
+        end_sequence = self.__channel__.get_next_sequence()
+
+        while self.__first_sequence__ < end_sequence \
+                and (self.__first_sequence__ < oldest_sequence
+                     or self.__channel__.get_time(self.__first_sequence__) < oldest_time):
+            self.__remove_first__()
+
+    def get_count(self):
+        """
+        Returns how many samples are in the window.
+        """
+
+        return self.__channel__.get_next_sequence() - self.__first_sequence__
+
+    def get_summary(self):
+        """
+        Returns a WindowSummary, or None if the window is empty.
+        """
+
+        count = self.get_count()
+
+        if count == 0:
+            return None
+
+        last_sequence = self.__channel__.get_next_sequence() - 1
+        elapsed = self.__channel__.get_time(last_sequence) \
+            - self.__channel__.get_time(self.__first_sequence__)
+        rate_per_hour = 0.0
+
+        if elapsed > 0:
+            rate_per_hour = (self.__channel__.get_value(last_sequence)
+                             - self.__channel__.get_value(self.__first_sequence__)) \
+                * ONE_HOUR / elapsed
+
+        return WindowSummary(self.window_seconds,
+                             count,
+                             self.__channel__.get_value(self.__min_sequences__[0]),
+                             self.__channel__.get_value(self.__max_sequences__[0]),
+                             self.__sum__ / count,
+                             rate_per_hour)
+
+    def __remove_first__(self):
+        self.__sum__ -= self.__channel__.get_value(self.__first_sequence__)
+
+        if self.__min_sequences__ and self.__min_sequences__[0] == self.__first_sequence__:
+            self.__min_sequences__.popleft()
+
+        if self.__max_sequences__ and self.__max_sequences__[0] == self.__first_sequence__:
+            self.__max_sequences__.popleft()
+
+        self.__first_sequence__ += 1
+
+
+class SensorChannel(object):
+    """
+    Ring buffered history of one sensor value.
+
+    >>> channel = SensorChannel("TEMP", 60)
+    >>> for minute in range(10):
+    ...     channel.add(20.0 + minute, minute * 60)
+    >>> summary = channel.get_summary(FIVE_MINUTES, 9 * 60)
+    >>> summary.count, summary.minimum, summary.maximum, summary.mean
+    (6, 24.0, 29.0, 26.5)
+    >>> summary.rate_per_hour
+    60.0
+    >>> channel.get_summary(ONE_HOUR, 9 * 60).minimum
+    20.0
+    """
+
+    def add(self, value, sample_time=None):
+        """
+        Adds a sample.
+        """
+
+        if sample_time is None:
+            sample_time = clock.get_time()
+
+        self.__lock__.acquire()
+        try:
+            self.__add__(value, sample_time)
+        finally:
+            self.__lock__.release()
+
+    def __add__(self, value, sample_time):
+        sequence = self.__next_sequence__
+
+        # Expire first, the new sample may overwrite
+        # the oldest one in the ring.
+        oldest_sequence = max(0, sequence + 1 - self.__capacity__)
+        for window in self.__windows__:
+            window.expire(sample_time, oldest_sequence)
+
+        index = sequence % self.__capacity__
+        self.__times__[index] = sample_time
+        self.__values__[index] = value
+        self.__next_sequence__ += 1
+
+        for window in self.__windows__:
+            window.add(sequence, value)
+
+    def get_summary(self, window_seconds, current_time=None):
+        """
+        Returns the WindowSummary for the window, or None if
+        there are no samples in it.
+        """
+
+        if current_time is None:
+            current_time = clock.get_time()
+
+        window = self.__windows_by_length__[window_seconds]
+
+        self.__lock__.acquire()
+        try:
+            window.expire(current_time,
+                          max(0, self.__next_sequence__ - self.__capacity__))
+
+            return window.get_summary()
+        finally:
+            self.__lock__.release()
+
+    def get_latest(self):
+        """
+        Returns the newest value, or None if there are no samples.
+        """
+
+        if self.__next_sequence__ == 0:
+            return None
+
+        return self.get_value(self.__next_sequence__ - 1)
+
+    def get_windows(self):
+        """
+        Returns the window lengths, in seconds, shortest first.
+        """
+
+        return sorted(self.__windows_by_length__.keys())
+
+    def get_next_sequence(self):
+        """
+        Returns the sequence number the next sample will have.
+        """
+
+        return self.__next_sequence__
+
+    def get_time(self, sequence):
+        """
+        Returns the time of the sample with the sequence number.
+        """
+
+        return self.__times__[sequence % self.__capacity__]
+
+    def get_value(self, sequence):
+        """
+        Returns the value of the sample with the sequence number.
+        """
+
+        return self.__values__[sequence % self.__capacity__]
+
+    def __init__(self, name, sample_interval, windows=None):
+        """
+        Creates a channel sized to hold the longest window
+        at the expected sample interval.
+        """
+
+        if windows is None:
+            windows = DEFAULT_WINDOWS
+
+        self.name = name
+        self.__lock__ = threading.Lock()
+        self.__capacity__ = int(math.ceil(max(windows) / float(sample_interval))) + 1
+        self.__times__ = array('d', [0.0] * self.__capacity__)
+        self.__values__ = array('d', [0.0] * self.__capacity__)
+        self.__next_sequence__ = 0
+        self.__windows__ = [SensorWindow(self, window_seconds)
+                            for window_seconds in windows]
+        self.__windows_by_length__ = dict([(window.window_seconds, window)
+                                           for window in self.__windows__])
+
+
+class SensorHistory(object):
+    """
+    The collection of sensor channels.
+    """
+
+    def add_channel(self, name, sample_interval):
+        """
+        Creates the channel if it does not already exist.
+        """
+
+        if name not in self.__channels__:
+            self.__channels__[name] = SensorChannel(name, sample_interval)
+            self.__channel_names__.append(name)
+
+        return self.__channels__[name]
+
+    def add(self, name, value, sample_time=None):
+        """
+        Adds a sample to an existing channel.
+        """
+
+        self.__channels__[name].add(value, sample_time)
+
+    def get_channel(self, name):
+        """
+        Returns the channel, or None.
+        """
+
+        return self.__channels__.get(name)
+
+    def get_channel_names(self):
+        """
+        Returns the channel names in the order they were added.
+        """
+
+        return list(self.__channel_names__)
+
+    def __init__(self):
+        self.__channels__ = {}
+        self.__channel_names__ = []
+
+
+def get_window_text(window_seconds):
+    """
+    Returns a short name for the window.
+
+    >>> get_window_text(FIVE_MINUTES)
+    '5m'
+    >>> get_window_text(ONE_HOUR)
+    '1h'
+    >>> get_window_text(ONE_DAY)
+    '24h'
+    """
+
+    if window_seconds < ONE_HOUR:
+        return str(window_seconds / 60) + "m"
+
+    return str(window_seconds / ONE_HOUR) + "h"
+
+
+def get_trend_text(channel, current_time=None):
+    """
+    Returns a few lines summarizing each window of the channel.
+
+    >>> channel = SensorChannel("TEMP", 60)
+    >>> for minute in range(10):
+    ...     channel.add(20.0 + minute, minute * 60)
+    >>> print get_trend_text(channel, 9 * 60)
+    TEMP
+    5m 24.0-29.0 avg 26.5 +60.0/h
+    1h 20.0-29.0 avg 24.5 +60.0/h
+    24h 20.0-29.0 avg 24.5 +60.0/h
+    """
+
+    lines = [channel.name]
+
+    for window_seconds in channel.get_windows():
+        summary = channel.get_summary(window_seconds, current_time)
+
+        if summary is None:
+            continue
+
+        rate = round(summary.rate_per_hour, 1)
+        lines.append(get_window_text(window_seconds) + " "
+                     + str(round(summary.minimum, 1)) + "-"
+                     + str(round(summary.maximum, 1))
+                     + " avg " + str(round(summary.mean, 1)) + " "
+                     + ("+" if rate >= 0 else "") + str(rate) + "/h")
+
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+
+    print "Tests finished"
@@ -0,0 +1,356 @@
+"""
+Module to bulk import sensor history into NumPy arrays.
+
+Reads the text logs written by the deployed units:
+
+    sensors.log      - ", LIGHT, Lux=..., VIS=..., IR=..."
+                       ", GAS, Level=..., Detected=..."
+                       ", TEMP, F=..."
+    hangar_buddy.log - the heater being switched on and off
+
+and the binary segments of the SeriesStore. Each file is parsed
+with a single regular expression (or read straight into a record
+array) per kind of line, so there is no per-line Python work.
+
+Times are seconds since the epoch in the hangar's local time,
+which is what the log timestamps are written in.
+
+Requires NumPy. This is meant to be run on a laptop against
+copies of the logs, not on the Pi.
+"""
+
+import glob
+import gzip
+import os
+import re
+
+import numpy as np
+
+from series_store import ChannelCatalog, SEGMENT_EXTENSION
+
+GAS_CHANNEL = "GAS"
+GAS_DETECTED_CHANNEL = "GAS_DETECTED"
+LIGHT_CHANNEL = "LUX"
+INFRARED_CHANNEL = "IR"
+FULL_SPECTRUM_CHANNEL = "FULL"
+TEMPERATURE_CHANNEL = "TEMP"
+HEATER_CHANNEL = "HEATER"
+
+SECONDS_PER_HOUR = 60 * 60
+
+TIMESTAMP_PATTERN = r"(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d),\d+ \S+ +"
+NUMBER_PATTERN = r"(-?[\d.]+)"
+
+LIGHT_PATTERN = re.compile(
+    r"(?m)^" + TIMESTAMP_PATTERN + r", LIGHT, Lux=" + NUMBER_PATTERN
+    + r", VIS=" + NUMBER_PATTERN + r", IR=" + NUMBER_PATTERN)
+LIGHT_DTYPE = [('time', 'S19'), ('lux', 'f8'),
+               ('full_spectrum', 'f8'), ('infrared', 'f8')]
+
+GAS_PATTERN = re.compile(
+    r"(?m)^" + TIMESTAMP_PATTERN + r", GAS, Level=" + NUMBER_PATTERN
+    + r", Detected=(True|False)")
+GAS_DTYPE = [('time', 'S19'), ('level', 'f8'), ('detected', 'S5')]
+
+TEMPERATURE_PATTERN = re.compile(
+    r"(?m)^" + TIMESTAMP_PATTERN + r", TEMP, F=" + NUMBER_PATTERN)
+TEMPERATURE_DTYPE = [('time', 'S19'), ('fahrenheit', 'f8')]
+
+# Older builds logged "__start_heater__::switch_high()", newer
+# ones log the load scheduler switching each relay.
+HEATER_PATTERN = re.compile(
+    r"(?m)^" + TIMESTAMP_PATTERN
+    + r"(?:__start_heater__::switch_(high)|__stop_heater__::switch_(low)"
+    + r"|Load schedule: \S+ (ON|OFF))")
+HEATER_DTYPE = [('time', 'S19'), ('high', 'S4'), ('low', 'S3'), ('state', 'S3')]
+
+SEGMENT_DTYPE = np.dtype([('time', '<f8'), ('channel', '<u4'), ('value', '<f4')])
+
+
+class SensorData(object):
+    """
+    Columns of (time, value) for each channel, built up a file
+    at a time.
+    """
+
+    def add(self, channel_name, times, values):
+        """
+        Adds a block of samples to the channel.
+        """
+
+        if len(times) == 0:
+            return
+
+        self.__blocks__.setdefault(channel_name, []).append(
+            (np.asarray(times, dtype=np.float64),
+             np.asarray(values, dtype=np.float64)))
+        self.__columns__.pop(channel_name, None)
+
+    def get(self, channel_name):
+        """
+        Returns the (times, values) arrays of the channel,
+        oldest first. Both are empty if there is no data.
+        """
+
+        if channel_name not in self.__columns__:
+            blocks = self.__blocks__.get(channel_name, [])
+
+            if not blocks:
+                return np.empty(0), np.empty(0)
+
+            times = np.concatenate([block[0] for block in blocks])
+            values = np.concatenate([block[1] for block in blocks])
+            order = np.argsort(times, kind='mergesort')
+            self.__columns__[channel_name] = (times[order], values[order])
+            self.__blocks__[channel_name] = [self.__columns__[channel_name]]
+
+        return self.__columns__[channel_name]
+
+    def get_channel_names(self):
+        """
+        Returns the names of the channels that have data.
+        """
+
+        return sorted(self.__blocks__.keys())
+
+    def __init__(self):
+        self.__blocks__ = {}
+        self.__columns__ = {}
+
+
+def get_log_files(log_path):
+    """
+    Returns a log file and its rotated copies
+    (log.1, log.2.gz, ...) oldest first.
+    """
+
+    def get_rotation(path):
+        suffix = path[len(log_path):].lstrip(".")
+        number = suffix.split(".")[0]
+
+        return int(number) if number.isdigit() else 0
+
+    paths = [path for path in glob.glob(log_path + "*")
+             if path == log_path or get_rotation(path) > 0]
+
+    return sorted(paths, key=get_rotation, reverse=True)
+
+
+def parse_times(timestamps):
+    """
+    Converts an array of "YYYY-MM-DD HH:MM:SS" strings
+    to seconds since the epoch.
+
+    >>> parse_times(np.array(['1970-01-02 00:00:01']))
+    array([86401.])
+    """
+
+    return np.asarray(timestamps, dtype='datetime64[s]').astype(np.int64) \
+        .astype(np.float64)
+
+
+def read_log_text(path):
+    """
+    Returns the contents of a log file, which may be gzipped.
+    """
+
+    if path.endswith(".gz"):
+        log_file = gzip.open(path, "rb")
+    else:
+        log_file = open(path, "rb")
+
+    try:
+        return log_file.read()
+    finally:
+        log_file.close()
+
+
+def parse_sensor_log(log_text, sensor_data):
+    """
+    Adds the light, gas and temperature readings in the
+    text of a sensors.log to the SensorData.
+    """
+
+    light = parse_records(LIGHT_PATTERN, LIGHT_DTYPE, log_text)
+    light_times = parse_times(light['time'])
+    sensor_data.add(LIGHT_CHANNEL, light_times, light['lux'])
+    sensor_data.add(FULL_SPECTRUM_CHANNEL, light_times, light['full_spectrum'])
+    sensor_data.add(INFRARED_CHANNEL, light_times, light['infrared'])
+
+    gas = parse_records(GAS_PATTERN, GAS_DTYPE, log_text)
+    gas_times = parse_times(gas['time'])
+    sensor_data.add(GAS_CHANNEL, gas_times, gas['level'])
+    sensor_data.add(GAS_DETECTED_CHANNEL, gas_times, gas['detected'] == 'True')
+
+    temperature = parse_records(TEMPERATURE_PATTERN, TEMPERATURE_DTYPE, log_text)
+    sensor_data.add(TEMPERATURE_CHANNEL,
+                    parse_times(temperature['time']),
+                    temperature['fahrenheit'])
+
+
+def parse_heater_log(log_text, sensor_data):
+    """
+    Adds the heater switching on (1) and off (0) in the
+    text of a hangar_buddy.log to the SensorData.
+    """
+
+    heater = parse_records(HEATER_PATTERN, HEATER_DTYPE, log_text)
+    is_on = (heater['high'] == 'high') | (heater['state'] == 'ON')
+
+    sensor_data.add(HEATER_CHANNEL, parse_times(heater['time']), is_on)
+
+
+def parse_records(pattern, dtype, log_text):
+    """
+    Returns a record array with one row per match of the pattern.
+    """
+
+    matches = pattern.findall(log_text)
+
+    if not matches:
+        return np.empty(0, dtype=dtype)
+
+    return np.array(matches, dtype=dtype)
+
+
+def import_sensor_logs(log_paths, sensor_data=None):
+    """
+    Imports sensors.log files, including their rotated
+    copies, into a SensorData.
+    """
+
+    if sensor_data is None:
+        sensor_data = SensorData()
+
+    for log_path in log_paths:
+        for path in get_log_files(log_path):
+            parse_sensor_log(read_log_text(path), sensor_data)
+
+    return sensor_data
+
+
+def import_heater_logs(log_paths, sensor_data=None):
+    """
+    Imports hangar_buddy.log files, including their rotated
+    copies, into a SensorData.
+    """
+
+    if sensor_data is None:
+        sensor_data = SensorData()
+
+    for log_path in log_paths:
+        for path in get_log_files(log_path):
+            parse_heater_log(read_log_text(path), sensor_data)
+
+    return sensor_data
+
+
+def import_series_store(directory, utc_offset=0, sensor_data=None):
+    """
+    Imports the raw segments of a SeriesStore into a SensorData.
+    utc_offset is the hours local time is behind UTC.
+
+    The relay channels ("RELAY_<name>") are also added
+    together as the HEATER channel.
+    """
+
+    if sensor_data is None:
+        sensor_data = SensorData()
+
+    catalog = ChannelCatalog(directory)
+    segment_names = sorted([file_name for file_name in os.listdir(directory)
+                            if file_name.endswith(SEGMENT_EXTENSION)])
+
+    for segment_name in segment_names:
+        records = np.fromfile(os.path.join(directory, segment_name),
+                              dtype=SEGMENT_DTYPE)
+        local_times = records['time'] - utc_offset * SECONDS_PER_HOUR
+
+        for channel_id in np.unique(records['channel']):
+            channel_name = catalog.get_name(int(channel_id))
+            selected = records['channel'] == channel_id
+
+            sensor_data.add(channel_name,
+                            local_times[selected],
+                            records['value'][selected])
+
+            if channel_name is not None and channel_name.startswith("RELAY_"):
+                sensor_data.add(HEATER_CHANNEL,
+                                local_times[selected],
+                                records['value'][selected])
+
+    return sensor_data
+
+
+##############
+# UNIT TESTS #
+##############
+
+def test_parse_logs():
+    """
+    Test that each kind of line ends up in its channel.
+    """
+
+    sensor_log = "\n".join([
+        "2017-07-14 10:00:00,001 INFO     , LIGHT, Lux=120, VIS=300, IR=40",
+        "2017-07-14 10:00:30,002 INFO     , GAS, Level=55, Detected=False",
+        "2017-07-14 10:01:00,003 INFO     , TEMP, F=41",
+        "2017-07-14 10:01:30,004 INFO     , GAS, Level=900, Detected=True",
+        "garbage line",
+        ""])
+    heater_log = "\n".join([
+        "2017-07-14 10:02:00,000 INFO     __start_heater__::switch_high()",
+        "2017-07-14 11:02:00,000 INFO     Load schedule: Heater OFF, 0W in use.",
+        ""])
+
+    sensor_data = SensorData()
+    parse_sensor_log(sensor_log, sensor_data)
+    parse_heater_log(heater_log, sensor_data)
+
+    assert list(sensor_data.get(LIGHT_CHANNEL)[1]) == [120.0]
+    assert list(sensor_data.get(INFRARED_CHANNEL)[1]) == [40.0]
+    assert list(sensor_data.get(GAS_CHANNEL)[1]) == [55.0, 900.0]
+    assert list(sensor_data.get(GAS_DETECTED_CHANNEL)[1]) == [0.0, 1.0]
+    assert list(sensor_data.get(TEMPERATURE_CHANNEL)[1]) == [41.0]
+    assert list(sensor_data.get(HEATER_CHANNEL)[1]) == [1.0, 0.0]
+    assert sensor_data.get(HEATER_CHANNEL)[0][1] \
+        - sensor_data.get(HEATER_CHANNEL)[0][0] == SECONDS_PER_HOUR
+
+
+def test_import_series_store():
+    """
+    Test that the binary history comes back as columns.
+    """
+
+    import shutil
+    import tempfile
+    from series_store import SeriesStore
+
+    directory = tempfile.mkdtemp()
+
+    try:
+        store = SeriesStore(directory)
+        for minute in range(100):
+            store.add("TEMP", minute, 1500000000 + minute * 60)
+            store.add("RELAY_HEATER", minute % 2, 1500000000 + minute * 60)
+        store.close()
+
+        sensor_data = import_series_store(directory, utc_offset=8)
+        times, values = sensor_data.get("TEMP")
+        assert len(times) == 100 and values[-1] == 99.0
+        assert times[0] == 1500000000 - 8 * SECONDS_PER_HOUR
+        assert len(sensor_data.get(HEATER_CHANNEL)[0]) == 100
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+    test_parse_logs()
+    test_import_series_store()
+
+    print "Tests finished"
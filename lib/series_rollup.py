@@ -0,0 +1,498 @@
+"""
+Module to keep minute, hour and day rollups of the series store.
+
+Every sample that goes into the SeriesStore is folded into the open
+bucket of its channel at each resolution. When a sample lands past
+the end of a bucket, the bucket is closed and queued to be written.
+Closed buckets are stored as fixed width records:
+
+    minute/YYYYMMDD.rol  - one segment per day
+    hour/YYYYMM.rol      - one segment per month
+    day/YYYY.rol         - one segment per year
+    channels.txt         - "id,name" for each channel
+
+Each record is '<dIIfff' (bucket start, channel id, count, min, max,
+mean). Only closed buckets are written, so after a restart the open
+buckets are rebuilt by replaying the raw samples since the newest
+closed day bucket.
+
+Buckets are aligned to local time, so a day bucket runs from
+midnight to midnight in the hangar.
+"""
+
+import os
+import struct
+import threading
+import time
+import clock
+
+from series_store import ChannelCatalog
+
+ONE_MINUTE = 60
+ONE_HOUR = 60 * 60
+ONE_DAY = 24 * 60 * 60
+
+RESOLUTIONS = [ONE_MINUTE, ONE_HOUR, ONE_DAY]
+RESOLUTION_NAMES = {ONE_MINUTE: "minute", ONE_HOUR: "hour", ONE_DAY: "day"}
+SEGMENT_FORMATS = {ONE_MINUTE: "%Y%m%d", ONE_HOUR: "%Y%m", ONE_DAY: "%Y"}
+
+DEFAULT_RETENTION_DAYS = {ONE_MINUTE: 31, ONE_HOUR: 400, ONE_DAY: 3650}
+
+RECORD_FORMAT = '<dIIfff'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+SEGMENT_EXTENSION = ".rol"
+
+
+class RollupBucket(object):
+    """
+    The aggregates of one channel over one bucket.
+
+    >>> bucket = RollupBucket(0)
+    >>> for value in [3.0, 1.0, 2.0]:
+    ...     bucket.add(value)
+    >>> bucket.count, bucket.minimum, bucket.maximum, bucket.get_mean()
+    (3, 1.0, 3.0, 2.0)
+    """
+
+    def add(self, value):
+        """
+        Folds a sample into the bucket.
+        """
+
+        if self.count == 0 or value < self.minimum:
+            self.minimum = value
+
+        if self.count == 0 or value > self.maximum:
+            self.maximum = value
+
+        self.count += 1
+        self.total += value
+
+    def get_mean(self):
+        """
+        Returns the mean of the samples, or None if there are none.
+        """
+
+        if self.count == 0:
+            return None
+
+        return self.total / self.count
+
+    def __init__(self, start_time, count=0, minimum=None, maximum=None, total=0.0):
+        self.start_time = start_time
+        self.count = count
+        self.minimum = minimum
+        self.maximum = maximum
+        self.total = total
+
+
+class RollupStore(object):
+    """
+    Incrementally maintained rollups of sample channels.
+    """
+
+    def add(self, channel_name, value, sample_time=None):
+        """
+        Folds a sample into the open bucket of every resolution.
+        Samples are expected to arrive in time order.
+        """
+
+        if sample_time is None:
+            sample_time = clock.get_time()
+
+        value = float(value)
+
+        self.__lock__.acquire()
+        try:
+            channel_id = self.__catalog__.get_id(channel_name)
+
+            for resolution in RESOLUTIONS:
+                self.__add_to_bucket__(channel_id, resolution, value, sample_time)
+        finally:
+            self.__lock__.release()
+
+    def query(self, channel_name, resolution, start_time, end_time):
+        """
+        Returns the buckets of the channel, oldest first, that
+        start between start_time and end_time. The open bucket
+        is included.
+        """
+
+        self.__lock__.acquire()
+        try:
+            channel_id = self.__catalog__.find_id(channel_name)
+
+            if channel_id is None:
+                return []
+
+            buckets = [bucket for bucket in self.__pending__[resolution]
+                       if bucket[0] == channel_id]
+            open_bucket = self.__open_buckets__.get((channel_id, resolution))
+        finally:
+            self.__lock__.release()
+
+        results = []
+        first_segment = self.__get_segment_name__(resolution, start_time)
+        last_segment = self.__get_segment_name__(resolution, end_time)
+
+        for segment_name in self.get_segment_names(resolution):
+            if first_segment <= segment_name <= last_segment:
+                results.extend(self.__read_segment__(resolution, segment_name,
+                                                     channel_id))
+
+        results.extend([bucket[1] for bucket in buckets])
+
+        if open_bucket is not None:
+            results.append(open_bucket)
+
+        results = [bucket for bucket in results
+                   if start_time <= bucket.start_time <= end_time]
+        results.sort(key=lambda bucket: bucket.start_time)
+
+        return results
+
+    def flush(self):
+        """
+        Writes the closed buckets to disk.
+        Returns the number of buckets written.
+        """
+
+        written = 0
+
+        self.__lock__.acquire()
+        try:
+            for resolution in RESOLUTIONS:
+                pending = self.__pending__[resolution]
+                self.__pending__[resolution] = []
+                segments = {}
+
+                for channel_id, bucket in pending:
+                    segment_name = self.__get_segment_name__(resolution,
+                                                             bucket.start_time)
+                    segments.setdefault(segment_name, []).append(
+                        struct.pack(RECORD_FORMAT,
+                                    bucket.start_time, channel_id, bucket.count,
+                                    bucket.minimum, bucket.maximum,
+                                    bucket.get_mean()))
+
+                for segment_name in sorted(segments.keys()):
+                    segment_path = self.__get_segment_path__(resolution, segment_name)
+                    first_record = 0
+                    if os.path.exists(segment_path):
+                        first_record = os.path.getsize(segment_path) / RECORD_SIZE
+
+                    with open(segment_path, "ab") as segment_file:
+                        # Trim any partial record left by a power loss
+                        segment_file.truncate(first_record * RECORD_SIZE)
+                        segment_file.write("".join(segments[segment_name]))
+                        segment_file.flush()
+                        os.fsync(segment_file.fileno())
+
+                written += len(pending)
+        finally:
+            self.__lock__.release()
+
+        return written
+
+    def catch_up(self, series_store, current_time=None):
+        """
+        Replays the raw samples that are newer than the last
+        closed day bucket. Must be called before any samples
+        are added.
+        Returns the number of samples replayed.
+        """
+
+        if current_time is None:
+            current_time = clock.get_time()
+
+        day_marks = [mark for (channel_id, resolution), mark
+                     in self.__marks__.items() if resolution == ONE_DAY]
+        start_time = 0
+
+        if day_marks:
+            start_time = min(day_marks) + ONE_DAY
+
+        self.__load_marks__([ONE_MINUTE, ONE_HOUR], start_time)
+        samples = series_store.scan(start_time, current_time)
+
+        for sample_time, channel_name, value in samples:
+            self.add(channel_name, value, sample_time)
+
+        return len(samples)
+
+    def rebuild(self, series_store, current_time=None):
+        """
+        Throws away every rollup and builds them again
+        from the raw samples.
+        Returns the number of samples replayed.
+        """
+
+        self.__lock__.acquire()
+        try:
+            for resolution in RESOLUTIONS:
+                for segment_name in self.get_segment_names(resolution):
+                    os.remove(self.__get_segment_path__(resolution, segment_name))
+
+                self.__pending__[resolution] = []
+
+            self.__open_buckets__ = {}
+            self.__marks__ = {}
+        finally:
+            self.__lock__.release()
+
+        return self.catch_up(series_store, current_time)
+
+    def apply_retention(self, current_time=None):
+        """
+        Removes the segments that have aged out of the
+        retention of their resolution.
+        Returns the number of segments removed.
+        """
+
+        if current_time is None:
+            current_time = clock.get_time()
+
+        removed = 0
+
+        self.__lock__.acquire()
+        try:
+            for resolution in RESOLUTIONS:
+                cutoff_segment = self.__get_segment_name__(
+                    resolution,
+                    current_time - self.retention_days[resolution] * ONE_DAY)
+
+                for segment_name in self.get_segment_names(resolution):
+                    if segment_name >= cutoff_segment:
+                        break
+
+                    os.remove(self.__get_segment_path__(resolution, segment_name))
+                    removed += 1
+        finally:
+            self.__lock__.release()
+
+        return removed
+
+    def get_segment_names(self, resolution):
+        """
+        Returns the names of the segments of the resolution, oldest first.
+        """
+
+        directory = os.path.join(self.directory, RESOLUTION_NAMES[resolution])
+
+        return sorted([file_name[:-len(SEGMENT_EXTENSION)]
+                       for file_name in os.listdir(directory)
+                       if file_name.endswith(SEGMENT_EXTENSION)])
+
+    def close(self):
+        """
+        Writes the closed buckets. Open buckets are rebuilt
+        from the raw samples by catch_up().
+        """
+
+        self.flush()
+
+    def get_bucket_start(self, resolution, sample_time):
+        """
+        Returns the start of the bucket the sample falls in.
+        """
+
+        local_time = sample_time - self.utc_offset_seconds
+
+        return local_time - (local_time % resolution) + self.utc_offset_seconds
+
+    def __add_to_bucket__(self, channel_id, resolution, value, sample_time):
+        """
+        Folds the sample into the open bucket, closing the
+        bucket first if the sample is past its end. Must
+        hold the lock.
+        """
+
+        key = (channel_id, resolution)
+        bucket_start = self.get_bucket_start(resolution, sample_time)
+        mark = self.__marks__.get(key)
+
+        # Already written out before a restart
+        if mark is not None and bucket_start <= mark:
+            return
+
+        bucket = self.__open_buckets__.get(key)
+
+        if bucket is not None and bucket.start_time != bucket_start:
+            self.__pending__[resolution].append((channel_id, bucket))
+            self.__marks__[key] = bucket.start_time
+            bucket = None
+
+        if bucket is None:
+            bucket = RollupBucket(bucket_start)
+            self.__open_buckets__[key] = bucket
+
+        bucket.add(value)
+
+    def __get_segment_name__(self, resolution, bucket_time):
+        return time.strftime(SEGMENT_FORMATS[resolution],
+                             time.gmtime(bucket_time - self.utc_offset_seconds))
+
+    def __get_segment_path__(self, resolution, segment_name):
+        return os.path.join(self.directory, RESOLUTION_NAMES[resolution],
+                            segment_name + SEGMENT_EXTENSION)
+
+    def __read_segment__(self, resolution, segment_name, channel_id):
+        """
+        Returns the buckets of the channel in one segment.
+        """
+
+        with open(self.__get_segment_path__(resolution, segment_name), "rb") \
+                as segment_file:
+            segment_data = segment_file.read()
+
+        results = []
+
+        for offset in xrange(0, len(segment_data) - RECORD_SIZE + 1, RECORD_SIZE):
+            start_time, record_channel, count, minimum, maximum, mean = \
+                struct.unpack_from(RECORD_FORMAT, segment_data, offset)
+
+            if channel_id is None or record_channel == channel_id:
+                results.append((record_channel,
+                                RollupBucket(start_time, count, minimum,
+                                             maximum, mean * count)))
+
+        if channel_id is None:
+            return results
+
+        return [bucket for _, bucket in results]
+
+    def __load_marks__(self, resolutions, since_time):
+        """
+        Finds the newest bucket that was written for each channel,
+        in the segments of the resolutions from since_time on.
+        """
+
+        for resolution in resolutions:
+            first_segment = self.__get_segment_name__(resolution, since_time)
+
+            for segment_name in self.get_segment_names(resolution):
+                if segment_name < first_segment:
+                    continue
+
+                for channel_id, bucket in self.__read_segment__(resolution,
+                                                                segment_name,
+                                                                None):
+                    key = (channel_id, resolution)
+                    self.__marks__[key] = max(self.__marks__.get(key, bucket.start_time),
+                                              bucket.start_time)
+
+    def __init__(self, directory, utc_offset=0, retention_days=None):
+        """
+        Opens (or creates) the rollups in the directory.
+        utc_offset is the hours local time is behind UTC.
+        """
+
+        if retention_days is None:
+            retention_days = DEFAULT_RETENTION_DAYS
+
+        self.directory = directory
+        self.utc_offset_seconds = utc_offset * ONE_HOUR
+        self.retention_days = dict(retention_days)
+        self.__lock__ = threading.RLock()
+        self.__open_buckets__ = {}
+        self.__pending__ = dict([(resolution, []) for resolution in RESOLUTIONS])
+
+        # The start of the newest bucket on disk for each
+        # (channel id, resolution)
+        self.__marks__ = {}
+
+        for resolution in RESOLUTIONS:
+            resolution_directory = os.path.join(directory,
+                                                RESOLUTION_NAMES[resolution])
+            if not os.path.exists(resolution_directory):
+                os.makedirs(resolution_directory)
+
+        self.__catalog__ = ChannelCatalog(directory)
+        self.__load_marks__([ONE_DAY], 0)
+
+
+def get_daily_text(rollups, channel_name, days, current_time=None):
+    """
+    Returns a line per day with the low and high of the channel.
+    """
+
+    if current_time is None:
+        current_time = clock.get_time()
+
+    start_time = rollups.get_bucket_start(ONE_DAY, current_time) \
+        - (days - 1) * ONE_DAY
+    lines = [channel_name + " low/high"]
+
+    for bucket in rollups.query(channel_name, ONE_DAY, start_time, current_time):
+        lines.append(time.strftime("%m/%d", time.gmtime(
+            bucket.start_time - rollups.utc_offset_seconds)) + " "
+                     + str(round(bucket.minimum, 1)) + "/"
+                     + str(round(bucket.maximum, 1)))
+
+    return "\n".join(lines)
+
+
+##############
+# UNIT TESTS #
+##############
+
+def test_rollups():
+    """
+    Test that rollups match the raw samples, survive
+    a restart, and can be rebuilt.
+    """
+
+    import shutil
+    import tempfile
+    from series_store import SeriesStore
+
+    directory = tempfile.mkdtemp()
+
+    try:
+        start_time = 1500000000.0 - (1500000000 % ONE_DAY)
+        store = SeriesStore(os.path.join(directory, "raw"))
+        rollups = RollupStore(os.path.join(directory, "rollups"))
+        store.add_sample_listener(rollups.add)
+
+        # Two and a half days of one sample a minute
+        for minute in range(60 * 60):
+            store.add("TEMP", minute % 100, start_time + minute * 60)
+
+        days = rollups.query("TEMP", ONE_DAY, start_time, start_time + 3 * ONE_DAY)
+        assert [bucket.count for bucket in days] == [1440, 1440, 720]
+        assert days[0].minimum == 0 and days[0].maximum == 99
+
+        hours = rollups.query("TEMP", ONE_HOUR, start_time, start_time + ONE_DAY - 1)
+        assert len(hours) == 24
+        assert hours[0].get_mean() == 29.5
+
+        rollups.close()
+        store.close()
+
+        reopened = RollupStore(os.path.join(directory, "rollups"))
+        assert reopened.catch_up(store, start_time + 3 * ONE_DAY) == 720
+        assert [bucket.count for bucket in reopened.query(
+            "TEMP", ONE_DAY, 0, start_time + 3 * ONE_DAY)] == [1440, 1440, 720]
+
+        assert reopened.rebuild(store, start_time + 3 * ONE_DAY) == 3600
+        assert len(reopened.query("TEMP", ONE_MINUTE, 0,
+                                  start_time + 3 * ONE_DAY)) == 3600
+
+        reopened.flush()
+        reopened.retention_days[ONE_MINUTE] = 1
+        assert reopened.apply_retention(start_time + 2 * ONE_DAY) == 1
+        assert len(reopened.query("TEMP", ONE_MINUTE, 0,
+                                  start_time + 3 * ONE_DAY)) == 2160
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+    test_rollups()
+
+    print "Tests finished"
@@ -0,0 +1,453 @@
+"""
+Module to keep long term sensor and modem history on disk.
+
+Samples are stored as fixed width binary records in one
+append-only segment file per (UTC) day:
+
+    YYYYMMDD.seg  - records of '<dIf' (time, channel id, value)
+    YYYYMMDD.idx  - sparse index of '<dI' (time, record number)
+                    written every INDEX_STRIDE records
+    channels.txt  - "id,name" for each channel
+
+Records are buffered in memory and written as a group, so the
+SD card sees one append every GROUP_COMMIT_SECONDS instead of
+one per sample.
+"""
+
+import bisect
+import calendar
+import mmap
+import os
+import struct
+import threading
+import time
+import clock
+
+RECORD_FORMAT = '<dIf'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+INDEX_FORMAT = '<dI'
+INDEX_SIZE = struct.calcsize(INDEX_FORMAT)
+INDEX_STRIDE = 64
+
+SEGMENT_EXTENSION = ".seg"
+INDEX_EXTENSION = ".idx"
+CHANNELS_FILE = "channels.txt"
+
+DEFAULT_GROUP_COMMIT_RECORDS = 256
+DEFAULT_GROUP_COMMIT_SECONDS = 5 * 60
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def get_segment_name(sample_time):
+    """
+    Returns the name of the segment a sample belongs in.
+
+    >>> get_segment_name(0)
+    '19700101'
+    >>> get_segment_name(1500000000)
+    '20170714'
+    """
+
+    return time.strftime("%Y%m%d", time.gmtime(sample_time))
+
+
+class ChannelCatalog(object):
+    """
+    The "id,name" catalog of the channels in a directory.
+    Ids are handed out in the order channels are first seen.
+    """
+
+    def get_id(self, channel_name):
+        """
+        Returns the id of the channel, adding it to the catalog
+        if it is new.
+        """
+
+        channel_id = self.__ids__.get(channel_name)
+
+        if channel_id is None:
+            channel_id = len(self.__ids__) + 1
+            self.__ids__[channel_name] = channel_id
+            self.__names__[channel_id] = channel_name
+
+            with open(self.__path__, "a") as channels_file:
+                channels_file.write(str(channel_id) + "," + channel_name + "\n")
+
+        return channel_id
+
+    def find_id(self, channel_name):
+        """
+        Returns the id of the channel, or None if it is not cataloged.
+        """
+
+        return self.__ids__.get(channel_name)
+
+    def get_name(self, channel_id):
+        """
+        Returns the name of the channel with the id.
+        """
+
+        return self.__names__.get(channel_id)
+
+    def get_names(self):
+        """
+        Returns the cataloged channel names.
+        """
+
+        return sorted(self.__ids__.keys())
+
+    def __init__(self, directory):
+        self.__path__ = os.path.join(directory, CHANNELS_FILE)
+        self.__ids__ = {}
+        self.__names__ = {}
+
+        if not os.path.exists(self.__path__):
+            return
+
+        with open(self.__path__, "r") as channels_file:
+            for line in channels_file:
+                tokens = line.strip().split(",", 1)
+                if len(tokens) == 2:
+                    self.__ids__[tokens[1]] = int(tokens[0])
+                    self.__names__[int(tokens[0])] = tokens[1]
+
+
+class SeriesStore(object):
+    """
+    Append-only store of (time, channel, value) samples.
+    """
+
+    def add(self, channel_name, value, sample_time=None):
+        """
+        Buffers a sample. It is written at the next group commit.
+        Samples are expected to arrive in time order.
+        """
+
+        self.__lock__.acquire()
+        try:
+            if sample_time is None:
+                sample_time = clock.get_time()
+
+            channel_id = self.__catalog__.get_id(channel_name)
+            self.__pending__.append((sample_time, channel_id, float(value)))
+
+            is_full = len(self.__pending__) >= self.group_commit_records
+        finally:
+            self.__lock__.release()
+
+        for sample_listener in self.__sample_listeners__:
+            sample_listener(channel_name, value, sample_time)
+
+        if is_full:
+            self.flush()
+
+    def add_sample_listener(self, sample_listener):
+        """
+        Adds a function that is called with (channel name, value, time)
+        for every sample that is added.
+        """
+
+        self.__sample_listeners__.append(sample_listener)
+
+    def flush(self):
+        """
+        Writes any buffered samples to disk.
+        Returns the number of samples written.
+        """
+
+        self.__lock__.acquire()
+        try:
+            pending = self.__pending__
+            self.__pending__ = []
+
+            segments = {}
+            for record in pending:
+                segments.setdefault(get_segment_name(record[0]), []).append(record)
+
+            for segment_name in sorted(segments.keys()):
+                self.__append_to_segment__(segment_name, segments[segment_name])
+
+            self.__last_flush_time__ = clock.get_time()
+
+            return len(pending)
+        finally:
+            self.__lock__.release()
+
+    def flush_if_due(self):
+        """
+        Flushes if the oldest buffered sample has waited a full
+        group commit interval. Meant to be called regularly.
+        """
+
+        if clock.get_time() - self.__last_flush_time__ >= self.group_commit_seconds:
+            return self.flush()
+
+        return 0
+
+    def query(self, channel_name, start_time, end_time):
+        """
+        Returns the list of (time, value) samples for the channel
+        with start_time <= time <= end_time, oldest first.
+        """
+
+        channel_id = self.__catalog__.find_id(channel_name)
+
+        if channel_id is None:
+            return []
+
+        return [(record[0], record[2])
+                for record in self.__get_records__(channel_id, start_time, end_time)]
+
+    def scan(self, start_time, end_time):
+        """
+        Returns the list of (time, channel name, value) samples of
+        every channel with start_time <= time <= end_time, in the
+        order they were added.
+        """
+
+        return [(record[0], self.__catalog__.get_name(record[1]), record[2])
+                for record in self.__get_records__(None, start_time, end_time)]
+
+    def get_channel_names(self):
+        """
+        Returns the names of every channel that has been recorded.
+        """
+
+        return self.__catalog__.get_names()
+
+    def get_segment_names(self):
+        """
+        Returns the names of the segments on disk, oldest first.
+        """
+
+        return sorted([file_name[:-len(SEGMENT_EXTENSION)]
+                       for file_name in os.listdir(self.directory)
+                       if file_name.endswith(SEGMENT_EXTENSION)])
+
+    def delete_segments_before(self, cutoff_time):
+        """
+        Removes the segments that only hold samples older than the cutoff.
+        Returns the number of segments removed.
+        """
+
+        cutoff_segment = get_segment_name(cutoff_time)
+        removed = 0
+
+        self.__lock__.acquire()
+        try:
+            for segment_name in self.get_segment_names():
+                if segment_name >= cutoff_segment:
+                    break
+
+                for extension in [SEGMENT_EXTENSION, INDEX_EXTENSION]:
+                    path = os.path.join(self.directory, segment_name + extension)
+                    if os.path.exists(path):
+                        os.remove(path)
+
+                removed += 1
+        finally:
+            self.__lock__.release()
+
+        return removed
+
+    def close(self):
+        """
+        Writes anything that is buffered.
+        """
+
+        self.flush()
+
+    def __get_records__(self, channel_id, start_time, end_time):
+        """
+        Returns the (time, channel id, value) records of the channel,
+        or every channel if channel_id is None, including the ones
+        that are still buffered.
+        """
+
+        self.__lock__.acquire()
+        try:
+            pending = list(self.__pending__)
+        finally:
+            self.__lock__.release()
+
+        results = []
+
+        for segment_name in self.get_segment_names():
+            segment_start = calendar.timegm(time.strptime(segment_name, "%Y%m%d"))
+            if segment_start > end_time or segment_start + SECONDS_PER_DAY <= start_time:
+                continue
+
+            results.extend(self.__query_segment__(segment_name, channel_id,
+                                                  start_time, end_time))
+
+        results.extend([record for record in pending
+                        if (channel_id is None or record[1] == channel_id)
+                        and start_time <= record[0] <= end_time])
+
+        return results
+
+    def __query_segment__(self, segment_name, channel_id, start_time, end_time):
+        """
+        Scans the records of one segment, starting from the
+        last index entry before start_time.
+        """
+
+        segment_path = os.path.join(self.directory, segment_name + SEGMENT_EXTENSION)
+        record_count = os.path.getsize(segment_path) / RECORD_SIZE
+
+        if record_count == 0:
+            return []
+
+        index_times, index_records = self.__read_index__(segment_name)
+        first_record = 0
+        position = bisect.bisect_left(index_times, start_time)
+        if position > 0:
+            first_record = index_records[position - 1]
+
+        results = []
+
+        with open(segment_path, "rb") as segment_file:
+            segment_map = mmap.mmap(segment_file.fileno(),
+                                    record_count * RECORD_SIZE,
+                                    access=mmap.ACCESS_READ)
+            try:
+                for record_number in xrange(first_record, record_count):
+                    sample_time, record_channel, value = struct.unpack_from(
+                        RECORD_FORMAT, segment_map, record_number * RECORD_SIZE)
+
+                    if sample_time > end_time:
+                        break
+
+                    if sample_time >= start_time \
+                            and (channel_id is None or record_channel == channel_id):
+                        results.append((sample_time, record_channel, value))
+            finally:
+                segment_map.close()
+
+        return results
+
+    def __read_index__(self, segment_name):
+        """
+        Returns the index of the segment as lists of times and record numbers.
+        """
+
+        index_times = []
+        index_records = []
+        index_path = os.path.join(self.directory, segment_name + INDEX_EXTENSION)
+
+        if not os.path.exists(index_path):
+            return index_times, index_records
+
+        with open(index_path, "rb") as index_file:
+            index_data = index_file.read()
+
+        for offset in xrange(0, len(index_data) - INDEX_SIZE + 1, INDEX_SIZE):
+            index_time, record_number = struct.unpack_from(INDEX_FORMAT,
+                                                           index_data, offset)
+            index_times.append(index_time)
+            index_records.append(record_number)
+
+        return index_times, index_records
+
+    def __append_to_segment__(self, segment_name, records):
+        """
+        Appends the records, and any index entries they cross,
+        in a single write to each file.
+        """
+
+        segment_path = os.path.join(self.directory, segment_name + SEGMENT_EXTENSION)
+        first_record = 0
+        if os.path.exists(segment_path):
+            first_record = os.path.getsize(segment_path) / RECORD_SIZE
+
+        record_data = []
+        index_data = []
+
+        for offset, record in enumerate(records):
+            record_number = first_record + offset
+            record_data.append(struct.pack(RECORD_FORMAT, *record))
+
+            if record_number % INDEX_STRIDE == 0:
+                index_data.append(struct.pack(INDEX_FORMAT, record[0], record_number))
+
+        with open(segment_path, "ab") as segment_file:
+            # Trim any partial record left by a power loss
+            segment_file.truncate(first_record * RECORD_SIZE)
+            segment_file.write("".join(record_data))
+            segment_file.flush()
+            os.fsync(segment_file.fileno())
+
+        if index_data:
+            index_path = os.path.join(self.directory, segment_name + INDEX_EXTENSION)
+            with open(index_path, "ab") as index_file:
+                index_file.write("".join(index_data))
+
+    def __init__(self,
+                 directory,
+                 group_commit_records=DEFAULT_GROUP_COMMIT_RECORDS,
+                 group_commit_seconds=DEFAULT_GROUP_COMMIT_SECONDS):
+        """
+        Opens (or creates) the store in the directory.
+        """
+
+        self.directory = directory
+        self.group_commit_records = group_commit_records
+        self.group_commit_seconds = group_commit_seconds
+        self.__lock__ = threading.RLock()
+        self.__pending__ = []
+        self.__sample_listeners__ = []
+        self.__last_flush_time__ = clock.get_time()
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.__catalog__ = ChannelCatalog(directory)
+
+
+##############
+# UNIT TESTS #
+##############
+
+def test_round_trip():
+    """
+    Test that samples come back out of the store.
+    """
+
+    import shutil
+    import tempfile
+
+    directory = tempfile.mkdtemp()
+
+    try:
+        store = SeriesStore(directory, group_commit_records=100)
+        start_time = 1500000000.0
+
+        for sample in range(1000):
+            store.add("GAS", sample, start_time + sample * 60)
+            store.add("TEMP", -sample, start_time + sample * 60)
+
+        assert len(store.get_segment_names()) == 1
+        results = store.query("GAS", start_time + 100 * 60, start_time + 199 * 60)
+        assert [value for _, value in results] == range(100, 200)
+
+        store.close()
+        reopened = SeriesStore(directory)
+        assert reopened.get_channel_names() == ["GAS", "TEMP"]
+        assert len(reopened.query("TEMP", 0, start_time * 2)) == 1000
+        assert os.path.getsize(os.path.join(
+            directory, reopened.get_segment_names()[0] + SEGMENT_EXTENSION)) \
+            == 2000 * RECORD_SIZE
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+    test_round_trip()
+
+    print "Tests finished"
@@ -6,20 +6,100 @@ Based on https://github.com/sunfounder/SunFounder_SensorKit_for_RPi2/blob/master
 
 #!/usr/bin/env python
 
+import threading
 import time
-import local_debug
-
-if not local_debug.is_debug():
-    import smbus
+import clock
+from i2c_bus import get_bus
+from ring_buffer import RingBuffer
 
 DEFAULT_SMBUS = 1
 DEFAULT_1602_ADDRESS = 0x27
 
+LCD_COLUMNS = 16
+LCD_ROWS = 2
+
+# The PCF8574 backpack pins
+LCD_REGISTER_SELECT = 0x01
+LCD_ENABLE = 0x04
+LCD_BACKLIGHT = 0x08
+
+# The most bytes in one SMBus block write, the command byte included.
+# The PCF8574 has no registers, so every byte goes to its pins.
+SMBUS_BLOCK_SIZE = 32
+
+# Each byte on the bus takes longer than the HD44780 needs for
+# the enable pulse and for most instructions. Only clear and
+# home, and the power on initialization, have to be waited on.
+CLEAR_SECONDS = 0.002
+INITIALIZE_SECONDS = 0.005
+
+CLEAR_COMMANDS = [0x01, 0x02, 0x03]
+
+# The HD44780 has room for eight glyphs of eight rows,
+# shown by the characters chr(0) to chr(7).
+GLYPH_COUNT = 8
+GLYPH_ROWS = 8
+
+# How many frames the I2C write counts are kept for
+DEFAULT_METRICS_SAMPLES = 256
+
+
+def to_frame(text_to_write):
+    """
+    Returns the rows of the screen showing the text,
+    one string of LCD_COLUMNS characters per row.
+
+    >>> to_frame("CSQ:9 MARGINAL\\nBAT:98%")
+    ['CSQ:9 MARGINAL  ', 'BAT:98%         ']
+    >>> to_frame("UPTIME:")
+    ['UPTIME:         ', '                ']
+    >>> to_frame("Longer than sixteen\\nA\\nB")
+    ['Longer than sixt', 'A               ']
+    """
+
+    text_array = text_to_write.split('\n')[:LCD_ROWS]
+    text_array += [""] * (LCD_ROWS - len(text_array))
+
+    return [row[:LCD_COLUMNS].ljust(LCD_COLUMNS) for row in text_array]
+
+
+def encode(values, register_select, backlight=True):
+    """
+    Returns the bytes to write to the PCF8574 so the HD44780
+    reads each value. Each value is sent high nibble first,
+    and each nibble is latched by raising then dropping EN.
+
+    >>> [hex(value) for value in encode([0x41], LCD_REGISTER_SELECT)]
+    ['0x4d', '0x49', '0x1d', '0x19']
+    >>> [hex(value) for value in encode([0x01], 0, backlight=False)]
+    ['0x4', '0x0', '0x14', '0x10']
+    """
+
+    control = register_select
+
+    if backlight:
+        control |= LCD_BACKLIGHT
+
+    sequence = []
+
+    for value in values:
+        for nibble in [value & 0xF0, (value & 0x0F) << 4]:
+            sequence.append(nibble | control | LCD_ENABLE)
+            sequence.append(nibble | control)
+
+    return sequence
+
+
 class LcdDisplay(object):
     """
     LCD OUTPUT
 
     Class to abstract a 1602 LCD display
+
+    Keeps a copy of what is on the screen, and only
+    sends the characters that change. The cursor is
+    only moved when the next changed character is not
+    where the display's auto-increment already put it.
     """
 
     def __init__(self, sm_bus_id=DEFAULT_SMBUS, adr=DEFAULT_1602_ADDRESS, bl=1):
@@ -31,27 +111,32 @@ class LcdDisplay(object):
         """
 
         self.enable = False
+        self.__smbus__ = None
+        self.__frame_lock__ = threading.RLock()
+        self.__shown__ = None
+        self.__cursor__ = None
+        self.__write_count__ = 0
+        self.__frame_writes__ = RingBuffer(DEFAULT_METRICS_SAMPLES)
+        self.__frame_seconds__ = RingBuffer(DEFAULT_METRICS_SAMPLES)
 
         try:
-            if not local_debug.is_debug():
-                self.__smbus__ = smbus.SMBus(sm_bus_id)
+            self.__smbus__ = get_bus(sm_bus_id)
 
             self.__blen__ = bl
             self.__lcd_addr__ = adr
             self.enable = True
 
-            self.send_command(0x33)  # Must initialize to 8-line mode at first
-            time.sleep(0.005)
-            self.send_command(0x32)  # Then initialize to 4-line mode
-            time.sleep(0.005)
+            # Must initialize to 8-line mode at first,
+            # then to 4-line mode.
+            for nibble in [0x30, 0x30, 0x30, 0x20]:
+                self.__send_sequence__(encode([nibble], 0, self.__blen__ == 1)[:2])
+                clock.sleep(INITIALIZE_SECONDS)
+
             self.send_command(0x28)  # 2 Lines & 5*7 dots
-            time.sleep(0.005)
             self.send_command(0x0C)  # Enable display without cursor
-            time.sleep(0.005)
-            self.send_command(0x01)  # Clear Screen
+            self.clear()
 
-            if not local_debug.is_debug() and self.__smbus__ is not None:
-                self.__smbus__.write_byte(self.__lcd_addr__, 0x08)
+            self.__smbus__.write_byte(self.__lcd_addr__, 0x08)
         except:
             self.enable = False
 
@@ -72,7 +157,8 @@ class LcdDisplay(object):
         else:
             temp &= 0xF7
 
-        if not local_debug.is_debug() and self.__smbus__ is not None:
+        if self.__smbus__ is not None:
+            self.__write_count__ += 1
             self.__smbus__.write_byte(self.__lcd_addr__, temp)
 
 
@@ -87,22 +173,10 @@ class LcdDisplay(object):
         if not self.enable:
             return
 
-        # Send bit7-4 firstly
-        buf = comm & 0xF0
-        buf |= 0x04               # RS = 0, RW = 0, EN = 1
-        self.write_word(buf)
-        time.sleep(0.002)
-        buf &= 0xFB               # Make EN = 0
-        self.write_word(buf)
-
-        # Send bit3-0 secondly
-        buf = (comm & 0x0F) << 4
-        buf |= 0x04               # RS = 0, RW = 0, EN = 1
-        self.write_word(buf)
-        time.sleep(0.002)
-        buf &= 0xFB               # Make EN = 0
-        self.write_word(buf)
+        self.__send_sequence__(encode([comm], 0, self.__blen__ == 1))
 
+        if comm in CLEAR_COMMANDS:
+            clock.sleep(CLEAR_SECONDS)
 
     def send_data(self, data):
         """
@@ -115,41 +189,104 @@ class LcdDisplay(object):
         if not self.enable:
             return
 
-        # Send bit7-4 firstly
-        buf = data & 0xF0
-        buf |= 0x05               # RS = 1, RW = 0, EN = 1
-        self.write_word(buf)
-        time.sleep(0.002)
-        buf &= 0xFB               # Make EN = 0
-        self.write_word(buf)
-
-        # Send bit3-0 secondly
-        buf = (data & 0x0F) << 4
-        buf |= 0x05               # RS = 1, RW = 0, EN = 1
-        self.write_word(buf)
-        time.sleep(0.002)
-        buf &= 0xFB               # Make EN = 0
-        self.write_word(buf)
+        self.__send_sequence__(encode([data], LCD_REGISTER_SELECT,
+                                      self.__blen__ == 1))
+
+    def __send_sequence__(self, sequence):
+        """
+        Writes the bytes to the PCF8574 in as few
+        block writes as the SMBus allows.
+        """
+
+        if self.__smbus__ is None:
+            return
+
+        for index in range(0, len(sequence), SMBUS_BLOCK_SIZE):
+            block = sequence[index:index + SMBUS_BLOCK_SIZE]
+            self.__write_count__ += 1
+
+            if len(block) == 1:
+                self.__smbus__.write_byte(self.__lcd_addr__, block[0])
+            else:
+                self.__smbus__.write_i2c_block_data(self.__lcd_addr__, block[0],
+                                                    block[1:])
 
     def clear(self):
         """
         Clears the screen.
         """
 
-        self.send_command(0x01)  # Clear Screen
+        self.__frame_lock__.acquire()
+        try:
+            # Until the clear has gone out, the screen is unknown
+            self.__shown__ = None
+            self.__cursor__ = None
+            self.send_command(0x01)  # Clear Screen
+            self.__shown__ = [[" "] * LCD_COLUMNS for _ in range(LCD_ROWS)]
+            self.__cursor__ = (0, 0)
+        finally:
+            self.__frame_lock__.release()
+
+    def define_glyph(self, index, rows):
+        """
+        Stores a custom character in the CGRAM. It is
+        shown by writing chr(index) as part of the text.
+
+        Arguments:
+            index {int} -- Which glyph, 0 to 7
+            rows {list} -- Eight rows, top down, of five
+                           bits each, the left most pixel
+                           being 0x10.
+        """
+
+        if not self.enable:
+            return
+
+        if index < 0 or index >= GLYPH_COUNT or len(rows) != GLYPH_ROWS:
+            raise ValueError("A glyph is one of 8, with 8 rows.")
+
+        self.__frame_lock__.acquire()
+        try:
+            # The address counter is left in the CGRAM, so
+            # the next character needs the cursor moved back.
+            self.__cursor__ = None
+            self.__send_sequence__(
+                encode([0x40 | (index << 3)], 0, self.__blen__ == 1)
+                + encode([row & 0x1F for row in rows], LCD_REGISTER_SELECT,
+                         self.__blen__ == 1))
+        finally:
+            self.__frame_lock__.release()
+
+    def get_stats_text(self):
+        """
+        Returns how many I2C writes each frame took, and
+        how long it took in milliseconds, mean/max over
+        the recent frames.
+        """
+
+        if len(self.__frame_writes__) == 0:
+            return "LCD frames=0"
+
+        return "LCD frames=" + str(self.__frame_writes__.get_total_count()) \
+            + " writes/frame=" + str(round(self.__frame_writes__.get_mean(), 1)) \
+            + "/" + str(int(self.__frame_writes__.get_max())) \
+            + " last=" + str(int(self.__frame_writes__.get_latest())) \
+            + " ms/frame=" + str(round(self.__frame_seconds__.get_mean() * 1000, 2)) \
+            + "/" + str(round(self.__frame_seconds__.get_max() * 1000, 2))
 
 
     def openlight(self):  # Enable the backlight
         """
         Turns on the backlight.
         """
+        # The bus is shared, so it is left open
         if self.__smbus__ is not None:
             self.__smbus__.write_byte(DEFAULT_1602_ADDRESS, 0x08)
-            self.__smbus__.close()
 
     def write_text(self, text_to_write):
         """
-        Writes a string to the LCD.
+        Shows a string on the LCD, replacing the whole screen.
+        The rows are split by new lines.
         """
 
         if text_to_write is None:
@@ -158,25 +295,13 @@ class LcdDisplay(object):
         if not self.enable:
             return False
 
-        text_array = text_to_write.split('\n')
-
-        array_count = len(text_array)
-
-        if array_count <= 0:
-            return False
-
-        if array_count >= 1:
-            self.clear()
-            self.write(0, 0, text_array[0])
-
-        if array_count >= 2:
-            self.write(0, 1, text_array[1])
+        self.__render__(to_frame(text_to_write))
 
         return True
 
     def write(self, pos_x, pos_y, text_to_write):
         """
-        Writes to the screen.
+        Writes to the screen, leaving the rest of it as it is.
 
         Arguments:
             x {int} -- The x position (in characters)
@@ -196,15 +321,74 @@ class LcdDisplay(object):
         if pos_y > 1:
             pos_y = 1
 
-        # Move cursor
-        addr = 0x80 + 0x40 * pos_y + pos_x
-        self.send_command(addr)
+        self.__frame_lock__.acquire()
+        try:
+            # Cells that are unknown are blanked
+            frame = [[character or " " for character in row]
+                     for row in self.__shown__ or to_frame("")]
+            text_to_write = text_to_write[:LCD_COLUMNS - pos_x]
+            frame[pos_y][pos_x:pos_x + len(text_to_write)] = list(text_to_write)
+
+            self.__render__(["".join(row) for row in frame])
+        finally:
+            self.__frame_lock__.release()
+
+    def __render__(self, frame):
+        """
+        Sends the characters of the frame that differ
+        from what is on the screen.
+        """
+
+        self.__frame_lock__.acquire()
+        try:
+            start_time = time.time()
+            first_write_count = self.__write_count__
+            backlight = self.__blen__ == 1
+            sequence = []
+
+            if self.__shown__ is None:
+                self.__shown__ = [[None] * LCD_COLUMNS for _ in range(LCD_ROWS)]
 
-        for char in text_to_write:
-            self.send_data(ord(char))
+            for row in range(LCD_ROWS):
+                for column in range(LCD_COLUMNS):
+                    character = frame[row][column]
+
+                    if self.__shown__[row][column] == character:
+                        continue
+
+                    if self.__cursor__ != (row, column):
+                        sequence += encode([0x80 + 0x40 * row + column], 0,
+                                           backlight)
+
+                    sequence += encode([ord(character)], LCD_REGISTER_SELECT,
+                                       backlight)
+                    self.__shown__[row][column] = character
+                    self.__cursor__ = (row, column + 1)
+
+            try:
+                self.__send_sequence__(sequence)
+            except:
+                # The screen is in an unknown state,
+                # so the next frame is sent in full.
+                self.__shown__ = None
+                self.__cursor__ = None
+                raise
+
+            self.__frame_writes__.append(self.__write_count__ - first_write_count)
+            self.__frame_seconds__.append(time.time() - start_time)
+        finally:
+            self.__frame_lock__.release()
 
 
 if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+
+    print "Tests finished"
+
     LCD = LcdDisplay(1, DEFAULT_1602_ADDRESS, 1)  # Slave with background light
     LCD.write(0, 0, 'CSQ:9 MARGINAL')
     LCD.write(0, 1, 'BAT:98% V:4.12')
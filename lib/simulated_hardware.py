@@ -0,0 +1,1273 @@
+"""
+Module to stand in for the hangar's hardware.
+
+Each simulated device follows a waveform, so the application can
+run with no Raspberry Pi: on a build server, a Mac or Windows.
+The waveforms are by channel:
+
+ADC0-ADC3  PCF8591 inputs, 0 to 255. The MQ2 is on ADC0.
+LUX        Light at the TSL2591.
+28-...     Temperature, in C, of the DS18B20 with that serial.
+PIN<n>     Level, 0 or 1, of GPIO input n (BOARD numbering),
+           ie PIN18 to ring the Fona's RI pin.
+BATTERY    Charge of the Fona's battery, in percent.
+CSQ        Signal strength at the Fona, 0 to 31.
+
+They can be scripted, ie "LUX:sine:400:400:86400, ADC0:constant:90",
+or replayed from a CSV file of "seconds,channel,value" rows.
+Channels that are not given keep the defaults.
+"""
+
+import csv
+import datetime
+import math
+import os
+import threading
+import clock as application_clock
+import light_sensor
+import temp_probe
+
+DEFAULT_PROBE_ID = "28-000000000001"
+
+# How often the GPIO inputs and the light sensor interrupt
+# are brought up to date with the waveforms.
+DEFAULT_TICK_SECONDS = 0.1
+
+# Fraction of the light at the TSL2591 that is infrared
+SIMULATED_INFRARED_FRACTION = 0.1
+
+TSL2591_ID = 0x50
+STATUS_AINT = 0x10
+SPECIAL_FUNCTION_BITS = 0x60
+
+LCD_REGISTER_SELECT = 0x01
+LCD_ENABLE = 0x04
+LCD_BACKLIGHT = 0x08
+LCD_COLUMNS = 16
+LCD_ROWS = 2
+
+# Errno of an I2C device that does not answer
+REMOTE_IO_ERROR = 121
+
+# The modem gives the time of a message in quarter hours
+# from UTC. The Fona driver expects the Pacific time.
+MODEM_TIMEZONE_QUARTER_HOURS = -32
+MODEM_BATTERY_MILLIVOLTS = 4100
+MODEM_END_OF_MESSAGE = "\x1a"
+
+
+class ConstantWaveform(object):
+    """
+    >>> ConstantWaveform(90).get_value(1000)
+    90.0
+    """
+
+    def get_value(self, seconds):
+        return self.value
+
+    def __init__(self, value):
+        self.value = float(value)
+
+
+class SineWaveform(object):
+    """
+    >>> waveform = SineWaveform(400, 400, 100)
+    >>> [round(waveform.get_value(seconds)) for seconds in [0, 25, 50, 75]]
+    [400.0, 800.0, 400.0, 0.0]
+    """
+
+    def get_value(self, seconds):
+        return self.mean + self.amplitude \
+            * math.sin(2.0 * math.pi * seconds / self.period_seconds)
+
+    def __init__(self, mean, amplitude, period_seconds):
+        self.mean = float(mean)
+        self.amplitude = float(amplitude)
+        self.period_seconds = float(period_seconds)
+
+
+class TriangleWaveform(object):
+    """
+    Ramps from low to high and back over each period.
+
+    >>> waveform = TriangleWaveform(200, 250, 100)
+    >>> [waveform.get_value(seconds) for seconds in [0, 25, 50, 75, 100]]
+    [200.0, 225.0, 250.0, 225.0, 200.0]
+    """
+
+    def get_value(self, seconds):
+        phase = (seconds % self.period_seconds) / self.period_seconds
+
+        if phase > 0.5:
+            phase = 1.0 - phase
+
+        return self.low + (self.high - self.low) * phase * 2.0
+
+    def __init__(self, low, high, period_seconds):
+        self.low = float(low)
+        self.high = float(high)
+        self.period_seconds = float(period_seconds)
+
+
+class StepWaveform(object):
+    """
+    Holds each value until the next one. Used for replays.
+
+    >>> waveform = StepWaveform([(10, 1), (0, 0), (20, 5)])
+    >>> [waveform.get_value(seconds) for seconds in [-5, 0, 15, 20, 99]]
+    [0.0, 0.0, 1.0, 5.0, 5.0]
+    """
+
+    def get_value(self, seconds):
+        value = self.points[0][1]
+
+        for point_seconds, point_value in self.points:
+            if point_seconds > seconds:
+                break
+
+            value = point_value
+
+        return value
+
+    def __init__(self, points):
+        self.points = sorted([(float(seconds), float(value))
+                              for seconds, value in points])
+
+
+WAVEFORM_SHAPES = {
+    "constant": ConstantWaveform,
+    "sine": SineWaveform,
+    "triangle": TriangleWaveform
+}
+
+
+def parse_waveform_definitions(waveforms_setting):
+    """
+    Parses a list of waveforms in the form "Channel:shape:arguments, ..."
+
+    >>> waveforms = parse_waveform_definitions("ADC0:constant:90, LUX:sine:400:400:86400")
+    >>> sorted(waveforms.keys())
+    ['ADC0', 'LUX']
+    >>> waveforms["ADC0"].get_value(0), waveforms["LUX"].amplitude
+    (90.0, 400.0)
+    """
+
+    waveforms = {}
+
+    for waveform_setting in waveforms_setting.split(','):
+        tokens = [token.strip() for token in waveform_setting.split(':')]
+
+        if len(tokens) < 3:
+            continue
+
+        # Probe serials have no colons, so the shape is always second
+        waveforms[tokens[0]] = WAVEFORM_SHAPES[tokens[1].lower()](
+            *[float(token) for token in tokens[2:]])
+
+    return waveforms
+
+
+def parse_replay(lines):
+    """
+    Reads "seconds,channel,value" rows into a StepWaveform for
+    each channel. A header row is skipped.
+
+    >>> waveforms = parse_replay(["seconds,channel,value", "0,LUX,5",
+    ...                           "60,LUX,300", "0,ADC0,80"])
+    >>> waveforms["LUX"].get_value(30), waveforms["LUX"].get_value(90)
+    (5.0, 300.0)
+    """
+
+    points = {}
+
+    for row in csv.reader(lines):
+        if len(row) < 3:
+            continue
+
+        try:
+            seconds = float(row[0])
+            value = float(row[2])
+        except ValueError:
+            continue
+
+        points.setdefault(row[1].strip(), []).append((seconds, value))
+
+    return dict([(channel, StepWaveform(channel_points))
+                 for channel, channel_points in points.items()])
+
+
+def load_replay(replay_file):
+    """
+    Reads a replay file.
+    """
+
+    with open(replay_file, "rb") as replay:
+        return parse_replay(replay)
+
+
+def get_default_waveforms():
+    """
+    Returns the waveforms of a hangar with nothing scripted.
+    The gas level ramps through the alarm every ten minutes,
+    and the light and temperature follow the day.
+    """
+
+    return {
+        "ADC0": TriangleWaveform(210, 255, 600),
+        "LUX": SineWaveform(300, 400, 86400),
+        DEFAULT_PROBE_ID: SineWaveform(5, 10, 86400)
+    }
+
+
+class SimulatedGpio(object):
+    """
+    Stands in for RPi.GPIO. Outputs read back what was
+    written. Inputs float high unless pulled down, and
+    are driven by the simulator.
+    """
+
+    BOARD = 10
+    BCM = 11
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def setwarnings(self, is_warning_enabled):
+        pass
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, pin, direction, pull_up_down=PUD_OFF, initial=-1):
+        self.__lock__.acquire()
+        try:
+            self.__directions__[pin] = direction
+
+            if direction == self.OUT:
+                self.__levels__[pin] = initial if initial in [self.LOW, self.HIGH] \
+                    else self.LOW
+            elif pin not in self.__driven_pins__:
+                self.__levels__[pin] = self.LOW if pull_up_down == self.PUD_DOWN \
+                    else self.HIGH
+        finally:
+            self.__lock__.release()
+
+    def output(self, pin, value):
+        self.__lock__.acquire()
+        try:
+            if self.__directions__.get(pin) != self.OUT:
+                raise RuntimeError("The GPIO channel has not been set up as an OUTPUT")
+
+            self.__levels__[pin] = self.HIGH if value else self.LOW
+        finally:
+            self.__lock__.release()
+
+    def input(self, pin):
+        self.__lock__.acquire()
+        try:
+            if pin not in self.__directions__:
+                raise RuntimeError("You must setup() the GPIO channel first")
+
+            return self.__levels__[pin]
+        finally:
+            self.__lock__.release()
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self.__lock__.acquire()
+        try:
+            self.__edge_callbacks__[pin] = (edge, callback)
+        finally:
+            self.__lock__.release()
+
+    def remove_event_detect(self, pin):
+        self.__lock__.acquire()
+        try:
+            self.__edge_callbacks__.pop(pin, None)
+        finally:
+            self.__lock__.release()
+
+    def cleanup(self):
+        self.__lock__.acquire()
+        try:
+            self.__directions__ = {}
+            self.__edge_callbacks__ = {}
+        finally:
+            self.__lock__.release()
+
+    def drive(self, pin, level):
+        """
+        Sets the level of an input, as the device on it would,
+        and calls its edge callback if the level changed.
+        """
+
+        level = self.HIGH if level else self.LOW
+        callback = None
+
+        self.__lock__.acquire()
+        try:
+            self.__driven_pins__.add(pin)
+            previous_level = self.__levels__.get(pin)
+            self.__levels__[pin] = level
+
+            if self.__directions__.get(pin) == self.IN \
+                    and pin in self.__edge_callbacks__ \
+                    and previous_level is not None and previous_level != level:
+                edge, callback = self.__edge_callbacks__[pin]
+                edge_happened = self.RISING if level == self.HIGH else self.FALLING
+
+                if edge not in [edge_happened, self.BOTH]:
+                    callback = None
+        finally:
+            self.__lock__.release()
+
+        if callback is not None:
+            callback(pin)
+
+    def __init__(self):
+        self.mode = None
+        self.__lock__ = threading.Lock()
+        self.__directions__ = {}
+        self.__levels__ = {}
+        self.__driven_pins__ = set()
+        self.__edge_callbacks__ = {}
+
+
+class SimulatedPcf8591(object):
+    """
+    The ADC. A read returns the previous conversion byte,
+    then the channels.
+    """
+
+    def read_byte(self, address):
+        return self.__get_channel__(self.control & 0x03)
+
+    def write_byte(self, address, control):
+        self.control = control
+
+    def write_byte_data(self, address, control, value):
+        self.control = control
+        self.dac_value = value
+
+    def read_i2c_block_data(self, address, control, length):
+        self.control = control
+        values = [self.__previous_value__] \
+            + [self.__get_channel__(channel) for channel in range(4)]
+        self.__previous_value__ = values[-1]
+
+        return (values * (length / len(values) + 1))[:length]
+
+    def __get_channel__(self, channel):
+        value = self.__backend__.get_value("ADC" + str(channel), 0)
+
+        return int(round(min(255, max(0, value))))
+
+    def __init__(self, backend):
+        self.__backend__ = backend
+        self.control = 0
+        self.dac_value = None
+        self.__previous_value__ = 0x80
+
+
+class SimulatedTsl2591(object):
+    """
+    The light sensor. The channels follow the LUX waveform
+    through the gain and integration time that are set, and
+    saturate like the real one. The ALS interrupt fires on the
+    first cycle outside the thresholds; persistence is ignored.
+    """
+
+    def read_byte_data(self, address, command):
+        return self.__get_registers__().get(command & 0x1F, 0)
+
+    def write_byte_data(self, address, command, value):
+        self.__write_registers__(command & 0x1F, [value])
+
+    def write_i2c_block_data(self, address, command, data):
+        self.__write_registers__(command & 0x1F, data)
+
+    def write_byte(self, address, command):
+        # Special functions clear the interrupt
+        if command & SPECIAL_FUNCTION_BITS == SPECIAL_FUNCTION_BITS:
+            self.__lock__.acquire()
+            try:
+                self.is_interrupt_pending = False
+            finally:
+                self.__lock__.release()
+
+    def read_i2c_block_data(self, address, command, length):
+        registers = self.__get_registers__()
+        register = command & 0x1F
+
+        return [registers.get(register + offset, 0) for offset in range(length)]
+
+    def update(self):
+        """
+        Raises the interrupt if channel 0 is outside the
+        thresholds. Returns True if it is pending.
+        """
+
+        self.__lock__.acquire()
+        try:
+            enable = self.__registers__.get(light_sensor.REGISTER_ENABLE, 0)
+
+            if enable & light_sensor.ENABLE_AIEN and self.__is_valid__():
+                full = self.get_channels()[0]
+                low = self.__get_word__(light_sensor.REGISTER_THRESHOLD_AILTL)
+                high = self.__get_word__(light_sensor.REGISTER_THRESHOLD_AIHTL)
+
+                if full < low or full > high:
+                    self.is_interrupt_pending = True
+
+            return self.is_interrupt_pending
+        finally:
+            self.__lock__.release()
+
+    def get_channels(self):
+        """
+        Returns (full, ir) for the light now.
+        """
+
+        control = self.__registers__.get(light_sensor.REGISTER_CONTROL, 0)
+        integration = control & 0x07
+        gain = control & 0x30
+        counts_per_lux = light_sensor.COUNTS_PER_LUX.get(
+            (integration, gain),
+            light_sensor.COUNTS_PER_LUX[(light_sensor.INTEGRATIONTIME_100MS,
+                                         light_sensor.GAIN_LOW)])
+        lux = max(0.0, self.__backend__.get_value("LUX", 0))
+
+        # So that calculate_lux gives the lux back
+        full = lux * counts_per_lux \
+            / (1.0 - light_sensor.LUX_COEFB * SIMULATED_INFRARED_FRACTION)
+        infrared = full * SIMULATED_INFRARED_FRACTION
+        max_count = light_sensor.get_max_count(integration)
+
+        return int(min(max_count, full)), int(min(max_count, infrared))
+
+    def __is_valid__(self):
+        """
+        Returns True once an integration cycle has completed.
+        """
+
+        enable = self.__registers__.get(light_sensor.REGISTER_ENABLE, 0)
+        is_running = enable & light_sensor.ENABLE_POWERON \
+            and enable & light_sensor.ENABLE_AEN
+        control = self.__registers__.get(light_sensor.REGISTER_CONTROL, 0)
+        integration_seconds = light_sensor.INTEGRATION_TIMES_MS.get(
+            control & 0x07, 100.) / 1000.0
+
+        return bool(is_running) \
+            and self.__backend__.clock() - self.__cycle_start_time__ >= integration_seconds
+
+    def __get_word__(self, register):
+        return self.__registers__.get(register, 0) \
+            | (self.__registers__.get(register + 1, 0) << 8)
+
+    def __get_registers__(self):
+        """
+        Returns the registers, with the status and
+        channels of the light now.
+        """
+
+        self.__lock__.acquire()
+        try:
+            registers = dict(self.__registers__)
+            status = 0
+
+            if self.__is_valid__():
+                status |= light_sensor.STATUS_AVALID
+                full, infrared = self.get_channels()
+                registers[light_sensor.REGISTER_CHAN0_LOW] = full & 0xFF
+                registers[light_sensor.REGISTER_CHAN0_HIGH] = full >> 8
+                registers[light_sensor.REGISTER_CHAN1_LOW] = infrared & 0xFF
+                registers[light_sensor.REGISTER_CHAN1_HIGH] = infrared >> 8
+
+            if self.is_interrupt_pending:
+                status |= STATUS_AINT
+
+            registers[light_sensor.REGISTER_STATUS] = status
+
+            return registers
+        finally:
+            self.__lock__.release()
+
+    def __write_registers__(self, register, values):
+        self.__lock__.acquire()
+        try:
+            was_running = self.__registers__.get(light_sensor.REGISTER_ENABLE, 0) \
+                & light_sensor.ENABLE_AEN
+
+            for offset, value in enumerate(values):
+                self.__registers__[register + offset] = value
+
+            is_running = self.__registers__.get(light_sensor.REGISTER_ENABLE, 0) \
+                & light_sensor.ENABLE_AEN
+
+            # A new setting, or starting up, restarts integration
+            if register == light_sensor.REGISTER_CONTROL \
+                    or (is_running and not was_running):
+                self.__cycle_start_time__ = self.__backend__.clock()
+        finally:
+            self.__lock__.release()
+
+    def __init__(self, backend):
+        self.__backend__ = backend
+        self.__lock__ = threading.Lock()
+        self.__registers__ = {light_sensor.REGISTER_ID: TSL2591_ID}
+        self.__cycle_start_time__ = backend.clock()
+        self.is_interrupt_pending = False
+
+
+class SimulatedLcd1602(object):
+    """
+    A 1602 LCD behind a PCF8574 backpack, in 4 bit mode.
+    Keeps the text that is on the screen.
+
+    write_count is the bytes written to the backpack's
+    pins, and transaction_count the I2C writes they took.
+    The rows of each custom character are kept in glyphs.
+    """
+
+    def write_byte(self, address, value):
+        self.transaction_count += 1
+        self.__write_pins__(value)
+
+    def write_i2c_block_data(self, address, register, data):
+        # The backpack has no registers, each byte sets the pins
+        self.transaction_count += 1
+
+        for value in [register] + list(data):
+            self.__write_pins__(value)
+
+    def get_lines(self):
+        """
+        Returns the text of each row.
+        """
+
+        return ["".join(row) for row in self.__rows__]
+
+    def __write_pins__(self, value):
+        self.write_count += 1
+        self.is_backlight_on = bool(value & LCD_BACKLIGHT)
+
+        # The HD44780 latches a nibble when EN falls
+        if self.__last_value__ & LCD_ENABLE and not value & LCD_ENABLE:
+            self.__latch__(value)
+
+        self.__last_value__ = value
+
+    def __latch__(self, value):
+        nibble = value & 0xF0
+
+        if self.__high_nibble__ is None:
+            self.__high_nibble__ = nibble
+            return
+
+        byte = self.__high_nibble__ | (nibble >> 4)
+        self.__high_nibble__ = None
+
+        if value & LCD_REGISTER_SELECT and self.__cgram_address__ is not None:
+            self.glyphs[self.__cgram_address__ >> 3][self.__cgram_address__ & 0x07] = byte
+            self.__cgram_address__ = (self.__cgram_address__ + 1) & 0x3F
+        elif value & LCD_REGISTER_SELECT:
+            if self.__row__ < LCD_ROWS and self.__column__ < LCD_COLUMNS:
+                self.__rows__[self.__row__][self.__column__] = chr(byte)
+
+            self.__column__ += 1
+        elif byte == 0x01:
+            self.__rows__ = [[" "] * LCD_COLUMNS for _ in range(LCD_ROWS)]
+            self.__row__ = 0
+            self.__column__ = 0
+            self.__cgram_address__ = None
+        elif byte & 0x80:
+            self.__cgram_address__ = None
+            address = byte & 0x7F
+            self.__row__ = 1 if address >= 0x40 else 0
+            self.__column__ = address - 0x40 * self.__row__
+        elif byte & 0x40:
+            self.__cgram_address__ = byte & 0x3F
+
+    def __init__(self):
+        self.write_count = 0
+        self.transaction_count = 0
+        self.is_backlight_on = False
+        self.__last_value__ = 0
+        self.__high_nibble__ = None
+        self.__rows__ = [[" "] * LCD_COLUMNS for _ in range(LCD_ROWS)]
+        self.__row__ = 0
+        self.__column__ = 0
+        self.__cgram_address__ = None
+        self.glyphs = [[0] * 8 for _ in range(8)]
+
+
+class SimulatedSmBus(object):
+    """
+    Stands in for smbus.SMBus. Passes each transaction to the
+    device at the address, and raises IOError, like a real bus,
+    if nothing is there.
+    """
+
+    def read_byte(self, address):
+        return self.__get_device__(address, "read_byte")(address)
+
+    def write_byte(self, address, value):
+        return self.__get_device__(address, "write_byte")(address, value)
+
+    def read_byte_data(self, address, register):
+        return self.__get_device__(address, "read_byte_data")(address, register)
+
+    def write_byte_data(self, address, register, value):
+        return self.__get_device__(address, "write_byte_data")(address, register, value)
+
+    def read_i2c_block_data(self, address, register, length):
+        return self.__get_device__(address, "read_i2c_block_data")(address, register,
+                                                                   length)
+
+    def write_i2c_block_data(self, address, register, data):
+        return self.__get_device__(address, "write_i2c_block_data")(address, register,
+                                                                    data)
+
+    def close(self):
+        pass
+
+    def __get_device__(self, address, operation_name):
+        device = self.__devices__.get(address)
+
+        if device is None or not hasattr(device, operation_name):
+            raise IOError(REMOTE_IO_ERROR, "Remote I/O error")
+
+        return getattr(device, operation_name)
+
+    def __init__(self, devices):
+        self.__devices__ = devices
+
+
+class SimulatedOneWire(object):
+    """
+    The sysfs files of a 1-Wire bus master with bulk read, and
+    a DS18B20 for each "28-" waveform. Conversions are instant.
+    """
+
+    def list_directory(self, path):
+        if self.__get_parts__(path) != []:
+            raise OSError(2, "No such file or directory", path)
+
+        return self.__get_probe_ids__() + [self.bus_master_name]
+
+    def exists(self, path):
+        parts = self.__get_parts__(path)
+
+        if parts is None or len(parts) > 2:
+            return False
+
+        if len(parts) < 2:
+            return parts == [] or parts[0] in self.list_directory(self.devices_directory)
+
+        if parts[0] == self.bus_master_name:
+            return parts[1] == temp_probe.BULK_READ_FILE
+
+        return parts[0] in self.__get_probe_ids__() \
+            and parts[1] in ["w1_slave", "resolution"]
+
+    def read_file(self, path):
+        if not self.exists(path):
+            raise IOError(2, "No such file or directory", path)
+
+        device_name, file_name = self.__get_parts__(path)
+
+        if device_name == self.bus_master_name:
+            return "1\n"
+
+        resolution = self.resolutions.get(device_name, temp_probe.DEFAULT_RESOLUTION)
+
+        if file_name == "resolution":
+            return str(resolution) + "\n"
+
+        return get_w1_slave_text(self.__backend__.get_value(device_name, 0),
+                                 resolution)
+
+    def write_file(self, path, text):
+        if not self.exists(path):
+            raise IOError(2, "No such file or directory", path)
+
+        device_name, file_name = self.__get_parts__(path)
+
+        if file_name == "resolution":
+            self.resolutions[device_name] = int(text)
+
+    def __get_probe_ids__(self):
+        return sorted([channel for channel in self.__backend__.waveforms.keys()
+                       if channel.startswith(temp_probe.PROBE_PREFIX)])
+
+    def __get_parts__(self, path):
+        """
+        Returns the parts of the path below the devices
+        directory, or None if it is not below it.
+        """
+
+        relative_path = os.path.relpath(path, self.devices_directory)
+
+        if relative_path == ".":
+            return []
+
+        if relative_path.startswith(".."):
+            return None
+
+        return relative_path.split(os.sep)
+
+    def __init__(self, backend, devices_directory=temp_probe.W1_DEVICES_DIRECTORY):
+        self.__backend__ = backend
+        self.devices_directory = devices_directory
+        self.bus_master_name = temp_probe.BUS_MASTER_PREFIX + "1"
+        self.resolutions = {}
+
+
+def get_w1_slave_text(temperature, resolution=temp_probe.DEFAULT_RESOLUTION):
+    """
+    Returns the contents of a w1_slave file, with the
+    temperature (in C) rounded to the resolution.
+
+    >>> temp_probe.parse_w1_slave(get_w1_slave_text(23.14))
+    23.125
+    >>> temp_probe.parse_w1_slave(get_w1_slave_text(23.14, 9))
+    23.0
+    """
+
+    step = 0.0625 * 2 ** (12 - resolution)
+    millidegrees = int(round(temperature / step) * step * 1000)
+
+    return "72 01 4b 46 7f ff 0e 10 57 : crc=57 YES\n" \
+        + "72 01 4b 46 7f ff 0e 10 57 t=" + str(millidegrees) + "\n"
+
+
+class SimulatedModem(object):
+    """
+    A Fona on the serial port, with the methods of serial.Serial
+    that the Fona driver uses. It echoes and answers the AT
+    commands, keeps the messages on its SIM card, and keeps
+    the messages it was asked to send.
+
+    receive_message() puts a message on the SIM card and
+    pulses the ring indicator pin, if there is one.
+    """
+
+    def receive_message(self, sender_number, message_text):
+        """
+        Receives a text message, as if it was sent now.
+        Returns the id of the message on the SIM card.
+        """
+
+        sent_time = datetime.datetime.utcfromtimestamp(self.__backend__.clock()) \
+            + datetime.timedelta(minutes=MODEM_TIMEZONE_QUARTER_HOURS * 15)
+
+        self.__lock__.acquire()
+        try:
+            self.__last_message_id__ += 1
+            message_id = self.__last_message_id__
+            self.__sim_card__[message_id] = ["REC UNREAD", sender_number,
+                                             sent_time, message_text]
+        finally:
+            self.__lock__.release()
+
+        if self.ring_indicator_pin is not None:
+            # The RI pin is pulled low for a moment
+            self.__backend__.gpio.drive(self.ring_indicator_pin, False)
+            self.__backend__.gpio.drive(self.ring_indicator_pin, True)
+
+        return message_id
+
+    def take_sent_messages(self):
+        """
+        Returns the (time, number, text) of the messages sent
+        since the last call, and forgets them.
+        """
+
+        self.__lock__.acquire()
+        try:
+            sent_messages = self.__sent_messages__
+            self.__sent_messages__ = []
+
+            return sent_messages
+        finally:
+            self.__lock__.release()
+
+    def get_message_count(self):
+        """
+        Returns how many messages are on the SIM card.
+        """
+
+        self.__lock__.acquire()
+        try:
+            return len(self.__sim_card__)
+        finally:
+            self.__lock__.release()
+
+    def write(self, data):
+        self.__lock__.acquire()
+        try:
+            for character in data:
+                if self.__recipient__ is not None:
+                    self.__add_message_character__(character)
+                elif character in "\r\n":
+                    command = self.__command__.strip()
+                    self.__command__ = ""
+
+                    if command:
+                        self.__run_command__(command)
+                else:
+                    self.__command__ += character
+
+            return len(data)
+        finally:
+            self.__lock__.release()
+
+    def read(self, size=1):
+        self.__lock__.acquire()
+        try:
+            read_text = self.__output__[:size]
+            self.__output__ = self.__output__[size:]
+
+            return read_text
+        finally:
+            self.__lock__.release()
+
+    def readline(self):
+        self.__lock__.acquire()
+        try:
+            line_end = self.__output__.find("\n") + 1
+
+            if line_end == 0:
+                line_end = len(self.__output__)
+
+            line = self.__output__[:line_end]
+            self.__output__ = self.__output__[line_end:]
+
+            return line
+        finally:
+            self.__lock__.release()
+
+    def inWaiting(self):
+        return len(self.__output__)
+
+    def flush(self):
+        pass
+
+    def flushInput(self):
+        self.__lock__.acquire()
+        try:
+            self.__output__ = ""
+        finally:
+            self.__lock__.release()
+
+    def flushOutput(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __run_command__(self, command):
+        """
+        Echoes and answers a command. Must hold the lock.
+        """
+
+        self.__output__ += command + "\r\n"
+        upper_command = command.upper()
+        response = []
+
+        if upper_command == "AT+CSQ":
+            response = ["+CSQ: " + str(int(self.__backend__.get_value("CSQ", 20))) + ",0"]
+        elif upper_command == "AT+CBC":
+            response = ["+CBC: 0," + str(int(self.__backend__.get_value("BATTERY", 95)))
+                        + "," + str(MODEM_BATTERY_MILLIVOLTS)]
+        elif upper_command == "AT+COPS?":
+            response = ['+COPS: 0,0,"SIMULATED"']
+        elif upper_command == "ATI":
+            response = ["SIM800 R14.18"]
+        elif upper_command == "AT+CCID":
+            response = ["89014103211118510720"]
+        elif upper_command.startswith("AT+CMGL"):
+            response = self.__list_messages__()
+        elif upper_command.startswith("AT+CMGD="):
+            try:
+                self.__sim_card__.pop(int(command[8:]), None)
+            except ValueError:
+                response = None
+        elif upper_command.startswith("AT+CMGS="):
+            self.__recipient__ = command[8:].strip('"')
+            self.__message_text__ = ""
+            self.__output__ += "> "
+
+            return
+        elif not upper_command.startswith("AT"):
+            response = None
+
+        if response is None:
+            self.__output__ += "ERROR\r\n"
+            return
+
+        for line in response:
+            self.__output__ += line + "\r\n"
+
+        self.__output__ += "\r\nOK\r\n"
+
+    def __list_messages__(self):
+        """
+        Returns the AT+CMGL lines of the messages on the SIM
+        card, and marks them as read. Must hold the lock.
+        """
+
+        lines = []
+
+        for message_id in sorted(self.__sim_card__.keys()):
+            message = self.__sim_card__[message_id]
+            status, sender_number, sent_time, message_text = message
+            lines.append("+CMGL: " + str(message_id) + ',"' + status + '","'
+                         + sender_number + '","","'
+                         + sent_time.strftime("%y/%m/%d,%H:%M:%S")
+                         + str(MODEM_TIMEZONE_QUARTER_HOURS) + '"')
+            lines.append(message_text)
+            message[0] = "REC READ"
+
+        return lines
+
+    def __add_message_character__(self, character):
+        """
+        Adds to the message being sent, and sends it at
+        the end of message character. Must hold the lock.
+        """
+
+        if character != MODEM_END_OF_MESSAGE:
+            self.__message_text__ += character
+            return
+
+        self.__sent_messages__.append((self.__backend__.clock(),
+                                       self.__recipient__,
+                                       self.__message_text__.strip()))
+        self.__recipient__ = None
+        self.__message_text__ = ""
+        self.sent_message_count += 1
+        self.__output__ += "\r\n+CMGS: " + str(self.sent_message_count) \
+            + "\r\n\r\nOK\r\n"
+
+    def __init__(self, backend, ring_indicator_pin=None):
+        self.__backend__ = backend
+        self.ring_indicator_pin = ring_indicator_pin
+        self.__lock__ = threading.RLock()
+        self.__command__ = ""
+        self.__output__ = ""
+        self.__recipient__ = None
+        self.__message_text__ = ""
+        self.__last_message_id__ = 0
+        self.__sim_card__ = {}
+        self.__sent_messages__ = []
+        self.sent_message_count = 0
+
+
+class SimulatedBackend(object):
+    """
+    A hangar of simulated devices on I2C bus 1, the GPIO
+    and the 1-Wire bus.
+
+    light_interrupt_pin is the GPIO input the light sensor's
+    INT pin is wired to, if it is. ring_indicator_pin is the
+    one the Fona's RI pin is wired to.
+
+    The waveforms follow the application's clock, so they
+    speed up with it.
+    """
+
+    name = "simulated"
+
+    def get_value(self, channel, default_value=None):
+        """
+        Returns the value of a waveform now.
+        """
+
+        waveform = self.waveforms.get(channel)
+
+        if waveform is None:
+            return default_value
+
+        return waveform.get_value(self.get_seconds())
+
+    def get_seconds(self):
+        """
+        Returns how long the simulation has been running.
+        """
+
+        return self.clock() - self.start_time
+
+    def get_gpio(self):
+        self.__start_ticking__()
+
+        return self.gpio
+
+    def open_smbus(self, bus_id):
+        return SimulatedSmBus(self.devices)
+
+    def open_serial(self, port, baud_rate):
+        return self.modem
+
+    def get_sysfs(self):
+        return self.one_wire
+
+    def update(self):
+        """
+        Brings the GPIO inputs up to date with the waveforms.
+        """
+
+        for channel in self.waveforms.keys():
+            if channel.startswith("PIN"):
+                try:
+                    pin = int(channel[3:])
+                except ValueError:
+                    continue
+
+                self.gpio.drive(pin, self.get_value(channel) >= 0.5)
+
+        if self.light_interrupt_pin is not None:
+            # The INT pin is active low
+            self.gpio.drive(self.light_interrupt_pin,
+                            not self.light_sensor.update())
+
+    def close(self):
+        self.__stop_event__.set()
+
+    def __start_ticking__(self):
+        """
+        Starts updating the inputs in the background.
+        """
+
+        if self.tick_seconds is None or self.__tick_thread__ is not None:
+            return
+
+        self.__tick_thread__ = threading.Thread(target=self.__tick__,
+                                                name="hardware_simulator")
+        self.__tick_thread__.daemon = True
+        self.__tick_thread__.start()
+
+    def __tick__(self):
+        while not self.__stop_event__.is_set():
+            try:
+                self.update()
+            except:
+                pass
+
+            self.__stop_event__.wait(self.tick_seconds)
+
+    def __init__(self,
+                 waveform_definitions=None,
+                 replay_file=None,
+                 clock=None,
+                 light_interrupt_pin=None,
+                 tick_seconds=DEFAULT_TICK_SECONDS,
+                 ring_indicator_pin=None):
+        if clock is None:
+            clock = application_clock.get_time
+
+        self.clock = clock
+        self.start_time = clock()
+        self.waveforms = get_default_waveforms()
+
+        if waveform_definitions:
+            self.waveforms.update(parse_waveform_definitions(waveform_definitions))
+
+        if replay_file:
+            self.waveforms.update(load_replay(replay_file))
+
+        self.light_interrupt_pin = light_interrupt_pin
+        self.tick_seconds = tick_seconds
+        self.gpio = SimulatedGpio()
+        self.gas_adc = SimulatedPcf8591(self)
+        self.light_sensor = SimulatedTsl2591(self)
+        self.lcd = SimulatedLcd1602()
+        self.devices = {
+            0x48: self.gas_adc,
+            0x29: self.light_sensor,
+            0x27: self.lcd
+        }
+        self.one_wire = SimulatedOneWire(self)
+        self.modem = SimulatedModem(self, ring_indicator_pin)
+        self.__stop_event__ = threading.Event()
+        self.__tick_thread__ = None
+
+
+##############
+# UNIT TESTS #
+##############
+
+def test_light_sensor(backend):
+    """
+    Test that the light sensor driver reads back the lux
+    of the waveform, across its ranges.
+    """
+
+    for lux in [0.5, 120, 20000]:
+        backend.waveforms["LUX"] = ConstantWaveform(lux)
+        result = light_sensor.LightSensorResult(
+            light_sensor.LightSensor(auto_range=True))
+
+        assert result.enabled
+        assert abs(result.lux - lux) <= lux * 0.05 + 0.1
+
+
+def test_lcd(backend):
+    """
+    Test that the text written to the LCD is decoded.
+    """
+
+    from sf_1602_lcd import LcdDisplay
+
+    lcd = LcdDisplay()
+    lcd.write_text("CSQ:9 MARGINAL\nBAT:98%")
+
+    assert backend.lcd.get_lines() == ["CSQ:9 MARGINAL  ", "BAT:98%         "]
+
+    # Only the changed characters are sent, each as two
+    # nibbles of two writes, and the cursor is only moved
+    # when it is not already on the next changed character.
+    # The whole frame goes out in one block write.
+    write_count = backend.lcd.write_count
+    transaction_count = backend.lcd.transaction_count
+    lcd.write_text("CSQ:8 MARGINAL\nBAT:97%")
+
+    assert backend.lcd.get_lines() == ["CSQ:8 MARGINAL  ", "BAT:97%         "]
+    assert backend.lcd.write_count - write_count == 4 * 4
+    assert backend.lcd.transaction_count - transaction_count == 1
+
+    write_count = backend.lcd.write_count
+    lcd.write_text("CSQ:8 MARGINAL\nBAT:97%")
+
+    assert backend.lcd.write_count == write_count
+    assert " last=0 " in lcd.get_stats_text()
+
+    lcd.write(7, 1, "V:4.1")
+
+    assert backend.lcd.get_lines() == ["CSQ:8 MARGINAL  ", "BAT:97%V:4.1    "]
+
+    # A full screen is 32 characters and 2 cursor moves,
+    # 136 bytes in blocks of 32
+    transaction_count = backend.lcd.transaction_count
+    lcd.write_text("ABCDEFGHIJKLMNOP\nQRSTUVWXYZ012345")
+
+    assert backend.lcd.get_lines() == ["ABCDEFGHIJKLMNOP", "QRSTUVWXYZ012345"]
+    assert backend.lcd.transaction_count - transaction_count == 5
+
+    # A glyph goes to the CGRAM, and the text after it
+    # still lands where it should
+    lcd.define_glyph(6, [0x04, 0x0E, 0x1F, 0x1F, 0x1F, 0x0E, 0x00, 0x00])
+    lcd.write_text("ABCDEFGHIJKLMNOP\nQRSTUVWXYZ01234" + chr(6))
+
+    assert backend.lcd.glyphs[6] == [0x04, 0x0E, 0x1F, 0x1F, 0x1F, 0x0E, 0x00, 0x00]
+    assert backend.lcd.get_lines() == ["ABCDEFGHIJKLMNOP", "QRSTUVWXYZ01234\x06"]
+
+
+def test_gpio_edges():
+    """
+    Test that a waveform on a pin calls the edge callback.
+    """
+
+    clock_seconds = [0.0]
+    backend = SimulatedBackend(clock=lambda: clock_seconds[0], tick_seconds=None)
+    backend.waveforms["PIN18"] = StepWaveform([(0, 0), (10, 1), (20, 0)])
+    gpio = backend.get_gpio()
+    rising_edges = []
+    gpio.setup(18, gpio.IN)
+    gpio.add_event_detect(18, gpio.RISING, rising_edges.append)
+
+    for seconds in [0, 5, 10, 15, 20, 25]:
+        clock_seconds[0] = seconds
+        backend.update()
+
+    assert rising_edges == [18]
+
+    gpio.setup(22, gpio.OUT)
+    gpio.output(22, gpio.HIGH)
+    assert gpio.input(22) == gpio.HIGH
+
+
+def test_temperature_probes(backend):
+    """
+    Test that the probes are found, and read at their resolution.
+    """
+
+    backend.waveforms["28-000000000002"] = ConstantWaveform(21.3)
+    probes = temp_probe.TemperatureProbes(resolutions={"28-000000000002": 10})
+
+    assert probes.get_probe_ids() == [DEFAULT_PROBE_ID, "28-000000000002"]
+    assert probes.read_probes()["28-000000000002"] == 21.25
+    assert probes.bulk_read_count == 1
+
+
+def test_modem():
+    """
+    Test that the Fona driver can read, delete and
+    send messages through the modem, and that a message
+    rings the RI pin.
+    """
+
+    import logging
+    import fona
+    import task_scheduler
+    from logger import Logger
+
+    previous_clock = application_clock.set_clock(application_clock.ScaledClock(1000.0))
+
+    try:
+        backend = SimulatedBackend(tick_seconds=None, ring_indicator_pin=18)
+        modem = backend.open_serial("/dev/ttyUSB0", 9600)
+        rings = []
+        backend.gpio.setup(18, backend.gpio.IN)
+        backend.gpio.add_event_detect(18, backend.gpio.RISING, rings.append)
+        sim_fona = fona.Fona(Logger(logging.getLogger("modem_test")), modem, None, None)
+
+        modem.receive_message("+12061234567", "Status")
+        assert rings == [18]
+
+        messages = sim_fona.get_messages()
+        assert len(messages) == 1
+        assert messages[0].message_text == "Status"
+        assert messages[0].get_sender_number() == "12061234567"
+        assert messages[0].minutes_waiting() == 0
+
+        sim_fona.delete_message(messages[0])
+        assert modem.get_message_count() == 0
+
+        sim_fona.send_message("2061234567", "HEATER OFF")
+        assert [sent[1:] for sent in modem.take_sent_messages()] == \
+            [("2061234567", "HEATER OFF")]
+        assert modem.take_sent_messages() == []
+
+        assert sim_fona.get_current_battery_condition().get_percent_battery() == 95
+        assert sim_fona.get_signal_strength().get_signal_strength() == 20
+    finally:
+        # Stops the Fona's polling task
+        task_scheduler.shutdown()
+        application_clock.set_clock(previous_clock)
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+
+    # The drivers get their devices from the selected backend
+    import hardware
+    BACKEND = hardware.select_backend(hardware.SIMULATED)
+
+    test_light_sensor(BACKEND)
+    test_lcd(BACKEND)
+    test_gpio_edges()
+    test_temperature_probes(BACKEND)
+    test_modem()
+
+    print "Tests finished"
@@ -0,0 +1,451 @@
+"""
+Module to run recurring tasks from a single scheduler thread.
+
+Tasks are kept in a heap ordered by their next deadline so
+the scheduler only ever has to look at the earliest task.
+"""
+
+import heapq
+import itertools
+import sys
+import threading
+import time
+import clock
+from ring_buffer import RingBuffer
+
+FIXED_RATE = "FIXED_RATE"
+FIXED_DELAY = "FIXED_DELAY"
+
+# How long the scheduler thread is allowed to take to exit
+DEFAULT_SHUTDOWN_TIMEOUT = 5
+
+# How many runs of each task are kept for the metrics
+DEFAULT_METRICS_SAMPLES = 64
+
+
+def log_message(logger, message):
+    """
+    Logs to either a logging.Logger or a lib.logger.Logger.
+    """
+
+    if logger is None:
+        return
+
+    if hasattr(logger, "log_warning_message"):
+        logger.log_warning_message(message)
+    else:
+        logger.info(message)
+
+
+class ScheduledTask(object):
+    """
+    A single task that is owned by a scheduler.
+    """
+
+    def is_cancelled(self):
+        """
+        Returns True if the task will never run again.
+        """
+
+        return self.__is_cancelled__
+
+    def cancel(self):
+        """
+        Stops the task from running again.
+        Safe to call from inside the callback.
+        """
+
+        self.__scheduler__.cancel(self)
+
+    def __init__(self, scheduler, task_name, task_interval, task_callback, mode, logger):
+        """
+        Creates a new task. Use TaskScheduler.schedule() instead.
+        """
+
+        self.__scheduler__ = scheduler
+        self.__is_cancelled__ = False
+
+        self.task_name = task_name
+        self.task_interval = float(task_interval)
+        self.task_callback = task_callback
+        self.mode = mode
+        self.logger = logger
+        self.next_run_time = None
+        self.run_count = 0
+        self.overrun_count = 0
+        self.skipped_count = 0
+        self.last_runtime = 0.0
+        self.runtimes = RingBuffer(DEFAULT_METRICS_SAMPLES)
+        self.lateness = RingBuffer(DEFAULT_METRICS_SAMPLES)
+        self.skips = RingBuffer(DEFAULT_METRICS_SAMPLES)
+
+    def get_stats_text(self):
+        """
+        Returns a one line summary of how the task has been running.
+        Times are in milliseconds. Skips are the total, then those
+        of the most recent runs.
+
+        >>> task = ScheduledTask(None, "test", 5, None, FIXED_RATE, None)
+        >>> task.get_stats_text()
+        'test:n=0'
+        >>> task.run_count = 1
+        >>> task.runtimes.append(0.25)
+        >>> task.lateness.append(0.002)
+        >>> task.skips.append(0)
+        >>> task.get_stats_text()
+        'test:n=1 run=250/250ms late=2/2ms skip=0/0 ovr=0'
+        """
+
+        if self.run_count == 0:
+            return self.task_name + ":n=0"
+
+        return self.task_name + ":n=" + str(self.run_count) \
+            + " run=" + __to_ms__(self.runtimes.get_mean()) \
+            + "/" + __to_ms__(self.runtimes.get_max()) + "ms" \
+            + " late=" + __to_ms__(self.lateness.get_mean()) \
+            + "/" + __to_ms__(self.lateness.get_max()) + "ms" \
+            + " skip=" + str(self.skipped_count) \
+            + "/" + str(int(sum(self.skips.values()))) \
+            + " ovr=" + str(self.overrun_count)
+
+
+def __to_ms__(seconds):
+    """
+    Formats seconds as whole milliseconds.
+
+    >>> __to_ms__(0.0125)
+    '12'
+    """
+
+    return str(int(seconds * 1000))
+
+
+class TaskScheduler(object):
+    """
+    Runs every scheduled task from one daemon thread.
+
+    FIXED_RATE tasks are scheduled from their previous deadline,
+    so callback duration does not build up drift. If a run is
+    so late that one or more deadlines were missed, the missed
+    runs are skipped and counted rather than run back-to-back.
+
+    FIXED_DELAY tasks are scheduled from the end of the previous run.
+    """
+
+    def schedule(self, task_name, task_interval, task_callback, mode=FIXED_RATE,
+                 logger=None, initial_delay=0):
+        """
+        Adds a task to the scheduler and returns the ScheduledTask.
+        """
+
+        task = ScheduledTask(self, task_name, task_interval,
+                             task_callback, mode, logger)
+
+        self.__condition__.acquire()
+        try:
+            task.next_run_time = clock.get_time() + initial_delay
+            self.__push__(task)
+            self.__start_thread__()
+            self.__condition__.notify()
+        finally:
+            self.__condition__.release()
+
+        return task
+
+    def cancel(self, task):
+        """
+        Cancels the task. The heap entry is discarded lazily
+        when it reaches the top.
+        """
+
+        self.__condition__.acquire()
+        try:
+            task.__is_cancelled__ = True
+            self.__condition__.notify()
+        finally:
+            self.__condition__.release()
+
+    def get_tasks(self):
+        """
+        Returns the tasks that are still scheduled.
+        """
+
+        self.__condition__.acquire()
+        try:
+            tasks = [entry[2] for entry in self.__heap__
+                     if not entry[2].is_cancelled()]
+            if self.__running_task__ is not None \
+                    and not self.__running_task__.is_cancelled():
+                tasks.append(self.__running_task__)
+        finally:
+            self.__condition__.release()
+
+        return sorted(tasks, key=lambda task: task.task_name)
+
+    def get_stats_text(self):
+        """
+        Returns the run/lateness/skip summary for every task,
+        one line per task. Run and late are mean/max.
+        """
+
+        return "\n".join([task.get_stats_text() for task in self.get_tasks()])
+
+    def shutdown(self, timeout=DEFAULT_SHUTDOWN_TIMEOUT):
+        """
+        Stops the scheduler thread. Any task that is running
+        is allowed to finish.
+        """
+
+        self.__condition__.acquire()
+        try:
+            self.__is_shutdown__ = True
+            self.__condition__.notify()
+            thread = self.__thread__
+        finally:
+            self.__condition__.release()
+
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def is_shutdown(self):
+        """
+        Returns True if the scheduler has been shutdown.
+        """
+
+        return self.__is_shutdown__
+
+    def __init__(self, name="scheduler"):
+        """
+        Creates a scheduler. The thread is started when the
+        first task is scheduled.
+        """
+
+        self.__thread_name__ = name
+        self.__heap__ = []
+        self.__sequence__ = itertools.count()
+        self.__condition__ = threading.Condition()
+        self.__thread__ = None
+        self.__running_task__ = None
+        self.__is_shutdown__ = False
+
+    def __push__(self, task):
+        """
+        Puts the task into the heap. Must hold the condition.
+        The sequence number keeps tasks with the same deadline
+        in the order they were added.
+        """
+
+        heapq.heappush(self.__heap__,
+                       (task.next_run_time, next(self.__sequence__), task))
+
+    def __start_thread__(self):
+        """
+        Starts the scheduler thread if needed. Must hold the condition.
+        """
+
+        if self.__thread__ is not None or self.__is_shutdown__:
+            return
+
+        self.__thread__ = threading.Thread(target=self.__run__,
+                                           name=self.__thread_name__)
+        self.__thread__.daemon = True
+        self.__thread__.start()
+
+    def __next_task__(self):
+        """
+        Blocks until the earliest task is due.
+        Returns None when the scheduler is shutdown.
+        """
+
+        self.__condition__.acquire()
+        try:
+            while not self.__is_shutdown__:
+                if not self.__heap__:
+                    self.__condition__.wait()
+                    continue
+
+                deadline, _, task = self.__heap__[0]
+
+                if task.is_cancelled():
+                    heapq.heappop(self.__heap__)
+                    continue
+
+                time_until_due = deadline - clock.get_time()
+
+                if time_until_due > 0:
+                    self.__condition__.wait(clock.to_real_seconds(time_until_due))
+                    continue
+
+                heapq.heappop(self.__heap__)
+                self.__running_task__ = task
+
+                return task
+        finally:
+            self.__condition__.release()
+
+        return None
+
+    def __execute__(self, task):
+        """
+        Runs the callback and records how long it took.
+        """
+
+        start_time = clock.get_time()
+        task.lateness.append(max(0.0, start_time - task.next_run_time))
+
+        try:
+            task.task_callback()
+        except:
+            log_message(task.logger, "EX(" + task.task_name + ")=" +
+                        str(sys.exc_info()[0]))
+
+        finish_time = clock.get_time()
+        task.last_runtime = finish_time - start_time
+        task.runtimes.append(task.last_runtime)
+        task.run_count += 1
+
+        if task.last_runtime > task.task_interval:
+            task.overrun_count += 1
+
+            log_message(task.logger, "OVERRUN(" + task.task_name + ")=" +
+                        str(round(task.last_runtime, 3)) + "s")
+
+        return finish_time
+
+    def __reschedule__(self, task, finish_time):
+        """
+        Works out when the task should next run and puts it back in the heap.
+        """
+
+        if task.mode == FIXED_DELAY:
+            task.next_run_time = finish_time + task.task_interval
+        else:
+            next_run_time = task.next_run_time + task.task_interval
+            missed_runs = 0
+
+            if next_run_time <= finish_time:
+                missed_runs = int((finish_time - next_run_time)
+                                  / task.task_interval) + 1
+                task.skipped_count += missed_runs
+                next_run_time += missed_runs * task.task_interval
+
+            task.skips.append(missed_runs)
+            task.next_run_time = next_run_time
+
+        self.__condition__.acquire()
+        try:
+            self.__running_task__ = None
+
+            if not task.is_cancelled() and not self.__is_shutdown__:
+                self.__push__(task)
+        finally:
+            self.__condition__.release()
+
+    def __run__(self):
+        """
+        The scheduler thread.
+        """
+
+        while True:
+            task = self.__next_task__()
+
+            if task is None:
+                return
+
+            finish_time = self.__execute__(task)
+            self.__reschedule__(task, finish_time)
+
+
+__DEFAULT_SCHEDULER__ = None
+__DEFAULT_SCHEDULER_LOCK__ = threading.Lock()
+
+
+def get_scheduler():
+    """
+    Returns the scheduler shared by the whole application.
+    """
+
+    global __DEFAULT_SCHEDULER__
+
+    __DEFAULT_SCHEDULER_LOCK__.acquire()
+    try:
+        if __DEFAULT_SCHEDULER__ is None or __DEFAULT_SCHEDULER__.is_shutdown():
+            __DEFAULT_SCHEDULER__ = TaskScheduler()
+    finally:
+        __DEFAULT_SCHEDULER_LOCK__.release()
+
+    return __DEFAULT_SCHEDULER__
+
+
+def shutdown(timeout=DEFAULT_SHUTDOWN_TIMEOUT):
+    """
+    Stops the shared scheduler, if it was started.
+    """
+
+    if __DEFAULT_SCHEDULER__ is not None:
+        __DEFAULT_SCHEDULER__.shutdown(timeout)
+
+
+##############
+# UNIT TESTS #
+##############
+
+def test_fixed_rate():
+    """
+    Test that a fixed rate task runs on schedule.
+    """
+
+    scheduler = TaskScheduler()
+    runs = []
+    scheduler.schedule("test", 0.05, lambda: runs.append(time.time()))
+    time.sleep(0.27)
+    scheduler.shutdown()
+
+    assert len(runs) >= 5
+
+
+def test_overrun_is_skipped():
+    """
+    Test that a slow fixed rate task skips the runs it missed.
+    """
+
+    scheduler = TaskScheduler()
+    task = scheduler.schedule("slow", 0.05, lambda: time.sleep(0.12))
+    time.sleep(0.3)
+    scheduler.shutdown()
+
+    assert task.overrun_count >= 1
+    assert task.skipped_count >= 1
+    assert sum(task.skips.values()) == task.skipped_count
+
+
+def test_cancel():
+    """
+    Test that a cancelled task does not run again.
+    """
+
+    scheduler = TaskScheduler()
+    runs = []
+    task = scheduler.schedule("cancel", 0.05, lambda: runs.append(1))
+    time.sleep(0.12)
+    task.cancel()
+    count = len(runs)
+    time.sleep(0.12)
+    scheduler.shutdown()
+
+    assert len(runs) == count
+    assert scheduler.get_tasks() == []
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+
+    test_fixed_rate()
+    test_overrun_is_skipped()
+    test_cancel()
+
+    print "Tests finished"
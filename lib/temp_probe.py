@@ -1,8 +1,9 @@
 """ Module to deal with the SunFounder temperature probe. """
 
 import os
-import time
-import local_debug
+import threading
+import clock
+import hardware
 
 # ---------------------------------------------------------------
 # Note:
@@ -29,74 +30,386 @@ def celcius_to_farenheit(temp_in_celcius):
     return ((temp_in_celcius * 9.0) / 5.0) + 32.0
 
 
-def read_sensor(sensor_id):
+W1_DEVICES_DIRECTORY = "/sys/bus/w1/devices/"
+PROBE_PREFIX = "28-"
+BUS_MASTER_PREFIX = "w1_bus_master"
+BULK_READ_FILE = "therm_bulk_read"
+DEFAULT_RESCAN_INTERVAL = 300
+DEFAULT_RESOLUTION = 12
+
+# How long a conversion takes at each resolution (bits).
+# Each bit less halves the time and the precision.
+CONVERSION_SECONDS = {
+    9: 0.09375,
+    10: 0.1875,
+    11: 0.375,
+    12: 0.75
+}
+
+# therm_bulk_read reads -1 while the conversion is running
+BULK_READ_POLL_SECONDS = 0.01
+
+
+def parse_w1_slave(text):
     """
-    Reads temperature from sensor and prints to stdout
-    id is the id of the sensor.
+    Returns the temperature in C from the contents of a w1_slave
+    file, or None if the CRC failed or it could not be parsed.
 
-    >>> read_sensor(None)
-    >>> read_sensor("1")
+    >>> parse_w1_slave("72 01 4b 46 7f ff 0e 10 57 : crc=57 YES\\n"
+    ...                "72 01 4b 46 7f ff 0e 10 57 t=23125\\n")
+    23.125
+    >>> parse_w1_slave("72 01 4b 46 7f ff 0e 10 57 : crc=57 NO\\n"
+    ...                "72 01 4b 46 7f ff 0e 10 57 t=23125\\n")
+    >>> parse_w1_slave("")
     """
 
+    lines = text.split("\n")
+
+    if len(lines) < 2 or not lines[0].strip().endswith("YES"):
+        return None
+
+    temperature_start = lines[1].find("t=")
+
+    if temperature_start < 0:
+        return None
+
     try:
-        tfile = open("/sys/bus/w1/devices/" + sensor_id + "/w1_slave")
-        text = tfile.read()
-        tfile.close()
-        secondline = text.split("\n")[1]
-        temperaturedata = secondline.split(" ")[9]
-        temperature = float(temperaturedata[2:])
-        temperature = temperature / 1000
-        print "Sensor: " + sensor_id + " : %0.3f C" % temperature
-        print "Sensor: " + sensor_id + " : %0.3f F" % celcius_to_farenheit(temperature)
-
-        return celcius_to_farenheit(temperature)
-    except:
+        return float(lines[1][temperature_start + 2:]) / 1000.0
+    except ValueError:
         return None
 
 
-def read_sensors():
+class TemperatureProbes(object):
     """
-    Reads temperature from all sensors found in /sys/bus/w1/devices/
-    starting with "28-...
+    Reads all of the DS18B20 probes on the one wire bus.
+
+    The list of probes is cached and rescanned every
+    rescan_interval seconds. If the kernel supports it, all of
+    the probes are told to convert at once with therm_bulk_read,
+    otherwise each probe is read on its own thread. Either way
+    a read takes about one conversion time, not one per probe.
 
-    >>> read_sensors()
-    Drivers not available.
-    No sensors found! Check connection.
-    []
+    resolutions maps probe ids to 9 to 12 bits. Probes not in
+    it use default_resolution.
+
+    The files are read through sysfs, the SysfsFiles of the
+    hardware backend unless given.
     """
-    temperature_probe_values = []
 
-    if local_debug.is_debug():
-        return temperature_probe_values
+    def read(self):
+        """
+        Returns the temperature, in F, of every probe that could
+        be read, in the order of get_probe_ids.
+        """
 
-    try:
-        for driver_file in os.listdir("/sys/bus/w1/devices/"):
-            if driver_file.startswith("28-"):
-                try:
-                    probe_value = read_sensor(driver_file)
+        temperatures = self.read_probes()
+
+        return [celcius_to_farenheit(temperatures[probe_id])
+                for probe_id in self.get_probe_ids()
+                if temperatures.get(probe_id) is not None]
+
+    def read_probes(self):
+        """
+        Returns a dictionary of probe id to temperature in C,
+        or None for a probe that could not be read.
+        """
+
+        probe_ids = self.get_probe_ids()
+
+        if not probe_ids:
+            return {}
+
+        if self.__bulk_read_paths__ and self.__start_bulk_conversion__(probe_ids):
+            self.bulk_read_count += 1
+            return dict([(probe_id, self.read_probe(probe_id))
+                         for probe_id in probe_ids])
+
+        return self.__read_concurrently__(probe_ids)
+
+    def read_probe(self, probe_id):
+        """
+        Returns the temperature, in C, of one probe or None.
+        """
+
+        try:
+            return parse_w1_slave(self.__read_file__(
+                os.path.join(self.devices_directory, probe_id, "w1_slave")))
+        except (IOError, OSError):
+            return None
+
+    def get_probe_ids(self, force_rescan=False):
+        """
+        Returns the ids of the probes, scanning the bus if the
+        cached list is too old.
+        """
+
+        if force_rescan or self.__last_scan_time__ is None \
+                or clock.get_time() - self.__last_scan_time__ >= self.rescan_interval:
+            self.__scan__()
+
+        return self.__probe_ids__
+
+    def get_resolution(self, probe_id):
+        """
+        Returns the resolution, in bits, wanted for a probe.
+        """
+
+        return self.resolutions.get(probe_id, self.default_resolution)
+
+    def get_cycle_seconds(self):
+        """
+        Returns about how long a read of all of the probes takes.
+        """
+
+        resolutions = [self.get_resolution(probe_id)
+                       for probe_id in self.get_probe_ids()]
+
+        if not resolutions:
+            return 0.0
+
+        return max([CONVERSION_SECONDS.get(resolution, CONVERSION_SECONDS[12])
+                    for resolution in resolutions])
+
+    def __scan__(self):
+        """
+        Finds the probes and bus masters, and sets the resolution
+        of any probe that is new.
+        """
+
+        self.__last_scan_time__ = clock.get_time()
+
+        sysfs = self.__get_sysfs__()
+
+        try:
+            device_names = sorted(sysfs.list_directory(self.devices_directory))
+        except OSError:
+            device_names = []
+
+        probe_ids = [name for name in device_names
+                     if name.startswith(PROBE_PREFIX)]
+        self.__bulk_read_paths__ = [
+            os.path.join(self.devices_directory, name, BULK_READ_FILE)
+            for name in device_names
+            if name.startswith(BUS_MASTER_PREFIX)
+            and sysfs.exists(os.path.join(self.devices_directory, name,
+                                          BULK_READ_FILE))]
+
+        for probe_id in probe_ids:
+            if probe_id not in self.__probe_ids__:
+                self.__set_resolution__(probe_id, self.get_resolution(probe_id))
+
+        self.__probe_ids__ = probe_ids
+
+    def __set_resolution__(self, probe_id, resolution):
+        """
+        Writes the resolution to the probe. Older kernels
+        do not have the resolution file, and keep 12 bits.
+        """
+
+        resolution_path = os.path.join(self.devices_directory, probe_id,
+                                       "resolution")
+
+        try:
+            if self.__get_sysfs__().exists(resolution_path):
+                self.__write_file__(resolution_path, str(resolution))
+        except (IOError, OSError):
+            pass
+
+    def __start_bulk_conversion__(self, probe_ids):
+        """
+        Starts a conversion on every probe at once and waits for
+        it. Returns False if the bulk read failed.
+        """
+
+        try:
+            for bulk_read_path in self.__bulk_read_paths__:
+                self.__write_file__(bulk_read_path, "trigger")
+
+            # The write returns once the conversion is started
+            deadline = clock.get_time() + self.get_cycle_seconds() * 2 \
+                + BULK_READ_POLL_SECONDS
+
+            for bulk_read_path in self.__bulk_read_paths__:
+                while self.__read_file__(bulk_read_path).strip() == "-1":
+                    if clock.get_time() > deadline:
+                        return False
+
+                    clock.sleep(BULK_READ_POLL_SECONDS)
+        except (IOError, OSError):
+            return False
+
+        return True
+
+    def __read_concurrently__(self, probe_ids):
+        """
+        Reads each probe on its own thread, so their
+        conversions overlap.
+        """
+
+        temperatures = {}
 
-                    if probe_value is not None:
-                        temperature_probe_values.append(probe_value)
-                except:
-                    print "Failed to read sensor"
-    except:
-        print "Drivers not available."
+        def read_into(probe_id):
+            temperatures[probe_id] = self.read_probe(probe_id)
 
-    array_length = 0
-    if temperature_probe_values is not None:
-        array_length = len(temperature_probe_values)
+        threads = [threading.Thread(target=read_into, args=(probe_id,))
+                   for probe_id in probe_ids]
 
-    if array_length == 0:
-        print "No sensors found! Check connection."
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        return temperatures
+
+    def __read_file__(self, path):
+        return self.__get_sysfs__().read_file(path)
+
+    def __write_file__(self, path, text):
+        self.__get_sysfs__().write_file(path, text)
+
+    def __get_sysfs__(self):
+        """
+        Returns the files, from the hardware backend the
+        first time they are needed.
+        """
+
+        if self.__sysfs__ is None:
+            self.__sysfs__ = hardware.get_sysfs()
+
+        return self.__sysfs__
+
+    def __init__(self,
+                 devices_directory=W1_DEVICES_DIRECTORY,
+                 rescan_interval=DEFAULT_RESCAN_INTERVAL,
+                 default_resolution=DEFAULT_RESOLUTION,
+                 resolutions=None,
+                 sysfs=None):
+        self.devices_directory = devices_directory
+        self.__sysfs__ = sysfs
+        self.rescan_interval = rescan_interval
+        self.default_resolution = default_resolution
+        self.resolutions = resolutions if resolutions is not None else {}
+        self.bulk_read_count = 0
+        self.__probe_ids__ = []
+        self.__bulk_read_paths__ = []
+        self.__last_scan_time__ = None
+
+
+class ProbeRegistry(object):
+    """
+    Names the probes by their 1-Wire serial, so a probe keeps
+    its name no matter what order the bus lists them in.
+    Probes that are not named go by their serial.
+
+    >>> registry = ProbeRegistry([("Engine", "28-02"), ("Cabin", "28-01")])
+    >>> registry.get_ordered_ids(["28-01", "28-03", "28-02"])
+    ['28-02', '28-01', '28-03']
+    >>> registry.get_name("28-01"), registry.get_name("28-03")
+    ('Cabin', '28-03')
+    >>> registry.find_id("engine"), registry.find_id("28-03", ["28-03"])
+    ('28-02', '28-03')
+    >>> registry.find_id("Wing", ["28-03"])
+    >>> registry.get_primary_id(["28-01", "28-03"])
+    '28-01'
+    """
+
+    def get_name(self, probe_id):
+        """
+        Returns the configured name of a probe, or its serial.
+        """
+
+        return self.__names__.get(probe_id, probe_id)
+
+    def find_id(self, name, probe_ids=None):
+        """
+        Returns the serial of the probe with the name, or of
+        the named or found probe with the serial, ignoring case.
+        Returns None if there is no such probe.
+        """
+
+        name = name.strip().upper()
+
+        for probe_name, probe_id in self.named_probes:
+            if probe_name.upper() == name or probe_id.upper() == name:
+                return probe_id
+
+        for probe_id in probe_ids if probe_ids is not None else []:
+            if probe_id.upper() == name:
+                return probe_id
+
+        return None
+
+    def get_ordered_ids(self, probe_ids):
+        """
+        Returns the probes with the named ones first, in the
+        order they were configured, then the rest by serial.
+        """
+
+        named_ids = [probe_id for _, probe_id in self.named_probes
+                     if probe_id in probe_ids]
+
+        return named_ids + sorted([probe_id for probe_id in probe_ids
+                                   if probe_id not in self.__names__])
+
+    def get_primary_id(self, probe_ids):
+        """
+        Returns the probe that is "the temperature", or None.
+        """
+
+        ordered_ids = self.get_ordered_ids(probe_ids)
+
+        if not ordered_ids:
+            return None
+
+        return ordered_ids[0]
+
+    def __init__(self, named_probes=None):
+        """
+        named_probes is a list of (name, serial).
+        """
+
+        self.named_probes = named_probes if named_probes is not None else []
+        self.__names__ = dict([(probe_id, name) for name, probe_id in self.named_probes])
+
+
+__DEFAULT_PROBES__ = TemperatureProbes()
+
+
+def read_sensor(sensor_id):
+    """
+    Reads the temperature, in F, of one sensor.
+    id is the id of the sensor.
+
+    >>> read_sensor(None)
+    >>> read_sensor("1")
+    """
+
+    if sensor_id is None:
+        return None
+
+    temperature = __DEFAULT_PROBES__.read_probe(sensor_id)
+
+    if temperature is None:
+        return None
+
+    return celcius_to_farenheit(temperature)
+
+
+def read_sensors():
+    """
+    Reads temperature from all sensors found in /sys/bus/w1/devices/
+    starting with "28-...
+    """
 
-    return temperature_probe_values
+    return __DEFAULT_PROBES__.read()
 
 
 def loop():
     """ read temperature every second for all connected sensors """
     while True:
         read_sensors()
-        time.sleep(1)
+        clock.sleep(1)
 
 
 # Nothing to cleanup
@@ -2,189 +2,335 @@
 
 # encoding: UTF-8
 
-import time
-import Queue
-from multiprocessing import Queue as MPQueue
+import lib.clock as clock
 
 import text
 import lib.utilities as utilities
 from lib.relay import PowerRelay
+from lib.channel import Channel
+from lib.load_scheduler import LoadScheduler, LOAD_OFF
 
 
 class RelayManager(object):
     """
-    Class to command and control the power relay.
+    Class to command and control the power relays.
+
+    Each relay has a load (wattage) and its own shutoff timer.
+    A LoadScheduler decides which of the relays that have been
+    turned on are energized so the circuit is never overloaded.
+
+    Functions that take a relay_name act on every relay
+    when the name is None.
     """
 
-    def turn_on(self):
+    def turn_on(self, relay_name=None):
         """
         Tells the heater to turn on.
         """
 
-        if not self.is_relay_on():
-            self.__heater_queue__.put(text.HEATER_ON_COMMAND)
+        relay_names = [name for name in self.__get_relay_names__(relay_name)
+                       if not self.is_relay_on(name)]
+
+        if relay_names:
+            self.__heater_queue__.put((text.HEATER_ON_COMMAND, relay_names))
             return True
 
         return False
 
-    def turn_off(self):
+    def turn_off(self, relay_name=None):
         """
         Tells the heater to turn off.
         """
-        if self.is_relay_on():
-            self.__heater_queue__.put(text.HEATER_OFF_COMMAND)
+
+        relay_names = [name for name in self.__get_relay_names__(relay_name)
+                       if self.is_relay_on(name)]
+
+        if relay_names:
+            self.__heater_queue__.put((text.HEATER_OFF_COMMAND, relay_names))
             return True
 
         return False
 
-    def is_relay_on(self):
+    def is_relay_on(self, relay_name=None):
         """
         Get the status of the relay.
         True is "ON"
         False is "OFF"
+
+        A relay that has been turned on, but is waiting its
+        turn on the circuit, is "ON".
+
+        Uses the relay's cached state, so it is cheap to call.
         """
 
-        return self.__heater_relay__.get_io_pin_status() == 1
+        for name in self.__get_relay_names__(relay_name):
+            if self.__load_scheduler__.get_load(name).is_requested \
+                    or self.__relays__[name].get_io_pin_status() == 1:
+                return True
 
-    def get_heater_time_remaining(self):
+        return False
+
+    def get_relay_names(self):
+        """
+        Returns the names of the relays, in configuration order.
+        """
+
+        return list(self.__relay_names__)
+
+    def get_heater_time_remaining(self, relay_name=None):
         """
         Returns a string saying how much time is left
         for the heater.
         """
 
-        self.__logger__.log_info_message("get_heater_time_remaining()")
-
         time_remaining = ""
+        shutoff_times = [self.__shutoff_timers__[name]
+                         for name in self.__get_relay_names__(relay_name)
+                         if self.__shutoff_timers__[name] is not None]
 
-        if self.__heater_shutoff_timer__ is not None:
-            self.__logger__.log_info_message("timer is not None")
-            delta_time = self.__heater_shutoff_timer__ - time.time()
-            self.__logger__.log_info_message("Got the delta")
+        if shutoff_times:
+            delta_time = max(shutoff_times) - clock.get_time()
             time_remaining = utilities.get_time_text(delta_time)
-            self.__logger__.log_info_message("Got the text")
         else:
-            self.__logger__.log_info_message("No time")
             time_remaining = "No time"
 
-        self.__logger__.log_info_message("adding remaining")
         time_remaining += " left."
 
-        self.__logger__.log_info_message("Done")
-
         return time_remaining
 
+    def get_relay_status(self, relay_name):
+        """
+        Returns a line with the state and timer of the relay.
+        """
+
+        state = self.__load_scheduler__.get_load(relay_name).get_state()
+        status = relay_name + " " + state
+
+        if state != LOAD_OFF:
+            status += ", " + self.get_heater_time_remaining(relay_name)
+
+        return status
+
+    def get_channels(self):
+        """
+        Returns the channels that update() services.
+        """
+
+        return [self.__heater_queue__]
+
     def update(self):
         """
         Services the queue from the heater service thread.
         """
 
+        for relay in self.__relays__.values():
+            relay.update()
+
         self.__update_shutoff_timer__()
 
         # check the queue to deal with various issues,
         # such as Max heater time and the gas sensor being tripped
-        while not self.__heater_queue__.empty():
-            try:
-                status_queue = self.__heater_queue__.get()
+        for command, relay_names in self.__heater_queue__.drain():
+            if text.HEATER_ON_COMMAND == command:
+                self.__start_heater_immediate__(relay_names)
 
-                if text.HEATER_ON_COMMAND in status_queue:
-                    self.__start_heater_immediate__()
+            if text.HEATER_OFF_COMMAND == command:
+                self.__stop_heater_immediate__(relay_names)
 
-                if text.HEATER_OFF_COMMAND in status_queue:
-                    self.__stop_heater_immediate__()
+            if text.MAX_TIME == command:
+                self.__max_time_immediate__(relay_names)
 
-                if text.MAX_TIME in status_queue:
-                    self.__max_time_immediate__()
-            except Queue.Empty:
-                pass
+        self.__apply_load_schedule__()
 
     def __init__(self,
                  configuration,
                  logger,
                  heater_on_callback,
                  heater_off_callback,
-                 heater_max_time_callback):
-        """ Initialize the object. """
+                 heater_max_time_callback,
+                 series_store=None,
+                 heater_rejected_callback=None):
+        """
+        Initialize the object.
+        The callbacks are given the list of relay names they apply to.
+        heater_rejected_callback is given the relays that were not
+        turned on because they draw more than the load budget.
+        Relay states are recorded in the series store, if one is given.
+        """
 
         self.__configuration__ = configuration
+        self.__series_store__ = series_store
         self.__logger__ = logger
         self.__on_callback__ = heater_on_callback
         self.__off_callback__ = heater_off_callback
         self.__max_time_callback__ = heater_max_time_callback
+        self.__rejected_callback__ = heater_rejected_callback
+        self.__heater_queue__ = Channel()
+        self.__load_scheduler__ = LoadScheduler(
+            configuration.load_budget_watts,
+            configuration.relay_stagger_seconds,
+            configuration.duty_cycle_minutes * 60)
+        self.__relays__ = {}
+        self.__relay_names__ = []
+
+        # Holds when each relay must be shut off.
+        self.__shutoff_timers__ = {}
+
+        # create a relay instance for each load
+        for relay_definition in configuration.relays:
+            relay = PowerRelay(
+                relay_definition.name, relay_definition.pin,
+                state_changed_callback=self.__relay_settled__,
+                mismatch_callback=self.__relay_mismatch__)
+
+            self.__relays__[relay.name] = relay
+            self.__relay_names__.append(relay.name)
+            self.__shutoff_timers__[relay.name] = None
+            self.__load_scheduler__.add_load(relay.name,
+                                             relay_definition.watts)
+
+            # make sure and turn heater off
+            relay.switch_low()
+
+    def __get_relay_names__(self, relay_name):
+        """
+        Returns the list of names a relay_name argument refers to.
+        """
+
+        if relay_name is None:
+            return self.__relay_names__
+
+        return [relay_name]
+
+    def __relay_settled__(self, relay, pin_status):
+        """
+        Called once a relay has settled after being switched.
+        """
+
+        self.__logger__.log_info_message(
+            relay.name + " settled at " + str(pin_status))
+
+        if self.__series_store__ is not None:
+            self.__series_store__.add("RELAY_" + relay.name.upper(), pin_status)
+
+    def __relay_mismatch__(self, relay, expected_status, pin_status):
+        """
+        Called when the pin does not match what was last written.
+        Writes the expected state again. The relay backs off
+        the next check while the pin keeps disagreeing.
+        """
+
+        self.__logger__.log_warning_message(
+            relay.name + " pin is " + str(pin_status)
+            + ", expected " + str(expected_status) + ". Rewriting (attempt "
+            + str(relay.mismatch_count) + ").")
+
+        relay.rewrite()
 
-        # create heater relay instance
-        self.__heater_relay__ = PowerRelay(
-            "heater_relay", configuration.heater_pin)
-        self.__heater_queue__ = MPQueue()
+    def __apply_load_schedule__(self):
+        """
+        Switches the relays the load scheduler has decided on.
+        """
 
-        # create queue to hold heater timer.
-        self.__heater_shutoff_timer__ = None
+        for relay_name, is_energized in self.__load_scheduler__.update(clock.get_time()):
+            self.__logger__.log_info_message(
+                "Load schedule: " + relay_name + " "
+                + (text.HEATER_ON_COMMAND if is_energized else text.HEATER_OFF_COMMAND)
+                + ", " + str(self.__load_scheduler__.get_used_watts()) + "W in use.")
 
-        # make sure and turn heater off
-        self.__heater_relay__.switch_low()
+            if is_energized:
+                self.__relays__[relay_name].switch_high()
+            else:
+                self.__relays__[relay_name].switch_low()
 
-    def __max_time_immediate__(self):
+    def __max_time_immediate__(self, relay_names):
         """
         Trigger everything associated with the timer
         being triggered.
         """
         if self.__max_time_callback__ is not None:
-            self.__max_time_callback__()
+            self.__max_time_callback__(relay_names)
 
-        self.__stop_heater__()
+        self.__stop_heater__(relay_names)
 
-    def __stop_heater_immediate__(self):
+    def __stop_heater_immediate__(self, relay_names):
         """
         Turn off the heater.
         """
         if self.__off_callback__ is not None:
-            self.__off_callback__()
+            self.__off_callback__(relay_names)
 
-        self.__stop_heater__()
+        self.__stop_heater__(relay_names)
 
-    def __start_heater_immediate__(self):
+    def __start_heater_immediate__(self, relay_names):
         """
         Start the heater.
+        Only the relays the load scheduler accepted are reported as on.
         """
-        if self.__on_callback__ is not None:
-            self.__on_callback__()
+        started_relay_names = self.__start_heater__(relay_names)
+        rejected_relay_names = [relay_name for relay_name in relay_names
+                                if relay_name not in started_relay_names]
 
-        self.__start_heater__()
+        if started_relay_names and self.__on_callback__ is not None:
+            self.__on_callback__(started_relay_names)
 
-    def __stop_heater__(self):
+        if rejected_relay_names and self.__rejected_callback__ is not None:
+            self.__rejected_callback__(rejected_relay_names)
+
+    def __stop_heater__(self, relay_names):
         """
         Stops the heater.
+        The relay is switched off even if the load scheduler
+        does not think it is energized.
         """
-        self.__logger__.log_info_message("__stop_heater__::switch_low()")
-        self.__heater_relay__.switch_low()
-        self.__logger__.log_info_message(
-            "__stop_heater__::stop_heater_timer()")
-        self.__stop_heater_timer__()
+        current_time = clock.get_time()
 
-    def __start_heater__(self):
+        for relay_name in relay_names:
+            self.__logger__.log_info_message(
+                "__stop_heater__::switch_low(" + relay_name + ")")
+            self.__load_scheduler__.release(relay_name, current_time)
+            self.__relays__[relay_name].switch_low()
+            self.__stop_heater_timer__(relay_name)
+
+    def __start_heater__(self, relay_names):
         """
         Starts the heater.
+        The load scheduler decides when the relay is switched on.
+        Returns the relays it accepted.
         """
-        self.__logger__.log_info_message("__start_heater__::switch_high()")
-        self.__heater_relay__.switch_high()
-        self.__logger__.log_info_message(
-            "__start_heater__::start_heater_timer()")
-        self.__start_heater_timer__()
+        current_time = clock.get_time()
+        started_relay_names = []
+
+        for relay_name in relay_names:
+            if not self.__load_scheduler__.request(relay_name, current_time):
+                self.__logger__.log_warning_message(
+                    relay_name + " draws more than the "
+                    + str(self.__load_scheduler__.budget_watts) + "W budget.")
+                continue
 
-    def __stop_heater_timer__(self):
+            self.__logger__.log_info_message(
+                "__start_heater__::start_heater_timer(" + relay_name + ")")
+            self.__start_heater_timer__(relay_name)
+            started_relay_names.append(relay_name)
+
+        return started_relay_names
+
+    def __stop_heater_timer__(self, relay_name):
         """
         Stops the heater timer.
         """
 
         self.__logger__.log_info_message(
-            "Cancelling the heater shutoff timer.")
-        self.__heater_shutoff_timer__ = None
+            "Cancelling the " + relay_name + " shutoff timer.")
+        self.__shutoff_timers__[relay_name] = None
 
-    def __start_heater_timer__(self):
+    def __start_heater_timer__(self, relay_name):
         """
         Starts the shutdown timer for the heater.
         """
-        self.__logger__.log_info_message("Starting the heater shutoff timer.")
-        self.__heater_shutoff_timer__ = time.time(
+        self.__logger__.log_info_message(
+            "Starting the " + relay_name + " shutoff timer.")
+        self.__shutoff_timers__[relay_name] = clock.get_time(
         ) + (self.__configuration__.max_minutes_to_run * 60)
 
         return True
@@ -195,11 +341,24 @@ class RelayManager(object):
         If so, then add it to the action.
         """
 
-        if self.__heater_shutoff_timer__ is not None \
-                and self.__heater_shutoff_timer__ < time.time():
-            self.__heater_queue__.put(text.MAX_TIME)
-        elif self.__heater_shutoff_timer__ is None \
-                and self.is_relay_on():
+        current_time = clock.get_time()
+        expired_relays = []
+        stray_relays = []
+
+        for relay_name in self.__relay_names__:
+            shutoff_timer = self.__shutoff_timers__[relay_name]
+
+            if shutoff_timer is not None and shutoff_timer < current_time:
+                expired_relays.append(relay_name)
+            elif shutoff_timer is None \
+                    and self.__relays__[relay_name].get_io_pin_status() == 1:
+                stray_relays.append(relay_name)
+
+        if expired_relays:
+            self.__heater_queue__.put((text.MAX_TIME, expired_relays))
+
+        if stray_relays:
             self.__logger__.log_warning_message(
-                "Heater should not be on, but the PIN is still active... attempting shutdown.")
-            self.__heater_queue__.put(text.HEATER_OFF_COMMAND)
+                ", ".join(stray_relays) + " should not be on, but the PIN"
+                + " is still active... attempting shutdown.")
+            self.__heater_queue__.put((text.HEATER_OFF_COMMAND, stray_relays))
@@ -5,6 +5,8 @@ Module to hold common text messages and strings.
 MAX_TIME = "MAX_TIME"
 GAS_WARNING = "Gas warning"
 GAS_OK = "OK"
+LIGHTS_ON = "Hangar lights turned ON"
+LIGHTS_OFF = "Hangar lights turned OFF"
 CHECK_SIGNAL = "SIGNAL"
 CHECK_BATTERY = "BATTERY"
 ERROR = "ERROR"
@@ -24,3 +26,6 @@ UPTIME_COMMAND = "UPTIME"
 CELL_STATUS_COMMAND = "SIGNAL"
 GAS_COMMAND = "GAS"
 HEATER_COMMAND = "HEATER"
+STATS_COMMAND = "STATS"
+TREND_COMMAND = "TREND"
+DAILY_COMMAND = "DAILY"